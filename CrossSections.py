@@ -12,16 +12,26 @@
 # This code relies on ArcPy, ArcGIS Pro's proprietary coding language. In the comment section, explanations, as well as justifications, for decisions is provided. 
 # Last updated on 12/15/2021
 
-from arcpy import env
-import arcpy
+import os
+
+from feature_store import FeatureTable, read_features, write_features, thin_profiles
+from cross_section_geometry import extend_lines, polyline_segments, offset_segments
+from profile_sampler import sample_profiles, write_profile_csvs
+from profile_store import write_profiles
+from artifact_cache import cached_arrays, cached_features, fingerprint
+from stage_trace import traced, lap
+from arcpy_backend import load_arcpy, use_workspace, workspace_path
 # import sys
 # import time
 
-# Set the workplace to the ArcGIS Pro database 
-arcpy.env.workspace = r"I:\Thesis\Thesis\Near_Brush_Creek.gdb"
+# ArcPy is only imported by the functions that use it (see arcpy_backend.py), and the ArcGIS Pro database is passed to them as workspace, so this file can be
+# imported (e.g. by cliff_pipeline.py's workers) without starting ArcPy or running anything. The run lines are at the bottom.
 
 # "Thin_it_out" function to create greater spacing in CliffMetrics outputs to increase processing speed of the erosion model 
-def thin_it_out(normals, toe_pts, top_pts, tag): # (normals shapefile, toe points shapefile, top points shapefile, tag (string of characters) to be added to all outputs for organization)
+@traced()
+def thin_it_out(normals, toe_pts, top_pts, tag, workspace=None): # (normals shapefile, toe points shapefile, top points shapefile, tag (string of characters) to be added to all outputs for organization,
+                                                                 # ArcGIS Pro database (None: ArcPy's current workspace))
+    arcpy = load_arcpy(workspace)
 
     # Iterate through normals and keep one in every 15
     with arcpy.da.UpdateCursor(normals, "OBJECTID") as cursor: # Create cursor for OBJECTID because each OBJECTID is unique (no duplicates)
@@ -81,12 +91,32 @@ def thin_it_out(normals, toe_pts, top_pts, tag): # (normals shapefile, toe point
     # For the top points, Delete stupid fields
     arcpy.management.DeleteField(top_thin, "nCoast;nProf;bisOK;CliffTopEl;Chainage")
 
-# thin_it_out("normals", "cliff_toe", "cliff_top", "Ophir_Beach") # this line of code will run the function. All other lines of code to run functions must be commented out. 
 
-# "Extend_cross_sections" function will extend cross sections 450 meters landward and 20 meters oceanward. 
-def extend_cross_sections(normals, coast, tag): # (normals from previous function shapefile, coastline shapefile, tag (string of characters) to add to all outputs)
+# Faster version of thin_it_out. Each input is read once into arrays (feature_store.py), the profiles to keep are picked with array operations and the thinned 
+# features are written once to new feature classes with OBJECTIDs 1, 2, 3, ... and without the unneeded fields (no deleteRow, CopyFeatures or DeleteField).
+# Unlike thin_it_out, the profiles are picked on the normals ("Normal") and the toe and top points of the same profiles ("nProf") are kept, so all three outputs 
+# line up. Every stride-th profile is kept (15, like thin_it_out), or with spacing (meters), profiles about that far apart along the coast. The inputs are not changed.
+@traced()
+def thin_it_out_fast(normals, toe_pts, top_pts, tag, stride=15, spacing=None, workspace=None): # (normals, toe points, top points, tag (string of characters) to be added to all outputs, 
+                                                                                # keep every stride-th profile, or keep profiles this many meters apart along the coast, ArcGIS Pro database)
+    use_workspace(workspace)
+    normals_table, (toe_table, top_table) = thin_profiles(read_features(normals), [read_features(toe_pts), read_features(top_pts)], stride, spacing)
+
+    # Write the outputs, without the fields thin_it_out deletes
+    write_features(normals_table.select_fields(drop=["ORIG_FID", "Normal", "StartCoast", "EndCoast", "HitLand", "HitCoast", "HitNormal", "nCoast"]), "normals_thin" + "_" + str(tag))
+    write_features(toe_table.select_fields(drop=["nCoast", "nProf", "bisOK", "CoastEl", "CliffToeEl"]), "toe_thin" + "_" + str(tag))
+    write_features(top_table.select_fields(drop=["nCoast", "nProf", "bisOK", "CliffTopEl", "Chainage"]), "top_thin" + "_" + str(tag))
+
+
+# Lines 450 meters landward and 20 meters oceanward of the coastline, used by extend_cross_sections and extend_cross_sections_fast to know how far to extend the normals.
+# Returns the name of the line feature class ("merged_buffer_erase"); the other scratch layers ("land_buffer", "land_line", "beach_buffer", "beach_line" and 
+# "merge_buffer") are left for the caller to delete.
+@traced()
+def buffer_lines(coast): # (coastline shapefile)
+    import arcpy
     
     # First, create land buffer that is 450 meters inland from the coastline shapefile
+    lap("land_buffer")
     land_buffer = "land_buffer" # Create name for land buffer polygon shapefile output
     if arcpy.Exists(land_buffer) == 1: # Check to see if name already exists
         arcpy.Delete_management(land_buffer) # If so, delete that shapefile 
@@ -99,12 +129,14 @@ def extend_cross_sections(normals, coast, tag): # (normals from previous functio
                                                                                                         #"Geodesic": (shape preserving) — All buffers will be created using a shape-preserving geodesic buffer method, regardless of the input coordinate system. 
 
     #Next, turn land buffer polygon shapefile into line shapefile
+    lap("land_line")
     land_line = "land_line" # Create name for land buffer line shapefile output
     if arcpy.Exists(land_line) == 1: # Check to see if name already exists
         arcpy.Delete_management(land_line) # If so, delete that shapefile 
     arcpy.management.PolygonToLine(land_buffer, land_line, "IGNORE_NEIGHBORS") #"IGNORE_NEIGHBORS": doesnt identify and store neighbouring information 
 
     # Next, create beach buffer 
+    lap("beach_buffer")
     beach_buffer = "beach_buffer" # Create name for beach buffer polygon shapefile output
     if arcpy.Exists(beach_buffer) == 1:  # Check to see if name already exists
         arcpy.Delete_management(beach_buffer) # If so, delete that shapefile
@@ -118,25 +150,46 @@ def extend_cross_sections(normals, coast, tag): # (normals from previous functio
 
 
     #Next, turn beach buffer into line 
+    lap("beach_line")
     beach_line = "beach_line" # Create name for beach buffer line shapefile output
     if arcpy.Exists(beach_line) == 1: # Check to see if name already exists
         arcpy.Delete_management(beach_line) # If so, delete that shapefile 
     arcpy.management.PolygonToLine(beach_buffer, beach_line, "IGNORE_NEIGHBORS") #"IGNORE_NEIGHBORS": doesnt identify and store neighbouring information 
 
     # Merge land and beach buffer line shapefiles 
+    lap("merge")
     merge_buffer = "merge_buffer" # Create name for merged buffer lines shapefile output
     if arcpy.Exists(merge_buffer) == 1: # Check to see if name already exists
         arcpy.Delete_management(merge_buffer) # If so, delete that shapefile 
     arcpy.management.Merge(beach_line + ";" + land_line, merge_buffer) # Merge the land buffer line and beach buffer line into one shapefile
 
     # Delete middle line shared between both buffer line shapefiles 
+    lap("erase")
     merged_buffer_erase = "merged_buffer_erase" # Create name for merged buffer lines shapefile output with middle line erased
     if arcpy.Exists(merged_buffer_erase) == 1:  # Check to see if name already exists
         arcpy.Delete_management(merged_buffer_erase) # If so, delete that shapefile 
     arcpy.analysis.Erase(merge_buffer, coast, merged_buffer_erase, None)    # Erase shared line between land and beach buffer line shapefile
                                                                             # "None": The minimum distance separating all feature coordinates (nodes and vertices) as well as the distance a coordinate can move in X or Y (or both). 
 
+    return merged_buffer_erase
+
+# Delete the scratch layers made by buffer_lines
+def delete_buffer_lines():
+    import arcpy
+    for layer in ("beach_buffer", "beach_line", "land_buffer", "land_line", "merge_buffer", "merged_buffer_erase"):
+        if arcpy.Exists(layer) == 1: # check to see if file exists
+            arcpy.management.Delete(layer)
+
+# "Extend_cross_sections" function will extend cross sections 450 meters landward and 20 meters oceanward. 
+@traced()
+def extend_cross_sections(normals, coast, tag, workspace=None): # (normals from previous function shapefile, coastline shapefile, tag (string of characters) to add to all outputs,
+                                                                # ArcGIS Pro database (None: ArcPy's current workspace))
+    arcpy = load_arcpy(workspace)
+
+    merged_buffer_erase = buffer_lines(coast) # lines 450 meters landward and 20 meters oceanward of the coast
+
     # Create new feature class for final cross sections 
+    lap("create_feature_class")
     final_CS = "final_CS" + "_" + str(tag) # Create name for final cross sections 
     if arcpy.Exists(final_CS) == 1: # Check to see if name already exists
         arcpy.Delete_management(final_CS) # If so, delete that shapefile 
@@ -151,19 +204,23 @@ def extend_cross_sections(normals, coast, tag): # (normals from previous functio
             object_id = line[0] # "OBJECTID" is the first item in the list
 
             # Make layer with that normal 
+            lap("select", items=1) # one per cross section
             single_CS = "single_CS" # create new name for single CS layer
             if arcpy.Exists(single_CS) == 1: # check to see if name already exists
                 arcpy.Delete_management(single_CS) # if so, delete it (after the first iteration, it will delete the previous iteration layer)
             arcpy.management.MakeFeatureLayer(normals, single_CS, "OBJECTID = " + str(object_id)) # Create layer by using query selecting the normal with the objectid of interest
         
             # Merged corrected buffer with normals 
+            lap("merge")
             merge_CS_buffer= "merge_CS_buffer" # create name for shapefile that is product of merging of normals and buffer polylines
             if arcpy.Exists(merge_CS_buffer) == 1: # check to see if file exists
                 arcpy.Delete_management(merge_CS_buffer) # if so, delete that file
             arcpy.management.Merge(str(single_CS)+";"+str(merged_buffer_erase) , merge_CS_buffer) # Merge buffer polylines with normals 
         
+            lap("extend_line")
             arcpy.edit.ExtendLine(merge_CS_buffer, "10000 Meters", "EXTENSION") #"10000 Meters": choose a distance that's well beyond how far it will take for the normals to hit the buffer polyline 
             
+            lap("delete_parts")
             with arcpy.da.UpdateCursor(merge_CS_buffer, "OBJECTID") as cursor: # Create cursor for OBJECTID because each OBJECTID is unique (no duplicates)
                 for parts in cursor: # search through cursor 
                     object_id = parts[0] # "OBJECTID" is the first item in the list
@@ -171,9 +228,11 @@ def extend_cross_sections(normals, coast, tag): # (normals from previous functio
                     if object_id != 1: # check to see if OBJECTID is equal to 1
                         cursor.deleteRow() # if not, delete
         
+            lap("append")
             arcpy.management.Append(merge_CS_buffer, final_CS, "NO_TEST") # Append cross section to final cross section feature class 
 
     # Copy lines to "reset" object ids
+    lap("copy")
     extended_normals = "extended_normals" + str(tag) # create new name for extended normals
     if arcpy.Exists(extended_normals) == 1: # see if file already exists
         arcpy.Delete_management(extended_normals) # if so, delete old file 
@@ -182,28 +241,68 @@ def extend_cross_sections(normals, coast, tag): # (normals from previous functio
                                                                                     #: None: This parameter has been deprecated in ArcGIS Pro. Any value you enter is ignored. 
                                                                                     #: None: This parameter has been deprecated in ArcGIS Pro. Any value you enter is ignored. 
     # Take out the trash 
-    arcpy.management.Delete(beach_buffer)
-    arcpy.management.Delete(beach_line)
-    arcpy.management.Delete(land_buffer)
-    arcpy.management.Delete(land_line)
-    arcpy.management.Delete(merge_buffer)
-    arcpy.management.Delete(merged_buffer_erase)    
+    lap("trash")
+    delete_buffer_lines()
+
+
+# "Extend_cross_sections_fast" does the same as "extend_cross_sections" for all normals at once (see cross_section_geometry.py): the normals and the buffer lines are
+# read into arrays, the buffer line segments are put in a grid index and both ends of every normal are extended along their end segments to the nearest buffer line
+# within 10000 meters, like ExtendLine "EXTENSION". Ends that hit nothing are left as they are. The output has the same name and, like the original, no attributes.
+# With parallel_offsets=True the 450 m / 20 m lines are offset from the coastline in NumPy instead of made with the ArcPy buffers (mitred corners instead of round 
+# ones, and the line is not clipped where the two offsets cross, so only use it for coastlines without sharp bends).
+# With cache (a folder, see artifact_cache.py), the buffer line segments are kept under a hash of the coastline and the extended normals under a hash of the normals,
+# the buffer lines and max_distance, so a rerun with the same inputs skips the buffers and the ray casting, and a rerun with another max_distance or other normals
+# reuses the buffer lines.
+@traced()
+def extend_cross_sections_fast(normals, coast, tag, parallel_offsets=False, max_distance=10000, cache=None, workspace=None): # (normals shapefile, coastline shapefile, tag, offset in NumPy, 
+                                                                                                                            # search distance in meters, artifact cache folder, ArcGIS Pro database)
+    use_workspace(workspace)
+
+    lap("buffer_lines")
+    coast_table = read_features(coast, [])
+    if parallel_offsets:
+        def build_segments(): # 450 meters to the right (landward) and 20 meters to the left (oceanward) of the coastline
+            return dict(zip(("x0", "y0", "x1", "y1"), offset_segments(coast_table, (450, -20))))
+    else:
+        def build_segments():
+            merged_buffer_erase = buffer_lines(coast) # lines 450 meters landward and 20 meters oceanward of the coast
+            segments = polyline_segments(read_features(merged_buffer_erase, []))
+            delete_buffer_lines() # Take out the trash 
+            return dict(zip(("x0", "y0", "x1", "y1"), segments))
+    segments_key = fingerprint("buffer_lines", coast_table.fingerprint(), parallel_offsets, (450, -20))
+    segments = cached_arrays(cache, segments_key, build_segments)
+
+    normals_table = read_features(normals, [])
+    lap("extend", items=len(normals_table))
+    def build_extended():
+        extended, start_hit, end_hit = extend_lines(normals_table, [segments[name] for name in ("x0", "y0", "x1", "y1")], max_distance)
+        extended.fields = {"start_hit": start_hit, "end_hit": end_hit} # kept for the report below, not written
+        return extended
+    extended = cached_features(cache, fingerprint("extended_normals", normals_table.fingerprint(), segments_key, max_distance), build_extended)
+
+    lap("write")
+    extended_normals = "extended_normals" + str(tag) # create new name for extended normals
+    write_features(extended.select_fields(keep=[]), extended_normals) # replaced if it already exists
+    print(str(int(extended.fields["start_hit"].sum())) + " start points and " + str(int(extended.fields["end_hit"].sum())) + " end points of " + str(len(extended)) + " normals extended")
 
-#extend_cross_sections("normals", "coast_Clip", "Near_Brush_Creek") #This line of code will run the "extend_cross_sections" function, make sure all other lines of code running other functions are commented out
 
 #This function "gets the good stuff" (aka the final cross sections for the physics based model)
-def get_the_good_stuff(normals, DEM, tag): # normals from the "extend_cross_sections" function 
+@traced()
+def get_the_good_stuff(normals, DEM, tag, workspace=None): # normals from the "extend_cross_sections" function (and the ArcGIS Pro database, None: ArcPy's current workspace)
+    arcpy = load_arcpy(workspace)
 
     with arcpy.da.SearchCursor(normals, "OBJECTID") as cursor: # Create cursor for OBJECTID because each OBJECTID is unique (no duplicates)
         
         for row in cursor: #search through cursor
             
             row_ID = row[0] # first item in the list is the OBJECTID
+            lap("select", items=1) # one per cross section
             cross_section = "cross_section" #name of the cross section layer
             if arcpy.Exists(cross_section) == 1: # check to see if file already exists
                 arcpy.Delete_management(cross_section) #if so, delete the file 
             arcpy.management.MakeFeatureLayer(normals, cross_section, "OBJECTID = " + str(row_ID)) # make a layer (or individual shapefile) by querying for that OBJECTID number
             
+            lap("generate_points")
             points = "points" # name of the points file
             if arcpy.Exists(points) == 1: # check to see if file already exists
                 arcpy.Delete_management(points) # if so, delete old file
@@ -212,8 +311,10 @@ def get_the_good_stuff(normals, DEM, tag): # normals from the "extend_cross_sect
                                                                                                                             # "None": The percentage from the beginning of the feature at which points will be placed. For example, if a percentage of 40 is used, points will be placed at 40 percent and 80 percent of the feature's distance.
                                                                                                                             # "END_POINTS": Additional points will be included at the start point and end point of the feature.                      
             
+            lap("add_xy")
             arcpy.management.AddXY(points) # Adds X and Y data based on the coordinate system of the inputs 
 
+            lap("add_surface_information")
             arcpy.ddd.AddSurfaceInformation(points, DEM, "Z", "BILINEAR", None, 1, 0, '')   # AddSurfaceInformation tool adds elevation data to shapefiles (e.g. points)
                                                                                             # "Z": The surface z-values interpolated for the x,y-location of each single-point feature will be added.
                                                                                             # "BILINEAR": An interpolation method exclusive to the raster surface which determines cell values from the four nearest cells will be used. This is the only option available for a raster surface.
@@ -222,10 +323,55 @@ def get_the_good_stuff(normals, DEM, tag): # normals from the "extend_cross_sect
                                                                                             # "0": The z-tolerance or window-size resolution of the terrain pyramid level that will be used. 0 is full resolution 
                                                                                             # '': Noise filtering, Specifies whether portions of the surface that are potentially characterized by anomalous measurements will be excluded from contributing to slope calculations.
 
+            lap("table_to_excel")
             excel = str(tag) + "_CSV" + str(row_ID-1) # create name for final CSV of X,Y and Z data for each cross section 
             if arcpy.Exists(excel) == 1: # check to see if file already exists
                 arcpy.Delete_management(excel) # if so, delete the old file 
             arcpy.conversion.TableToExcel(points, excel, "NAME", "CODE")    # "NAME": Column headers will be set using the input's field names. 
                                                                             # "CODE": All field values will be used as they are stored in the table. 
 
-# get_the_good_stuff("extended_normals_Near_Brush_Creek", "Near_Brush_Creek_full_m", "Near_Brush_Creek") # This line of code runs the "get_the_good_stuff" function
\ No newline at end of file
+
+# Lines or points as a FeatureTable (feature_store.py): a FeatureTable is used as it is and a .npz file saved from one is loaded, both without ArcPy; anything else is
+# a feature class read with ArcPy (names looked up in workspace). fields: attribute fields read from a feature class (None for all of them)
+def feature_table(features, workspace=None, fields=None):
+    if isinstance(features, FeatureTable):
+        return features
+    if str(features).lower().endswith(".npz"):
+        return FeatureTable.load(features)
+    use_workspace(workspace)
+    return read_features(features, fields)
+
+
+# "Get_the_good_stuff_fast" does the same as "get_the_good_stuff" for all cross sections at once (see profile_sampler.py): the stations every meter (plus the end
+# points) of every cross section are generated as one set of arrays and Z is interpolated (bilinear) from the DEM reading only the blocks of the DEM the cross 
+# sections cross. All profiles are written to one profile store, the folder <tag>_profiles in out_folder (see profile_store.py: X, Y, Z and distance of every point
+# with an index of where each cross section starts, loaded with ProfileStore). With csvs=True one .csv per cross section is written too (<tag>_CSV<n>.csv with 
+# OBJECTID, ORIG_FID, POINT_X, POINT_Y and Z, n = OBJECTID - 1 of the cross section as the normals from "extend_cross_sections"/"extend_cross_sections_fast" are 
+# numbered from 1). out_folder defaults to the folder holding the workspace.
+# The normals can also be a FeatureTable or a .npz file saved from one and the DEM a .npy or GeoTIFF grid: with those and an out_folder, ArcPy is not imported.
+@traced()
+def get_the_good_stuff_fast(normals, DEM, tag, out_folder=None, spacing=1, csvs=False, workspace=None): # (normals from the "extend_cross_sections" function, DEM raster, tag, folder for the outputs, 
+                                                                                                        # station spacing in meters, also write .csv files, ArcGIS Pro database)
+    if out_folder is None:
+        out_folder = os.path.dirname(workspace if workspace is not None else load_arcpy().env.workspace) # next to the geodatabase
+    dem = workspace_path(DEM, workspace) # files are kept, other names are rasters in the workspace
+    lap("read_normals")
+    lines = feature_table(normals, workspace)
+    lap("sample_profiles", items=len(lines))
+    columns, offsets = sample_profiles(lines, dem, spacing) # stations and Z of every cross section
+    lap("write_profiles")
+    store = write_profiles(os.path.join(out_folder, str(tag) + "_profiles"), columns, offsets, meta={"tag": str(tag), "spacing": spacing, "spatial_reference": lines.spatial_reference})
+    if csvs:
+        lap("write_csvs", items=offsets.size - 1)
+        write_profile_csvs(columns, offsets, out_folder, tag)
+    print(str(offsets.size - 1) + " cross sections (" + str(offsets[-1]) + " points) written to " + str(store))
+
+
+if __name__ == "__main__": # only runs when this file is run as a script, not when it is imported. Uncomment the line of the function to run, make sure all other lines are commented out.
+    workspace = r"I:\Thesis\Thesis\Near_Brush_Creek.gdb" # ArcGIS Pro database
+    # thin_it_out("normals", "cliff_toe", "cliff_top", "Ophir_Beach", workspace=workspace)
+    # thin_it_out_fast("normals", "cliff_toe", "cliff_top", "Ophir_Beach", workspace=workspace)
+    # extend_cross_sections("normals", "coast_Clip", "Near_Brush_Creek", workspace=workspace)
+    # extend_cross_sections_fast("normals", "coast_Clip", "Near_Brush_Creek", workspace=workspace)
+    # get_the_good_stuff("extended_normals_Near_Brush_Creek", "Near_Brush_Creek_full_m", "Near_Brush_Creek", workspace=workspace)
+    # get_the_good_stuff_fast("extended_normals_Near_Brush_Creek", "Near_Brush_Creek_full_m", "Near_Brush_Creek", workspace=workspace)
@@ -28,29 +28,44 @@
 # covers the entire world, however xGeoid20 covers from 0 to 82 degrees north and 180 to 10 degrees west. Therefore this is also the extent of the TSS grid. 
 
 
-from arcpy import env
-import arcpy
 # import sys
 # import time
 import math 
+import os
+import shutil
+import tempfile
 import numpy as np
 
+from grid_io import open_grid, common_grids, common_windows, GridWindow, OutputGrid
+from grid_align import align_grids, aligned_grid, target_grid
+from grid_algebra import evaluate_tiled_many, Product, Placed
+from band_scheduler import run_bands
+from offshore_mask import cached_offshore_mask, PackedMask
+from rasterize import polygon_mask, read_polygons
+from stage_trace import traced, lap, stage
+from arcpy_backend import load_arcpy, use_workspace
 
-# Set the workspace to the ArcGIS Pro project geodatabase
-arcpy.env.workspace = r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\TSS_final.gdb"
 
+# ArcPy is only imported by the functions that use it (see arcpy_backend.py), and the ArcGIS Pro project geodatabase is passed to them as workspace, so this file
+# can be imported (e.g. by band_scheduler.py's workers) without starting ArcPy or running anything. The run lines are at the bottom.
 
-def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generates MSS grids based on the extents provided by the inputs 
+
+@traced()
+def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag, workspace=None): # this code generates MSS grids based on the extents provided by the inputs 
                                                             # (CNES' MSS grid, conversion grid from topex poseidon to WGS 84, conversion grid from mean tide to tide free, a land polygon 
-                                                            # covering area NOT of interest, tag (string of characters) to be added to outputs to distinguish)
+                                                            # covering area NOT of interest, tag (string of characters) to be added to outputs to distinguish,
+                                                            # ArcGIS Pro project geodatabase (None: ArcPy's current workspace))
+    arcpy = load_arcpy(workspace)
 
     # Create polygon shapefile covering the extent of CNES' MSS 
+    lap("CNES_domain")
     CNES_domain = "CNES_domain" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(CNES_domain) == 1: # see if shapefile already exists
         arcpy.Delete_management(CNES_domain) # if so, delete old shapefile
     arcpy.ddd.RasterDomain(CNES, CNES_domain, "POLYGON") # "POLYGON": The output will be a z-enabled polygon feature class.
 
     # Create polygon shapefile covering the extent of the matlab inputs 
+    lap("matlab_domain")
     matlab_domain = "matlab_domain" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(matlab_domain) == 1: # see if shapefile already exists
         arcpy.Delete_management(matlab_domain) # if so, delete old shapefile
@@ -58,6 +73,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
                                                             # note that either TP_WGS or MT_FT can be used
 
     #Find intersect between extent of CNES' MSS and the matlab inputs 
+    lap("intersect")
     intersect = "intersect" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(intersect) == 1: # see if shapefile already exists
         arcpy.Delete_management(intersect) # if so, delete old shapefile
@@ -68,6 +84,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
 
 
     # Create buffer around land shapefile to delineate between onshore and offshore extents 
+    lap("buffer")
     buffer = "buffer" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(buffer) == 1: # see if shapefile already exists
         arcpy.Delete_management(buffer)# if so, delete old shapefile
@@ -81,6 +98,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
 
 
     # Create final extent by removing areas not of interest (e.g. land and nearshore extents)
+    lap("erase")
     final_mask = "final_mask" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(final_mask) == 1: # see if shapefile already exists
         arcpy.Delete_management(final_mask) # if so, delete old shapefile
@@ -89,6 +107,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
 
 
     # Crop CNES to the final mask extent 
+    lap("extract_CNES")
     final_CNES = "final_CNES" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_CNES) == 1: # see if raster already exists
         arcpy.Delete_management(final_CNES) # if so, delete old raster
@@ -96,6 +115,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
     out_raster_CNES.save(final_CNES) # save the output from tool above
 
     # Crop conversion grid from topex poseidon to WGS84 to final mask extent
+    lap("extract_TP_WGS")
     final_TP_WGS = "final_TP_WGS" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_TP_WGS) == 1: # see if raster already exists
         arcpy.Delete_management(final_TP_WGS) # if so, delete old raster
@@ -103,6 +123,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
     out_raster_TP_WGS.save(final_TP_WGS) # save the output from tool above
         
     # Crop conversion grid from mean tide to tide free to final mask extent
+    lap("extract_MT_FT")
     final_MT_FT = "final_MT_FT" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_MT_FT) == 1: # see if raster already exists
         arcpy.Delete_management(final_MT_FT) # if so, delete old raster
@@ -110,6 +131,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
     out_raster_MT_FT.save(final_MT_FT) # save the output from tool above
 
     # Use raster calculator to generate the final TSS grid
+    lap("raster_calculator")
     raster = "raster" + "_" + str(tag) # create name for raster
     if arcpy.Exists(raster) == 1: # see if raster already exists
         arcpy.Delete_management(raster) # if so, delete old raster
@@ -118,6 +140,7 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
     output_raster.save(raster) # save output 
 
     # Take out the trash 
+    lap("trash")
     arcpy.management.Delete(CNES_domain)
     arcpy.management.Delete(matlab_domain)
     arcpy.management.Delete(buffer)
@@ -126,14 +149,61 @@ def MSS_generation(CNES, TP_WGS, MT_FT, land_polygon, tag): # this code generate
     arcpy.management.Delete(final_TP_WGS)
     arcpy.management.Delete(final_MT_FT)
 
-# MSS_generation(r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\Raw_Data\MSS.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\tp_wgs_xGeoid20_2.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\mt_tf_xGeoid20.tif", "aggregate_land", "MSS_extentxGeoid20") # this line of code will run the "MSS_generation" function. 
+
+# NumPy version of MSS_generation. The inputs are not cropped to the final mask with ExtractByMask (which writes a masked copy of every input). Instead:
+# the common extent of the three grids is found from their georeferencing (they must share the 1/60 degree cells), the offshore mask is built on that grid and 
+# "a+b+c" is evaluated tile by tile straight into the output grid, with the mask applied to each tile. Tiles that are completely on land are skipped.
+# The offshore mask replaces the global 9000 Meters Buffer and Erase: the land polygon is rasterized onto the grid once and every cell further than buffer_distance
+# from land (distance transform that accounts for the cell size shrinking with latitude, see offshore_mask.py) is kept. 
+# The output is written to output (a geodatabase raster, "raster_<tag>" by default, a memory mapped ".npy" grid, or a ".tif": an internally tiled, compressed
+# GeoTIFF with overviews, see tiled_tiff.py, so other tools can read just the tiles and the resolution they need).
+# With mask_cache (a folder), the offshore mask is kept on disk and reused by later MSS and TSS runs with the same land polygon, distance, grid and coverage, 
+# instead of being rebuilt and deleted every time. mask_cache is an artifact cache (artifact_cache.py), so the same folder can be shared with calculate_RMSE.py
+# and CrossSections.py.
+# With resample ("nearest" or "bilinear"), inputs do not need to share CNES' cells: they are resampled on the fly onto CNES' cells inside the common coverage of all
+# three grids (see grid_align.py), and the resampling plans are kept in mask_cache too, so a new geoid or conversion grid release needs no manual resampling.
+# With workers, the grid is produced in latitude bands by that many processes (see band_scheduler.py). Geodatabase outputs are then filled in a .npy file in scratch 
+# (a temporary folder by default) first. An interrupted parallel run can be finished with resume=True: the bands it completed are not computed again.
+@traced()
+def MSS_generation_numpy(CNES, TP_WGS, MT_FT, land_polygon, tag, output=None, tile_size=1024, buffer_distance=9000.0, mask_cache=None, resample=None, 
+                         workers=None, band_rows=None, resume=False, scratch=None, workspace=None): 
+    # (CNES' MSS grid, conversion grid from topex poseidon to WGS 84, conversion grid from mean tide to tide free, land polygon (feature class or list of (label, rings) polygons), 
+    # tag (string of characters) to be added to outputs to distinguish, output raster, tile edge in cells, offshore distance in meters, folder of the mask and resampling cache,
+    # resampling of inputs that do not line up with CNES' MSS grid: None (they must line up), "nearest" or "bilinear", number of processes (None: no parallel bands), 
+    # rows per latitude band, finish an interrupted parallel run, folder for the .npy files of geodatabase outputs in parallel runs, ArcGIS Pro project geodatabase that 
+    # geodatabase names are looked up in (None: ArcPy's current workspace; not needed, and ArcPy not imported, for .npy/.tif grids and polygon lists))
+    output = output if output is not None else "raster" + "_" + str(tag)
+    run_job(MSS_job, dict(CNES=CNES, TP_WGS=TP_WGS, MT_FT=MT_FT, land_polygon=land_polygon, output=output, buffer_distance=buffer_distance, mask_cache=mask_cache, 
+                          resample=resample, workspace=workspace), tag, tile_size, workers, band_rows, resume, scratch)
+
+# Set up MSS_generation_numpy (see run_job): inputs, offshore mask, output and the product evaluated into it
+def MSS_job(CNES, TP_WGS, MT_FT, land_polygon, output, buffer_distance, mask_cache, resample, scratch, mode="r+", workspace=None):
+    use_workspace(workspace) # also in band workers, which set the job up again
+    lap("grids")
+    grids = [open_grid(CNES), open_grid(TP_WGS), open_grid(MT_FT)]
+    grid_CNES, grid_TP_WGS, grid_MT_FT = common_grids(grids) if resample is None else align_grids(grids, resample, mask_cache) # replaces RasterDomain and Intersect: the cells all three grids cover
+    definition = grid_CNES.definition
+
+    # Offshore mask: cells more than 9 km (buffer_distance) from land, replaces Buffer and Erase
+    lap("offshore_mask")
+    offshore = cached_offshore_mask(land_polygon, definition, buffer_distance, cache=mask_cache) # 8 cells per byte
+
+    # CNES MSS + conversion from topex poseidon to WGS 84 + conversion from mean tide to tide free, evaluated tile by tile straight into the output
+    lap("outputs")
+    raster = OutputGrid(output, definition, mode=mode, scratch=scratch)
+    inputs = {"a": grid_CNES, "b": grid_TP_WGS, "c": grid_MT_FT}
+    return [Product("a+b+c", raster.array, offshore, names=inputs)], inputs, [raster], definition.shape
 
 # The "TSS_generation" function creates TSS grids based on the extents provided by the inputs. 
-def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): # (CNES' MSS raster, xGeoid20 raster, conversion grid from topex poseidon to WGS 84,
+@traced()
+def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect, workspace=None): # (CNES' MSS raster, xGeoid20 raster, conversion grid from topex poseidon to WGS 84,
 #                                                                             # conversion grid from mean tide to tide free, a poylgon shapefile covering land not to be included
-#                                                                             # tag (string of characters) to be added to ouputs for organization, polygon shapefile covering intersection of CNES' MSS and xGeoid20)
+#                                                                             # tag (string of characters) to be added to ouputs for organization, polygon shapefile covering intersection of CNES' MSS and xGeoid20,
+#                                                                             # ArcGIS Pro project geodatabase (None: ArcPy's current workspace))
+    arcpy = load_arcpy(workspace)
 
     # Create polygon shapefile for buffer around land shapefile 
+    lap("buffer")
     buffer = "buffer" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(buffer) == 1: # check to see if it already exists
         arcpy.Delete_management(buffer) # if so, delete old shapefile 
@@ -147,6 +217,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
 
 
     # Create final mask that reflects area not of interest (e.g. buffer around land shapefile) from extent 
+    lap("erase")
     final_mask = "final_mask" + "_" + str(tag) # create name for shapefile
     if arcpy.Exists(final_mask) == 1: # check to see if it already exists
         arcpy.Delete_management(final_mask) # if so, delete old shapefile 
@@ -155,6 +226,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
 
 
     # Create raster that crops CNES' MSS grid to the final mask extent 
+    lap("extract_CNES")
     final_CNES = "final_CNES" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_CNES) == 1: # check to see if it already exists
         arcpy.Delete_management(final_CNES) # if so, delete old raster 
@@ -162,6 +234,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
     out_raster_CNES.save(final_CNES) #save output
     
     # Create raster that crops the Geoid grid to the final mask extent 
+    lap("extract_Geoid")
     final_Geoid = "final_Geoid" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_Geoid) == 1: # check to see if it already exists
         arcpy.Delete_management(final_Geoid) # if so, delete old raster 
@@ -169,6 +242,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
     out_raster_Geoid.save(final_Geoid) # save output
 
     # Create raster that crops the conversion from topex poseidon to WGS84 grid to the final mask extent 
+    lap("extract_TP_WGS")
     final_TP_WGS = "final_TP_WGS" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_TP_WGS) == 1: # check to see if it already exists
         arcpy.Delete_management(final_TP_WGS) # if so, delete old raster 
@@ -176,6 +250,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
     out_raster_TP_WGS.save(final_TP_WGS) # save output
         
     # Create raster that crops the conversion from mean tide to tide free to the final mask extent 
+    lap("extract_MT_FT")
     final_MT_FT = "final_MT_FT" + "_" + str(tag) # create name for raster
     if arcpy.Exists(final_MT_FT) == 1: # check to see if it already exists
         arcpy.Delete_management(final_MT_FT) # if so, delete old raster 
@@ -183,6 +258,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
     out_raster_MT_FT.save(final_MT_FT) # save output
 
     # Use raster calculator to generate TSS grid
+    lap("raster_calculator")
     raster = "raster" + "_" + str(tag) # create name for raster
     if arcpy.Exists(raster) == 1: # check to see if it already exists
         arcpy.Delete_management(raster) # if so, delete old raster 
@@ -191,6 +267,7 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
     output_raster.save(raster) # save output from raster calculator 
 
     # Take out the trash 
+    lap("trash")
     arcpy.management.Delete(buffer)
     arcpy.management.Delete(final_mask)
     arcpy.management.Delete(final_CNES)
@@ -198,4 +275,131 @@ def TSS_generation(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect): #
     arcpy.management.Delete(final_TP_WGS)
     arcpy.management.Delete(final_MT_FT)
 
-# TSS_generation(r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\Raw_Data\MSS.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\Raw_Data\xGeoid20.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\tp_wgs_xGeoid20_2.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\mt_tf_xGeoid20.tif", "aggregate_land", "xGeoid20_agg", "xGeoid20_RD") # this line of code will run the "TSS_generation" function.
\ No newline at end of file
+
+# NumPy version of TSS_generation, see MSS_generation_numpy. The common extent of the four grids replaces the manual intersect of CNES' MSS and xGeoid20 
+# (cells where xGeoid20 has no data stay NoData in the output); if an intersect polygon is still given, the output is limited to it as well.
+@traced()
+def TSS_generation_numpy(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect=None, output=None, tile_size=1024, buffer_distance=9000.0, mask_cache=None, resample=None, 
+                         workers=None, band_rows=None, resume=False, scratch=None, workspace=None): 
+    # (CNES' MSS raster, xGeoid20 raster, conversion grid from topex poseidon to WGS 84, conversion grid from mean tide to tide free, land polygon, 
+    # tag (string of characters) to be added to outputs for organization, optional intersect polygon, output raster, tile edge in cells, offshore distance in meters, 
+    # folder of the mask and resampling cache, resampling of inputs that do not line up with the xGeoid20 grid: None (they must line up), "nearest" or "bilinear",
+    # number of processes (None: no parallel bands), rows per latitude band, finish an interrupted parallel run, folder for the .npy files of geodatabase outputs,
+    # ArcGIS Pro project geodatabase (see MSS_generation_numpy))
+    output = output if output is not None else "raster" + "_" + str(tag)
+    run_job(TSS_job, dict(CNES=CNES, Geoid=Geoid, TP_WGS=TP_WGS, MT_FT=MT_FT, land_polygon=land_polygon, intersect=intersect, output=output, buffer_distance=buffer_distance, 
+                          mask_cache=mask_cache, resample=resample, workspace=workspace), tag, tile_size, workers, band_rows, resume, scratch)
+
+# Set up TSS_generation_numpy (see run_job). The grids and the offshore mask are set up like MSS_TSS_job (TSS_grids), so land just outside the xGeoid20 extent
+# still counts and both give the same TSS grid.
+def TSS_job(CNES, Geoid, TP_WGS, MT_FT, land_polygon, intersect, output, buffer_distance, mask_cache, resample, scratch, mode="r+", workspace=None):
+    use_workspace(workspace) # also in band workers, which set the job up again
+    (grid_CNES, grid_TP_WGS, grid_MT_FT), grid_Geoid, TSS_window, MSS_offshore, TSS_offshore = TSS_grids(CNES, Geoid, TP_WGS, MT_FT, land_polygon, intersect, 
+                                                                                                          buffer_distance, mask_cache, resample)
+    definition = grid_Geoid.definition
+
+    # xGeoid20 - CNES MSS - conversion from topex poseidon to WGS 84 - conversion from mean tide to tide free, evaluated tile by tile straight into the output
+    lap("outputs")
+    raster = OutputGrid(output, definition, mode=mode, scratch=scratch)
+    inputs = {"a": grid_Geoid, "b": GridWindow(grid_CNES, *TSS_window), "c": GridWindow(grid_TP_WGS, *TSS_window), "d": GridWindow(grid_MT_FT, *TSS_window)} # TSS cells of the MSS grids
+    return [Product("a-b-c-d", raster.array, TSS_offshore, names=inputs)], inputs, [raster], definition.shape
+
+# Combined MSS and TSS production. CNES' MSS and the two conversion grids are inputs to both equations, so instead of two runs that each read and mask them, 
+# both grids are produced in one tiled pass: every tile of every input is read once and shared by the two equations. The MSS covers the cells of CNES' MSS and the 
+# conversion grids (the whole world), the TSS covers the part of those cells xGeoid20 also covers (and the intersect polygon, if one is given). The offshore mask 
+# is built once on the MSS grid and cut to the TSS extent, so land just outside the xGeoid20 extent still counts.
+@traced()
+def MSS_TSS_generation_numpy(CNES, Geoid, TP_WGS, MT_FT, land_polygon, tag, intersect=None, MSS_output=None, TSS_output=None, tile_size=1024, buffer_distance=9000.0, mask_cache=None, 
+                             resample=None, workers=None, band_rows=None, resume=False, scratch=None, workspace=None): 
+    # (CNES' MSS raster, xGeoid20 raster, conversion grid from topex poseidon to WGS 84, conversion grid from mean tide to tide free, land polygon, tag (string of characters) to be added 
+    # to outputs, optional intersect polygon, MSS output ("raster_MSS_<tag>" by default), TSS output ("raster_TSS_<tag>" by default), tile edge in cells, offshore distance in meters, 
+    # folder of the mask and resampling cache, resampling of inputs that do not line up with CNES' MSS grid: None (they must line up), "nearest" or "bilinear",
+    # number of processes (None: no parallel bands), rows per latitude band, finish an interrupted parallel run, folder for the .npy files of geodatabase outputs,
+    # ArcGIS Pro project geodatabase (see MSS_generation_numpy))
+    MSS_output = MSS_output if MSS_output is not None else "raster_MSS" + "_" + str(tag)
+    TSS_output = TSS_output if TSS_output is not None else "raster_TSS" + "_" + str(tag)
+    run_job(MSS_TSS_job, dict(CNES=CNES, Geoid=Geoid, TP_WGS=TP_WGS, MT_FT=MT_FT, land_polygon=land_polygon, intersect=intersect, MSS_output=MSS_output, TSS_output=TSS_output, 
+                              buffer_distance=buffer_distance, mask_cache=mask_cache, resample=resample, workspace=workspace), tag, tile_size, workers, band_rows, resume, scratch)
+
+# Set up MSS_TSS_generation_numpy (see run_job)
+def MSS_TSS_job(CNES, Geoid, TP_WGS, MT_FT, land_polygon, intersect, MSS_output, TSS_output, buffer_distance, mask_cache, resample, scratch, mode="r+", workspace=None):
+    use_workspace(workspace) # also in band workers, which set the job up again
+    (grid_CNES, grid_TP_WGS, grid_MT_FT), grid_Geoid, TSS_window, MSS_offshore, TSS_offshore = TSS_grids(CNES, Geoid, TP_WGS, MT_FT, land_polygon, intersect, 
+                                                                                                          buffer_distance, mask_cache, resample)
+    MSS_definition, TSS_definition = grid_CNES.definition, grid_Geoid.definition
+
+    # Both equations over the MSS extent, every input tile is read once
+    lap("outputs")
+    MSS_raster = OutputGrid(MSS_output, MSS_definition, mode=mode, scratch=scratch)
+    TSS_raster = OutputGrid(TSS_output, TSS_definition, mode=mode, scratch=scratch)
+    inputs = {"cnes": grid_CNES, "tp_wgs": grid_TP_WGS, "mt_ft": grid_MT_FT, "geoid": Placed(grid_Geoid, TSS_window[0], TSS_window[1])} # xGeoid20 only covers the TSS extent
+    products = [Product("cnes+tp_wgs+mt_ft", MSS_raster.array, MSS_offshore, names=inputs), # CNES MSS + conversion from topex poseidon to WGS 84 + conversion from mean tide to tide free
+                Product("geoid-cnes-tp_wgs-mt_ft", TSS_raster.array, TSS_offshore, TSS_window, names=inputs)] # xGeoid20 - CNES MSS - conversion from topex poseidon to WGS 84 - conversion from mean tide to tide free
+    return products, inputs, [MSS_raster, TSS_raster], MSS_definition.shape
+
+# MSS and TSS extents of MSS_TSS_job and TSS_job: the three MSS grids on the MSS extent (the cells CNES' MSS and the conversion grids cover), xGeoid20 on the TSS
+# extent (the MSS cells xGeoid20 also covers), the TSS extent as a window of the MSS extent, and the offshore masks of both extents. The offshore mask is built on the
+# MSS grid and then cut to the TSS extent (and the intersect polygon), so land just outside the xGeoid20 extent still counts, like the Buffer around land_polygon.
+def TSS_grids(CNES, Geoid, TP_WGS, MT_FT, land_polygon, intersect, buffer_distance, mask_cache, resample):
+    lap("grids")
+    grids = [open_grid(CNES), open_grid(TP_WGS), open_grid(MT_FT)]
+    grid_CNES, grid_TP_WGS, grid_MT_FT = common_grids(grids) if resample is None else align_grids(grids, resample, mask_cache) # MSS extent: the cells the three shared inputs cover
+    MSS_definition = grid_CNES.definition
+    grid_Geoid = open_grid(Geoid)
+    if resample is None:
+        TSS_window, Geoid_window = common_windows([MSS_definition, grid_Geoid.definition]) # TSS extent inside the MSS extent, and the same cells in xGeoid20
+        TSS_definition = MSS_definition.window(*TSS_window)
+        grid_Geoid = grid_Geoid.window(*Geoid_window)
+    else: # TSS extent: the MSS cells inside the xGeoid20 coverage, xGeoid20 resampled onto them
+        TSS_definition = target_grid([MSS_definition, grid_Geoid.definition])
+        TSS_window = common_windows([MSS_definition, TSS_definition])[0]
+        grid_Geoid = aligned_grid(grid_Geoid, TSS_definition, resample, mask_cache)
+
+    # Offshore masks: built once on the MSS grid, then cut to the TSS extent (and the intersect polygon)
+    lap("offshore_mask")
+    MSS_offshore = cached_offshore_mask(land_polygon, MSS_definition, buffer_distance, cache=mask_cache)
+    TSS_offshore = MSS_offshore.read(*TSS_window)
+    if intersect is not None:
+        TSS_offshore &= polygon_mask(intersect, TSS_definition)
+    TSS_offshore = PackedMask(TSS_offshore)
+    return (grid_CNES, grid_TP_WGS, grid_MT_FT), grid_Geoid, TSS_window, MSS_offshore, TSS_offshore
+
+# Run a job set up by MSS_job, TSS_job or MSS_TSS_job: job(**arguments, scratch, mode) returns (products, inputs, output grids, shape of the tiled area).
+# Without workers, everything is evaluated in one tiled pass in this process. With workers, the area is split into latitude bands evaluated by a process pool that 
+# writes into the same memory mapped outputs (band_scheduler.py); each worker sets the job up again from the arguments, so polygons are read here once and handed 
+# over as lists, and the offshore masks are cached (in scratch if there is no mask_cache) so workers load them instead of building them again.
+def run_job(job, arguments, tag, tile_size=1024, workers=None, band_rows=None, resume=False, scratch=None):
+    use_workspace(arguments.get("workspace"))
+    if workers is None:
+        with stage("set_up"):
+            products, inputs, rasters, shape = job(scratch=None, mode="w+", **arguments)
+        with stage("evaluate", items=shape[0] * shape[1]): # items: cells of the tiled area
+            evaluate_tiled_many(products, inputs, shape, tile_size)
+    else:
+        temporary = scratch is None # own scratch folder, removed once the outputs are saved
+        scratch = scratch if scratch is not None else os.path.join(tempfile.gettempdir(), "MSS_TSS_" + str(tag)) # same folder for a resumed run
+        os.makedirs(scratch, exist_ok=True)
+        arguments = dict(arguments, scratch=scratch)
+        for name in ("land_polygon", "intersect"): # read feature classes once
+            if isinstance(arguments.get(name), str):
+                arguments[name] = read_polygons(arguments[name])
+        if arguments["mask_cache"] is None:
+            arguments["mask_cache"] = os.path.join(scratch, "cache")
+        with stage("set_up"):
+            products, inputs, rasters, shape = job(mode="r+" if resume else "w+", **arguments)
+        with stage("evaluate_bands", items=shape[0] * shape[1]):
+            run_bands(job, arguments, (products, inputs), shape, band_rows, tile_size, workers, rasters[0].file + ".progress", resume)
+    with stage("save"):
+        for raster in rasters: # save outputs
+            raster.close()
+    if workers is not None and temporary:
+        # The run is complete (nothing left to resume): delete the working copies of .tif and geodatabase outputs and the mask cache kept in the temporary scratch
+        # folder, which for global grids take about a gigabyte per output. A run that fails leaves them for resume=True; a scratch folder passed in is kept.
+        del products, inputs, rasters # memory maps into the folder
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__": # only runs when this file is run as a script, not when it is imported. Uncomment the line of the function to run.
+    workspace = r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\TSS_final.gdb" # ArcGIS Pro project geodatabase
+    # MSS_generation(r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\Raw_Data\MSS.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\tp_wgs_xGeoid20_2.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\mt_tf_xGeoid20.tif", "aggregate_land", "MSS_extentxGeoid20", workspace=workspace) # this line of code will run the "MSS_generation" function. 
+    # TSS_generation(r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\Raw_Data\MSS.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\Raw_Data\xGeoid20.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\tp_wgs_xGeoid20_2.tif", r"C:\Users\herrmanj\Desktop\NOAA\TSS_final\mt_tf_xGeoid20.tif", "aggregate_land", "xGeoid20_agg", "xGeoid20_RD", workspace=workspace) # this line of code will run the "TSS_generation" function.
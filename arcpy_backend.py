@@ -0,0 +1,30 @@
+# ArcPy as an optional backend of calculate_RMSE.py, MSS_TSS_final.py and CrossSections.py.
+# Importing ArcPy takes seconds and needs a licensed ArcGIS Pro install, so no module imports it when it is loaded: the NumPy paths (.npy and GeoTIFF grids, lists
+# of polygons, FeatureTables) never touch it, and ArcPy is only imported by the functions that read or write geodatabases or run geoprocessing tools. Worker
+# processes that only do array math therefore start without it.
+# The workspace (the geodatabase that dataset names are looked up in and scratch layers are written to) is passed to each function instead of being set when a
+# script is imported. Without one, ArcPy's current workspace is used.
+
+import os
+
+
+# ArcPy, with its workspace set to workspace if one is given
+def load_arcpy(workspace=None):
+    import arcpy
+    if workspace is not None:
+        arcpy.env.workspace = workspace
+    return arcpy
+
+
+# Set the ArcPy workspace if one is given; without one ArcPy is not even imported
+def use_workspace(workspace):
+    if workspace is not None:
+        load_arcpy(workspace)
+
+
+# Full path of a dataset: paths of files on disk are kept, names are looked up in workspace (ArcPy's current workspace if None)
+def workspace_path(name, workspace=None):
+    name = str(name)
+    if os.path.isabs(name) or os.path.exists(name):
+        return name
+    return os.path.join(workspace if workspace is not None else load_arcpy().env.workspace, name)
@@ -0,0 +1,204 @@
+# Shared on-disk cache of intermediate results (artifacts) for calculate_RMSE.py, MSS_TSS_final.py and CrossSections.py: offshore masks, resampling plans, AOI
+# zone grids, buffer lines, extended normals, ... Instead of deleting every intermediate in a "Take out the trash" block and computing it again on the next run, each
+# one is stored under a content hash (fingerprint) of everything it was computed from: the contents of its inputs and its parameters. A run with the same inputs
+# and parameters gets the stored result back; a run with one parameter changed only recomputes the artifacts whose key includes that parameter (and the ones built
+# from them, since their keys include the keys of what they were built from).
+# Each entry is a folder named after its key, written to a temporary folder first and then renamed into place, so a run that is interrupted (or two runs writing the
+# same entry at the same time) never leave a half written entry behind. meta.json is written last and marks an entry as complete.
+# The cache is bounded: entries not used for max_age seconds are deleted, then the least recently used ones until the cache fits in max_bytes.
+# grid_cache.GridCache (arrays saved as memory mapped .npy files) is an ArtifactCache, so all three scripts can share one cache folder.
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+
+# Content hash (hex) of any mix of numbers, strings, None, bytes, NumPy arrays, lists/tuples (including GridDefinition) and dicts
+def fingerprint(*parts):
+    digest = hashlib.sha256()
+    update_fingerprint(digest, parts)
+    return digest.hexdigest()
+
+
+def update_fingerprint(digest, value):
+    if isinstance(value, np.ndarray):
+        digest.update(b"array" + str(value.dtype).encode() + str(value.shape).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"list" + str(len(value)).encode())
+        for item in value:
+            update_fingerprint(digest, item)
+    elif isinstance(value, dict):
+        digest.update(b"dict" + str(len(value)).encode())
+        for key in sorted(value, key=str):
+            update_fingerprint(digest, str(key))
+            update_fingerprint(digest, value[key])
+    elif isinstance(value, bytes):
+        digest.update(b"bytes" + str(len(value)).encode() + value)
+    else: # numbers, strings, None (repr keeps 1 and "1" apart)
+        text = repr(value).encode()
+        digest.update(b"value" + str(len(text)).encode() + text)
+
+
+class ArtifactCache:
+
+    def __init__(self, directory, max_bytes=8 * 1024 ** 3, max_age=None): # (folder holding the cache, largest total size in bytes, seconds an unused entry is kept (None: no limit))
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key): # folder of an entry
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key): # (folder, meta) of a complete entry, or None if it is not cached
+        entry = self.path(key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError): # missing, evicted in the meantime or damaged
+            return None
+        self.touch(entry)
+        return entry, meta
+
+    def store(self, key, write, meta=None): # write(folder) fills a new entry with its files; returns (folder, meta) of the stored entry
+        entry = self.path(key)
+        staging = entry + ".tmp-" + uuid.uuid4().hex # unique temporary folder, renamed into place once complete
+        os.makedirs(staging)
+        try:
+            write(staging)
+            meta = dict(meta or {})
+            meta["created"] = time.time()
+            with open(os.path.join(staging, "meta.json"), "w") as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(staging, entry) # atomic: other runs see either no entry or the complete one
+        except OSError: # another run stored the same entry first; theirs is identical
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.exists(os.path.join(entry, "meta.json")):
+                raise
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+        return self.lookup(key) or (entry, meta)
+
+    def fetch(self, key, write, meta=None): # (folder, meta) of the entry, stored with write(folder) first if it is not cached
+        return self.lookup(key) or self.store(key, write, meta)
+
+    def touch(self, entry): # mark an entry as just used (for least recently used and age eviction)
+        try:
+            os.utime(os.path.join(entry, "meta.json"))
+        except OSError:
+            pass
+
+    def entries(self): # (last used time, size in bytes, key) of every complete entry
+        found = []
+        for key in os.listdir(self.directory):
+            entry = self.path(key)
+            meta = os.path.join(entry, "meta.json")
+            if ".tmp-" in key or not os.path.exists(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, name)) for root, folders, names in os.walk(entry) for name in names)
+            found.append((os.path.getmtime(meta), size, key))
+        return found
+
+    def evict(self, keep=None): # delete entries older than max_age, then least recently used entries until the cache fits in max_bytes (never the entry "keep")
+        now = time.time()
+        for key in os.listdir(self.directory): # temporary folders of runs that died while storing (a day old)
+            if ".tmp-" in key and now - os.path.getmtime(self.path(key)) > 86400:
+                shutil.rmtree(self.path(key), ignore_errors=True)
+        found = sorted(self.entries())
+        total = sum(size for used, size, key in found)
+        for used, size, key in found:
+            too_old = self.max_age is not None and now - used > self.max_age
+            if total <= self.max_bytes and not too_old:
+                continue
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+
+
+# An ArtifactCache from a folder name, or the cache itself (None stays None: no caching)
+def as_artifact_cache(cache):
+    if cache is None or isinstance(cache, ArtifactCache):
+        return cache
+    return ArtifactCache(cache)
+
+
+# Arrays (name -> array) returned by build(), stored in the cache under key as .npy files and memory mapped when they are taken from it. cache is an ArtifactCache,
+# a folder name or None (build() every time).
+def cached_arrays(cache, key, build, meta=None):
+    cache = as_artifact_cache(cache)
+    if cache is None:
+        return build()
+    def write(folder):
+        for name, array in build().items():
+            np.save(os.path.join(folder, name + ".npy"), array)
+    entry, meta = cache.fetch(key, write, meta)
+    return {os.path.basename(name)[:-len(".npy")]: np.load(name, mmap_mode="r") for name in sorted(glob.glob(os.path.join(entry, "*.npy")))}
+
+
+# FeatureTable (feature_store.py) returned by build(), stored in the cache under key as a .npz file
+def cached_features(cache, key, build, meta=None):
+    from feature_store import FeatureTable
+    cache = as_artifact_cache(cache)
+    if cache is None:
+        return build()
+    entry, meta = cache.fetch(key, lambda folder: build().save(os.path.join(folder, "features.npz")), meta)
+    return FeatureTable.load(os.path.join(entry, "features.npz"))
+
+
+# Size and modification time of a file and of its sidecars
+def file_signature(path):
+    files = sorted(set(glob.glob(glob.escape(os.path.splitext(path)[0]) + ".*")) | {path})
+    return fingerprint([(os.path.basename(name), os.path.getsize(name), os.stat(name).st_mtime_ns) for name in files if os.path.isfile(name)])
+
+
+# Names, sizes and modification times of the files of the file geodatabase (.gdb folder) a dataset is in, None for other workspaces (enterprise geodatabases)
+def geodatabase_files(path):
+    folder = path
+    while not folder.lower().endswith(".gdb"):
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+    if not os.path.isdir(folder):
+        return None
+    names = sorted(name for name in os.listdir(folder) if os.path.isfile(os.path.join(folder, name)) and not name.endswith(".lock"))
+    return [(name, os.path.getsize(os.path.join(folder, name)), os.stat(os.path.join(folder, name)).st_mtime_ns) for name in names]
+
+
+# Fingerprint of the contents of an input dataset, to key the artifacts built from it. Files on disk: size and modification time of the file and of its sidecars
+# (same name, other extensions: .dbf/.shx of a shapefile, .json of a .npy grid, ...). Feature classes in a geodatabase: the features themselves
+# (feature_store.read_features). Rasters in a geodatabase are not read: they are keyed on what ArcPy describes (extent, cell size, shape, pixel type, spatial
+# reference, band statistics) and on the sizes and modification times of the files of a file geodatabase (geodatabase_files), so any edit of the geodatabase
+# gives a new key. With content_hash=True the cells are hashed instead (read block by block), which is exact but reads the whole raster.
+def dataset_signature(path, content_hash=False):
+    path = str(path)
+    if os.path.exists(path):
+        return file_signature(path)
+    import arcpy
+    description = arcpy.Describe(path)
+    if description.dataType in ("RasterDataset", "RasterBand", "MosaicDataset"):
+        if not content_hash:
+            raster = arcpy.Raster(path)
+            extent = raster.extent
+            statistics = [getattr(raster, name, None) for name in ("minimum", "maximum", "mean", "standardDeviation")] # None where there are no statistics
+            return fingerprint("raster", (extent.XMin, extent.YMin, extent.XMax, extent.YMax), raster.meanCellWidth, raster.meanCellHeight, raster.height,
+                               raster.width, raster.bandCount, raster.pixelType, raster.spatialReference.exportToString(), statistics, geodatabase_files(path))
+        from grid_io import open_grid, iter_blocks
+        grid = open_grid(path)
+        digest = hashlib.sha256()
+        update_fingerprint(digest, tuple(grid.definition))
+        for row0, col0, nrows, ncols in iter_blocks(grid.definition.nrows, grid.definition.ncols, 2048, grid.definition.ncols):
+            update_fingerprint(digest, grid.read(row0, col0, nrows, ncols))
+        return digest.hexdigest()
+    from feature_store import read_features
+    return read_features(path).fingerprint()
@@ -0,0 +1,123 @@
+# Parallel production of large grids (e.g. the global 1/60 degree MSS and TSS grids of MSS_TSS_final.py) in latitude bands.
+# The output area is split into bands of rows. The bands are handed to a pool of worker processes; every worker sets up the job once when it starts (opens the input
+# grids, loads the cached offshore masks and opens the memory mapped .npy outputs) and then evaluates each band it is given tile by tile (grid_algebra.py), writing
+# straight into its rows of the shared outputs. No stitching step is needed: the bands are disjoint rows of the same files.
+# Bands where no product has anything to compute (all land, or outside every product's extent and coverage) are filled with NoData by the main process without
+# involving a worker or reading any input.
+# Finished bands are recorded in a progress file (JSON lines) next to the first output. A run that is interrupted can be resumed: bands already recorded are skipped
+# and the outputs are reopened instead of recreated. The progress file starts with a fingerprint of the job, so a changed job never resumes from a stale one.
+
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from grid_algebra import evaluate_tiled_many, intersect_windows, read_mask
+from grid_cache import fingerprint
+
+
+DEFAULT_BANDS = 64 # number of latitude bands when band_rows is not given
+
+# Job of each worker process, set up once by open_job: (products, inputs) as used by grid_algebra.evaluate_tiled_many
+worker_job = None
+
+
+# Worker start-up: set up the job (open inputs, masks and outputs) once per process instead of once per band
+def open_job(setup, args):
+    global worker_job
+    worker_job = setup(**args)[:2]
+
+
+# Evaluate every product over one band (row0, col0, rows, columns) of the tiled area and flush the outputs. Returns the band.
+def run_band(band, shape, tile_size=1024, job=None):
+    products, inputs = job if job is not None else worker_job
+    evaluate_tiled_many(products, inputs, shape, tile_size, area=band)
+    for product in products:
+        if hasattr(product.out, "flush"): # memory mapped output: make the band visible on disk before it is recorded as done
+            product.out.flush()
+    return band
+
+
+# Latitude bands of band_rows rows covering a (rows, columns) area, as (row0, col0, rows, columns) windows
+def latitude_bands(shape, band_rows):
+    nrows, ncols = shape
+    return [(row0, 0, min(band_rows, nrows - row0), ncols) for row0 in range(0, nrows, band_rows)]
+
+
+# True if no product has a cell to compute in the band: outside every product's window, or masked out (e.g. land) everywhere it overlaps
+def band_is_empty(products, band):
+    for product in products:
+        cells = intersect_windows(band, product.window)
+        if cells is None:
+            continue
+        keep = read_mask(product.mask, cells[0] - product.window[0], cells[1] - product.window[1], cells[2], cells[3])
+        if keep is None or keep.any():
+            return False
+    return True
+
+
+# Record of the bands a job has finished: one JSON line per band after a header line holding the job's fingerprint
+class Progress:
+
+    def __init__(self, path, key, resume=False): # (progress file, fingerprint of the job, continue from an existing file of the same job)
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path) as progress_file:
+                lines = [json.loads(line) for line in progress_file if line.strip()]
+            if lines and lines[0].get("job") == key:
+                self.done = {tuple(line["band"]) for line in lines[1:]}
+                return
+        with open(path, "w") as progress_file: # new job (or a different one): start over
+            progress_file.write(json.dumps({"job": key}) + "\n")
+
+    def mark(self, band):
+        self.done.add(tuple(band))
+        with open(self.path, "a") as progress_file:
+            progress_file.write(json.dumps({"band": list(band)}) + "\n")
+
+    def remove(self): # the job is complete: nothing left to resume
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# Evaluate products over an area of the given shape in latitude bands with a pool of worker processes.
+# setup(**args) must return (products, inputs, ...) for grid_algebra.evaluate_tiled_many with the outputs opened from memory mapped .npy files ("r+"), since every
+# worker calls it to get its own handles; setup and args must therefore be picklable (a module level function and a dict of plain values). job is the (products, inputs)
+# of the main process, used to find the empty bands and to fill them. With a progress file, finished bands are recorded in it and, with resume, the bands a previous
+# run of the same job recorded are skipped; the file is removed once the job is complete. workers=1 evaluates every band in the main process.
+# Returns the number of bands evaluated (empty bands and bands done by a previous run are not counted).
+def run_bands(setup, args, job, shape, band_rows=None, tile_size=1024, workers=None, progress=None, resume=False):
+    workers = workers or os.cpu_count() or 1
+    if band_rows is None: # enough bands to keep every core of a node busy even when bands take different times (e.g. mostly land near the poles)
+        band_rows = max(1, int(math.ceil(shape[0] / float(DEFAULT_BANDS))))
+    if progress is not None:
+        progress = Progress(progress, fingerprint(setup.__module__, setup.__name__, args, tuple(shape), band_rows, tile_size), resume)
+    todo = []
+    for band in latitude_bands(shape, band_rows):
+        if progress is not None and band in progress.done:
+            continue
+        if band_is_empty(job[0], band): # nothing to compute: fill with NoData here, no inputs are read
+            run_band(band, shape, tile_size, job)
+            if progress is not None:
+                progress.mark(band)
+        else:
+            todo.append(band)
+
+    if workers == 1 or len(todo) <= 1:
+        for band in todo:
+            run_band(band, shape, tile_size, job)
+            if progress is not None:
+                progress.mark(band)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo)), initializer=open_job, initargs=(setup, args)) as pool:
+            futures = [pool.submit(run_band, band, shape, tile_size) for band in todo]
+            for future in as_completed(futures):
+                band = future.result()
+                if progress is not None:
+                    progress.mark(band)
+    if progress is not None:
+        progress.remove()
+    return len(todo)
@@ -0,0 +1,146 @@
+# Score many satellite derived bathymetric grids (Landsat/Sentinel, different band ratios and calibrations, ...) against one truth (aerial LiDAR) grid in parallel.
+# This is the batch version of calculate_RMSE_numpy in calculate_RMSE.py: every candidate is compared to the truth with the single-pass NumPy statistics in
+# grid_stats.py, so no intermediate rasters are written and runs in the same workspace cannot step on each other's files.
+# The candidates are spread over a process pool. Each worker opens the truth grid and rasterizes the AOI zones onto the whole truth grid once when it starts, then
+# scores every candidate it is handed against it, cutting the zones of the cells the candidate has in common with the truth out of that zone grid (a view, no
+# rasterizing per candidate). ".npy" truth grids are memory mapped, so all workers share the same pages through the operating system's file cache.
+# All results are written to one table (.csv) with a row per candidate (and, optionally, a row per AOI zone). Besides bias, standard deviation and RMSE, each candidate
+# gets the median difference, NMAD and the 68th/95th percentiles of the absolute difference. With --error-map-block, a coarse error map (count, bias and RMSE per tile)
+# is saved for every candidate from the same pass, instead of a full resolution difference raster.
+#
+# Example: python batch_RMSE.py sm_AOI_truth.tif landsat_*.tif sentinel_*.tif --aoi AOI_btw_tracklines --workspace I:\NASA\Florida_SDB\Florida_SDB.gdb --out results.csv
+# A list of candidates can also be read from a text file (one per line) with @candidates.txt
+
+import argparse
+import csv
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from grid_io import open_grid, overlap_windows
+from grid_stats import RunningStats, ZonalStats, ErrorHistogram, ErrorMap, compare_grids, save_error_map
+from rasterize import rasterize_polygons, read_polygons
+from arcpy_backend import use_workspace
+
+
+RESULT_FIELDS = ["candidate", "tag", "zone", "count", "bias", "std", "rmse", "median", "nmad", "p68", "p95", "error"] # columns of the results table
+
+# State of each worker process, filled in once by open_truth
+worker_truth = None # truth grid
+worker_labels = None # AOI zones rasterized onto the truth grid, or None to compare every common cell
+
+
+# Worker start-up: open the truth grid and rasterize the AOI once per process instead of once per candidate
+def open_truth(truth, AOI, workspace):
+    global worker_truth, worker_labels
+    use_workspace(workspace) # geodatabase names (rasters or the AOI feature class) are looked up in the workspace
+    worker_truth = open_grid(truth)
+    polygons = read_polygons(AOI) if isinstance(AOI, str) else AOI
+    worker_labels = rasterize_polygons(polygons, worker_truth.definition) if polygons is not None else None
+
+
+# Tag of every candidate (for the table and the error map names): its name without folders or extension. Candidates with the same name in different folders
+# (landsat/ratio.tif and sentinel/ratio.tif) get as many of their parent folders as it takes to tell them apart (landsat_ratio and sentinel_ratio), and a number
+# if even that is not enough.
+def candidate_tags(candidates):
+    parts = [re.split(r"[\\/]+", str(candidate).rstrip("\\/")) for candidate in candidates] # folders and name (Windows or POSIX paths, geodatabase names)
+    parts = [names[:-1] + [os.path.splitext(names[-1])[0]] for names in parts]
+    depths = [1] * len(parts)
+    while True:
+        tags = ["_".join([re.sub(r"\W", "_", folder) for folder in parts[i][-depths[i]:-1]] + [parts[i][-1]]) for i in range(len(parts))]
+        clashes = [i for i in range(len(tags)) if tags.count(tags[i]) > 1 and depths[i] < len(parts[i])]
+        if not clashes:
+            break
+        for i in clashes:
+            depths[i] += 1
+    return [tag if tags.count(tag) == 1 else tag + "_" + str(i + 1) for i, tag in enumerate(tags)]
+
+
+# Compare one candidate to the worker's truth grid. Returns a list of result rows (overall first, then one per zone if per_zone is set).
+def score_candidate(candidate, tag=None, block_size=1024, per_zone=False, error_map_block=None, error_map_folder=None): # (candidate grid, its tag (see candidate_tags), ...)
+    tag = tag if tag is not None else os.path.splitext(os.path.basename(str(candidate)))[0] # name of the candidate without folders or extension
+    try:
+        candidate_grid = open_grid(candidate)
+        window_1, window_2 = overlap_windows(worker_truth.definition, candidate_grid.definition) # cells both grids have in common
+        grid_1, grid_2 = worker_truth.window(*window_1), candidate_grid.window(*window_2)
+        histogram = ErrorHistogram() # error distribution, filled in the same pass
+        extra = [histogram]
+        if error_map_block: # coarse error map, also filled in the same pass
+            error_map = ErrorMap(grid_1.definition, error_map_block)
+            extra.append(error_map)
+        if worker_labels is None: # every common cell
+            zonal = None
+            stats = RunningStats()
+            compare_grids(grid_1, grid_2, [stats] + extra, block_size)
+        else: # zones of the AOI on this candidate's common cells, cut out of the worker's zone grid
+            row0, col0, nrows, ncols = window_1
+            labels = worker_labels[row0:row0 + nrows, col0:col0 + ncols]
+            zonal = ZonalStats(labels)
+            compare_grids(grid_1, grid_2, [zonal] + extra, block_size, mask=labels)
+            stats = zonal.pooled()
+        if error_map_block:
+            save_error_map(error_map, tag, error_map_folder)
+    except Exception as error: # e.g. grids that are not aligned or do not overlap, or a missing or unreadable candidate; reported in the table instead of stopping the whole batch
+        return [dict(candidate=candidate, tag=tag, zone="all", error=str(error) or repr(error))]
+
+    rows = [dict(candidate=candidate, tag=tag, zone="all", count=stats.count, bias=stats.bias, std=stats.std, rmse=stats.rmse,
+                 median=histogram.median, nmad=histogram.nmad, p68=histogram.percentile(68, absolute=True), p95=histogram.percentile(95, absolute=True))]
+    if per_zone and zonal is not None:
+        table = zonal.table()
+        for i in range(table["zone"].size):
+            rows.append(dict(candidate=candidate, tag=tag, zone=int(table["zone"][i]), count=int(table["count"][i]), bias=float(table["bias"][i]), std=float(table["std"][i]), rmse=float(table["rmse"][i])))
+    return rows
+
+
+# Score every candidate against the truth grid with a pool of worker processes and write the results table.
+# Returns the result rows in the same order as the candidates.
+def run_batch(truth, candidates, AOI=None, out_table=None, workers=None, block_size=1024, per_zone=False, workspace=None, error_map_block=None, error_map_folder=None): 
+    # (truth grid, list of candidate grids, AOI feature class or (label, rings) polygons or None, results .csv, number of processes, block edge in cells, add a row per zone, 
+    # ArcGIS workspace for geodatabase names, tile edge of the error maps in cells (None for no maps), folder for .npy error maps (None for the ArcGIS workspace))
+    rows = []
+    score = partial(score_candidate, block_size=block_size, per_zone=per_zone, error_map_block=error_map_block, error_map_folder=error_map_folder)
+    with ProcessPoolExecutor(max_workers=workers, initializer=open_truth, initargs=(truth, AOI, workspace)) as pool:
+        for candidate_rows in pool.map(score, candidates, candidate_tags(candidates)):
+            rows.extend(candidate_rows)
+    if out_table is not None:
+        write_table(rows, out_table)
+    return rows
+
+
+# Write result rows to a .csv table
+def write_table(rows, out_table):
+    with open(out_table, "w", newline="") as table:
+        writer = csv.DictWriter(table, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare one truth grid to many candidate grids (bias, standard deviation, RMSE).", fromfile_prefix_chars="@")
+    parser.add_argument("truth", help="truth (e.g. aerial LiDAR) grid: .npy with .json sidecar or any raster ArcGIS Pro can read")
+    parser.add_argument("candidates", nargs="+", help="candidate (e.g. satellite derived) grids")
+    parser.add_argument("--aoi", help="feature class of the area of interest; each OBJECTID is a zone")
+    parser.add_argument("--workspace", help="ArcGIS workspace (geodatabase) used to look up geodatabase names")
+    parser.add_argument("--out", default="RMSE_results.csv", help="results table (.csv)")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per core)")
+    parser.add_argument("--block-size", type=int, default=1024, help="edge of the blocks read at a time, in cells")
+    parser.add_argument("--per-zone", action="store_true", help="add a row per AOI zone")
+    parser.add_argument("--error-map-block", type=int, default=None, help="save a coarse error map per candidate with tiles of this many cells on a side")
+    parser.add_argument("--error-map-folder", default=None, help="folder for .npy error maps (default: rasters in the ArcGIS workspace)")
+    args = parser.parse_args(argv)
+
+    rows = run_batch(args.truth, args.candidates, args.aoi, args.out, args.workers, args.block_size, args.per_zone, args.workspace, args.error_map_block, args.error_map_folder)
+    for row in rows:
+        if row["zone"] != "all":
+            continue
+        if row.get("error"):
+            print(str(row["tag"]) + ": " + row["error"])
+        else:
+            print(str(row["tag"]) + ": bias " + str(round(row["bias"],3)) + " m, standard deviation " + str(round(row["std"],3)) + " m, RMSE " + str(round(row["rmse"],3)) + " m, NMAD " + str(round(row["nmad"],3)) + " m")
+    print("Results written to " + str(args.out))
+
+
+if __name__ == "__main__":
+    main()
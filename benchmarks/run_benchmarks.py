@@ -0,0 +1,196 @@
+# Benchmarks of the hot paths of the three scripts on synthetic inputs (synthetic.py), headless and without ArcPy, to catch performance regressions before a release.
+# (The scripts only import ArcPy when a function needs a geodatabase, see arcpy_backend.py, so MSS_TSS_final.py is imported and run as it is.)
+#   rmse      calculate_RMSE_numpy itself: AOI zones rasterized onto the common cells, zonal statistics, error histogram and depth bins (cells per second)
+#   mss_tss   MSS_TSS_generation_numpy's combined pass: common cells, offshore masks (distance transform) and both equations tile by tile (MSS cells per second)
+#   thin      thin_it_out_fast's selection: every 15th profile and profiles 20 m apart, normals, toe and top points (normals per second)
+#   extend    extend_cross_sections_fast's geometry: offset lines of the coast and ray casting of every thinned normal (normals per second)
+#   profiles  get_the_good_stuff_fast's sampling: 1 m stations along every extended normal and bilinear Z from the DEM (stations per second)
+# Every benchmark is timed repeat times (the best time counts), then run once more under tracemalloc for its peak memory (NumPy and Python allocations; memory
+# mapped inputs are not counted). Results are compared to a baseline file: a benchmark whose throughput drops or whose peak memory grows by more than tolerance is
+# reported as a regression and the exit status is 1. --update-baseline stores the results of this machine as the new baseline. Baselines are per machine and per
+# scale, so the baseline file is not part of the repository.
+#
+# Example: python benchmarks/run_benchmarks.py --update-baseline       (once, on the machine used for the checks)
+#          python benchmarks/run_benchmarks.py --only rmse extend        (later, compare to it)
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # the repository's modules
+
+import synthetic
+from calculate_RMSE import calculate_RMSE_numpy
+from cross_section_geometry import extend_lines, offset_segments
+from feature_store import thin_profiles
+from grid_io import open_grid, overlap_grids
+from MSS_TSS_final import MSS_TSS_generation_numpy
+from profile_sampler import sample_profiles
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+# Each benchmark: setup(folder, scale) makes its inputs (not timed) and returns them, run(inputs) does the timed work and returns the number of items processed.
+
+def setup_rmse(folder, scale):
+    (truth, candidate), polygons = synthetic.bathymetry(folder, scale)
+    definition = overlap_grids(open_grid(truth), open_grid(candidate))[0].definition # common cells, the items counted
+    return truth, candidate, polygons, definition.nrows * definition.ncols
+
+
+def run_rmse(inputs): # calculate_RMSE.calculate_RMSE_numpy itself, without an AOI cache so the zones are rasterized every time (its report is not printed)
+    truth, candidate, polygons, cells = inputs
+    with contextlib.redirect_stdout(io.StringIO()):
+        calculate_RMSE_numpy(truth, candidate, polygons, "benchmark", 1024)
+    return cells
+
+
+def setup_mss_tss(folder, scale):
+    paths, land = synthetic.sea_surface(folder, scale)
+    return paths, land, folder
+
+
+def run_mss_tss(inputs): # MSS_TSS_final.MSS_TSS_generation_numpy itself, without a mask cache so the masks are built every time
+    paths, land, folder = inputs
+    MSS_TSS_generation_numpy(paths["CNES"], paths["Geoid"], paths["TP_WGS"], paths["MT_FT"], land, "benchmark", MSS_output=os.path.join(folder, "MSS_out.npy"),
+                             TSS_output=os.path.join(folder, "TSS_out.npy"))
+    definition = open_grid(paths["CNES"]).definition
+    return definition.nrows * definition.ncols
+
+
+def setup_cliffs(folder, scale):
+    return synthetic.cliffs(folder, scale)
+
+
+def run_thin(inputs): # see CrossSections.thin_it_out_fast
+    coast, normals, toe, top, dem = inputs
+    thin_profiles(normals, [toe, top], stride=15)
+    thin_profiles(normals, [toe, top], spacing=20.0)
+    return len(normals)
+
+
+def thinned_normals(inputs):
+    coast, normals, toe, top, dem = inputs
+    return thin_profiles(normals, [], stride=15)[0]
+
+
+def setup_extend(folder, scale):
+    inputs = setup_cliffs(folder, scale)
+    return inputs[0], thinned_normals(inputs)
+
+
+def run_extend(inputs): # see CrossSections.extend_cross_sections_fast with parallel_offsets=True
+    coast, normals = inputs
+    extend_lines(normals, offset_segments(coast, (450, -20)), 10000)
+    return len(normals)
+
+
+def setup_profiles(folder, scale):
+    inputs = setup_cliffs(folder, scale)
+    coast, dem = inputs[0], inputs[4]
+    extended = extend_lines(thinned_normals(inputs), offset_segments(coast, (450, -20)), 10000)[0]
+    return extended, dem
+
+
+def run_profiles(inputs): # see CrossSections.get_the_good_stuff_fast
+    extended, dem = inputs
+    columns, offsets = sample_profiles(extended, open_grid(dem), 1.0)
+    return int(offsets[-1])
+
+
+# name -> (setup, run, what the items are)
+BENCHMARKS = {
+    "rmse": (setup_rmse, run_rmse, "cells"),
+    "mss_tss": (setup_mss_tss, run_mss_tss, "cells"),
+    "thin": (setup_cliffs, run_thin, "normals"),
+    "extend": (setup_extend, run_extend, "normals"),
+    "profiles": (setup_profiles, run_profiles, "stations"),
+}
+
+
+# Time one benchmark: best of repeat runs, then one run under tracemalloc for the peak memory. Returns a result dict.
+def measure(name, scale=1.0, repeat=5):
+    setup, run, unit = BENCHMARKS[name]
+    folder = tempfile.mkdtemp(prefix="benchmark_" + name + "_")
+    try:
+        inputs = setup(folder, scale)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            items = run(inputs)
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        run(inputs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    seconds = min(times)
+    return {"items": items, "unit": unit, "seconds": seconds, "throughput": items / seconds if seconds > 0 else float("inf"), "peak_mb": peak / 1024.0 ** 2}
+
+
+# Regressions of a result against its baseline: list of messages (empty if none)
+def regressions(result, baseline, tolerance=0.25):
+    found = []
+    if result["throughput"] < baseline["throughput"] / (1 + tolerance):
+        found.append("throughput " + format(result["throughput"], ".3g") + " " + result["unit"] + "/s, baseline " + format(baseline["throughput"], ".3g"))
+    if result["peak_mb"] > baseline["peak_mb"] * (1 + tolerance) + 1.0: # 1 MB of slack for tiny benchmarks
+        found.append("peak memory " + format(result["peak_mb"], ".1f") + " MB, baseline " + format(baseline["peak_mb"], ".1f") + " MB")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on synthetic data and compare them to a stored baseline.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="size of the synthetic inputs (1: around a second each)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (the best counts)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline .json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed loss of throughput / growth of peak memory before a regression is reported")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--out", help="also write the results to this .json file")
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+    scale_key = format(args.scale, "g") # baselines are kept per scale
+    baseline = baselines.get(scale_key, {})
+
+    results, failed = {}, False
+    print("benchmark".ljust(10) + "items".rjust(12) + "seconds".rjust(10) + "items/s".rjust(12) + "peak MB".rjust(10) + "  vs baseline")
+    for name in args.only or list(BENCHMARKS):
+        result = results[name] = measure(name, args.scale, args.repeat)
+        if name in baseline:
+            change = format(result["throughput"] / baseline[name]["throughput"] - 1, "+.0%") + " throughput"
+            problems = regressions(result, baseline[name], args.tolerance)
+            if problems and not args.update_baseline:
+                failed = True
+                change += "  REGRESSION: " + "; ".join(problems)
+        else:
+            change = "no baseline"
+        print(name.ljust(10) + str(result["items"]).rjust(12) + format(result["seconds"], ".3f").rjust(10) + format(result["throughput"], ".3g").rjust(12) +
+              format(result["peak_mb"], ".1f").rjust(10) + "  " + change)
+
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump({scale_key: results}, out_file, indent=1)
+    if args.update_baseline:
+        baselines[scale_key] = dict(baseline, **results)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=1)
+        print("Baseline for scale " + scale_key + " written to " + args.baseline)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Synthetic inputs for the benchmarks (run_benchmarks.py), so the hot paths of calculate_RMSE.py, MSS_TSS_final.py and CrossSections.py can be timed without an
+# ArcGIS Pro workspace. Everything is generated from a seed, at a size set by scale (at 1 each benchmark takes around a second or less; the number of cells, features
+# and points grows about linearly with scale), and grids are saved as memory mapped .npy grids with their .json sidecars, like real .npy inputs.
+#   bathymetry:  a truth and a satellite-like candidate bathymetry grid (bias, noise and gaps) plus AOI zones as (label, rings) polygons,
+#   sea surface: global CNES MSS, topex poseidon -> WGS 84 and mean tide -> tide free grids, a regional xGeoid20-like grid and land polygons,
+#   cliffs:      a meandering coastline, CliffMetrics-like normals (one per meter, with their fields), cliff toe and top points, and a DEM of the cliffs.
+
+import math
+import os
+
+import numpy as np
+
+from feature_store import FeatureTable
+from grid_io import GridDefinition, save_grid
+
+
+# Smooth random field over a (rows, columns) grid: a sum of a few random plane waves, values roughly in -1..1
+def smooth_field(shape, rng, waves=6, wavelength=(50.0, 400.0)):
+    rows, cols = np.ogrid[:shape[0], :shape[1]]
+    field = np.zeros(shape, dtype=np.float32)
+    for _ in range(waves):
+        angle, length, phase = rng.uniform(0, math.pi), rng.uniform(*wavelength), rng.uniform(0, 2 * math.pi)
+        field += np.cos((rows * math.sin(angle) + cols * math.cos(angle)) * (2 * math.pi / length) + phase).astype(np.float32)
+    return field / waves
+
+
+# Closed ring (N x 2 array) of an ellipse with a wobbly edge
+def blob(x, y, radius_x, radius_y, rng, points=64):
+    angle = np.linspace(0, 2 * math.pi, points, endpoint=False)
+    wobble = 1 + 0.15 * np.sin(3 * angle + rng.uniform(0, 6)) + 0.05 * np.sin(7 * angle + rng.uniform(0, 6))
+    ring = np.column_stack([x + radius_x * wobble * np.cos(angle), y + radius_y * wobble * np.sin(angle)])
+    return np.vstack([ring, ring[:1]])
+
+
+# Truth and candidate bathymetry grids (.npy paths in folder) of about 16 million cells times scale, and AOI zones as (label, rings) polygons
+def bathymetry(folder, scale=1.0, seed=0, zones=40):
+    rng = np.random.default_rng(seed)
+    size = int(4096 * math.sqrt(scale))
+    definition = GridDefinition(500000.0, 3000000.0 + size, 1.0, 1.0, size, size)
+    truth = (10 + 9 * smooth_field(definition.shape, rng)).astype(np.float32) # depths 1 to 19 m
+    candidate = truth + np.float32(0.2) + rng.normal(0, 0.5, definition.shape).astype(np.float32)
+    for _ in range(20): # gaps (clouds, turbid water) in the satellite derived grid
+        row, col, extent = rng.integers(0, size, 2).tolist() + [int(rng.integers(size // 40 + 1, size // 10 + 2))]
+        candidate[row:row + extent, col:col + extent] = np.nan
+    paths = os.path.join(folder, "truth.npy"), os.path.join(folder, "candidate.npy")
+    save_grid(truth, definition, paths[0])
+    save_grid(candidate, definition, paths[1])
+    polygons = []
+    for label in range(1, zones + 1):
+        x, y = definition.x_min + rng.uniform(0.1, 0.9) * size, definition.y_min + rng.uniform(0.1, 0.9) * size
+        polygons.append((label, [blob(x, y, rng.uniform(0.03, 0.15) * size, rng.uniform(0.03, 0.15) * size, rng)]))
+    return paths, polygons
+
+
+# Global sea surface inputs (.npy paths in folder) on a grid of 15 x sqrt(scale) cells per degree (1/60 degree at scale 16): CNES MSS, topex poseidon -> WGS 84, mean tide -> tide free, an
+# xGeoid20-like grid over a region (on the same cells), and land polygons in degrees
+def sea_surface(folder, scale=1.0, seed=0, continents=12):
+    rng = np.random.default_rng(seed)
+    per_degree = max(1, int(round(15 * math.sqrt(scale))))
+    cell = 1.0 / per_degree
+    world = GridDefinition(-180.0, 90.0, cell, cell, 180 * per_degree, 360 * per_degree)
+    region = GridDefinition(-150.0, 60.0, cell, cell, 60 * per_degree, 110 * per_degree) # North America and the Pacific, lined up with the world grid
+    latitude = (world.y_max - (np.arange(world.nrows) + 0.5) * cell)[:, None]
+    grids = {
+        "CNES": (30 * np.sin(np.radians(latitude) * 2) + 20 * smooth_field(world.shape, rng, wavelength=(20 * per_degree, 200 * per_degree))).astype(np.float32),
+        "TP_WGS": np.broadcast_to(np.float32(-0.7) + 0.01 * np.cos(np.radians(latitude)).astype(np.float32), world.shape).copy(),
+        "MT_FT": np.broadcast_to((-0.15 + 0.2 * np.sin(np.radians(latitude)) ** 2).astype(np.float32), world.shape).copy(),
+    }
+    paths = {}
+    for name, array in grids.items():
+        paths[name] = os.path.join(folder, name + ".npy")
+        save_grid(array, world, paths[name])
+    geoid = grids["CNES"][30 * per_degree:90 * per_degree, 30 * per_degree:140 * per_degree] + rng.normal(0, 0.05, region.shape).astype(np.float32)
+    paths["Geoid"] = os.path.join(folder, "Geoid.npy")
+    save_grid(geoid, region, paths["Geoid"])
+    land = [(label, [blob(rng.uniform(-170, 170), rng.uniform(-60, 70), rng.uniform(5, 30), rng.uniform(5, 25), rng)]) for label in range(1, continents + 1)]
+    return paths, land
+
+
+# Coastline, CliffMetrics-like normals (one per meter of coast, 100 m long, pointing landward), cliff toe and top points, and a DEM (.npy path in folder) of a
+# 20 km stretch of cliffs times scale. Returns (coast, normals, toe points, top points) as FeatureTables and the DEM path.
+def cliffs(folder, scale=1.0, seed=0, cell=0.91):
+    rng = np.random.default_rng(seed)
+    length = 20000.0 * scale
+    y = np.arange(0.0, length + 5.0, 5.0) # coast vertices every 5 m, running north with the land to the east (right)
+    x = 150 * np.sin(y / 700.0 + rng.uniform(0, 6)) + 30 * np.sin(y / 90.0 + rng.uniform(0, 6))
+    coast = FeatureTable("POLYLINE", x, y, offsets=[0, x.size])
+
+    # Normals every meter along the coast, perpendicular to it
+    along = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+    station = np.arange(1.0, along[-1] - 1.0, 1.0)
+    sx, sy = np.interp(station, along, x), np.interp(station, along, y)
+    tx, ty = np.interp(station + 0.5, along, x) - np.interp(station - 0.5, along, x), np.interp(station + 0.5, along, y) - np.interp(station - 0.5, along, y)
+    norm = np.hypot(tx, ty)
+    nx, ny = ty / norm, -tx / norm # right of the coast: landward
+    count = station.size
+    profile = np.arange(1, count + 1)
+    normals = FeatureTable("POLYLINE", np.column_stack([sx, sx + 100 * nx]).ravel(), np.column_stack([sy, sy + 100 * ny]).ravel(),
+                           {"ORIG_FID": profile, "Normal": profile, "StartCoast": profile, "EndCoast": profile, "HitLand": np.ones(count, dtype=np.int32),
+                            "HitCoast": np.zeros(count, dtype=np.int32), "HitNormal": np.zeros(count, dtype=np.int32), "nCoast": np.ones(count, dtype=np.int32)},
+                           np.arange(0, 2 * count + 1, 2))
+    toe_distance, top_distance = rng.uniform(10, 30, count), rng.uniform(40, 80, count)
+    point_fields = {"nCoast": np.ones(count, dtype=np.int32), "nProf": profile, "bisOK": np.ones(count, dtype=np.int32)}
+    toe = FeatureTable("POINT", sx + toe_distance * nx, sy + toe_distance * ny, dict(point_fields, CoastEl=np.zeros(count), CliffToeEl=np.full(count, 3.0)))
+    top = FeatureTable("POINT", sx + top_distance * nx, sy + top_distance * ny, dict(point_fields, CliffTopEl=np.full(count, 30.0), Chainage=station))
+
+    # DEM: sea level offshore, a beach, a cliff about 20 to 80 m inland and a rolling terrace behind it
+    x_min, x_max, y_min, y_max = x.min() - 100, x.max() + 550, -100.0, length + 100
+    definition = GridDefinition(x_min, y_max, cell, cell, int((y_max - y_min) / cell), int((x_max - x_min) / cell))
+    dem = np.empty(definition.shape, dtype=np.float32)
+    columns = x_min + (np.arange(definition.ncols) + 0.5) * cell
+    for row0 in range(0, definition.nrows, 1024): # row blocks to keep the temporaries small
+        rows = y_max - (np.arange(row0, min(row0 + 1024, definition.nrows)) + 0.5) * cell
+        inland = columns[None, :] - np.interp(rows, y, x)[:, None] # meters east of the coastline
+        cliff = 30 / (1 + np.exp(-(inland - 50) / 5)) # cliff face around 50 m inland
+        dem[row0:row0 + rows.size] = np.where(inland < 0, -1.0, 0.05 * inland + cliff + 2 * np.sin(rows / 40.0)[:, None] * (inland > 60))
+    dem_path = os.path.join(folder, "DEM.npy")
+    save_grid(dem, definition, dem_path)
+    return coast, normals, toe, top, dem_path
+
@@ -11,32 +11,43 @@
 # This code utilizes ArcPy, ArcGIS Pro's proprietary coding language, therefore in the comments are explanations, as well as justifications, for decisions. 
 # Last updated 2/4/2022
 
-from arcpy import env
-import arcpy
 # import sys 
 # import time
 import math 
 import numpy as np 
 
+from grid_io import open_grid, overlap_grids
+from grid_stats import RunningStats, ZonalStats, DepthBinnedStats, ErrorHistogram, ErrorMap, compare_grids, save_error_map
+from rasterize import rasterize, read_polygons
+from artifact_cache import cached_arrays, fingerprint
+from stage_trace import traced, lap, stage
+from arcpy_backend import load_arcpy, use_workspace
 
-# Set the workspace to the ArcGIS Pro datbase for the project
-arcpy.env.workspace = r"I:\NASA\Florida_SDB\Florida_SDB.gdb"
 
-def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other raster to, raster that other raster will be compared to, shapefile of the area of interest, string that will be added to outputs to distinguish)
+# ArcPy is only imported by the functions that use it (see arcpy_backend.py), and the ArcGIS Pro database for the project is passed to them as workspace, 
+# so this file can be imported (e.g. by batch_RMSE.py's workers) without starting ArcPy or running anything.
+
+@traced()
+def calculate_RMSE(raster_1, raster_2, AOI, tag, workspace=None): # (raster to compare other raster to, raster that other raster will be compared to, shapefile of the area of interest, string that will be added to outputs to distinguish,
+                                                                  # ArcGIS Pro database for the project (None: ArcPy's current workspace))
+    arcpy = load_arcpy(workspace)
 
     # Capture extent for raster_1
+    lap("domain_1")
     domain_1 = "Domain1" + "_" + str(tag) # name of raster extent shapefile using the tag 
     if arcpy.Exists(domain_1) == 1: # checks to see if name already exists
         arcpy.Delete_management(domain_1) # deletes shapefile if it already exists
     arcpy.ddd.RasterDomain(raster_1, domain_1, "POLYGON") # "POLYGON": creates polygon shapefile covering the extent of the first raster 
 
     # Capture extent for raster_2
+    lap("domain_2")
     domain_2 = "Domain2" + "_" + str(tag) # name of raster extent shapefile using the tag 
     if arcpy.Exists(domain_2) == 1: # checks to see if name already exists
         arcpy.Delete_management(domain_2) # deletes shapefile if it already exists
     arcpy.ddd.RasterDomain(raster_2, domain_2, "POLYGON") # "POLYGON": creates polygon shapefile covering the extent of the first raster 
 
     # Intersect between two extents 
+    lap("intersect")
     intersect = "intersect" + "_" + str(tag) # name of overlapping extents shapefile using the tag 
     if arcpy.Exists(intersect) == 1: # checks to see if name already exists
         arcpy.Delete_management(intersect) # deletes shapefile if it already exists
@@ -46,6 +57,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
                                                                                                             #"INPUT": Output type is the same as the input type (polygon shapefile)
 
     # Crop first raster to the intersecting extent 
+    lap("extract_1")
     extract_1 = "extract_1" + "_" + str(tag) # name of cropped raster 1 using the tag
     if arcpy.Exists(extract_1) == 1: # checks to see if name already exists
         arcpy.Delete_management(extract_1) # deletes raster if it already exists
@@ -53,6 +65,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     out_raster_CNES.save(extract_1) # saves the cropped raster
 
     # Extract by intersect for raster_2 
+    lap("extract_2")
     extract_2 = "extract_2" + "_" + str(tag) # name of cropped raster 2 using the tag
     if arcpy.Exists(extract_2) == 1: # checks to see if name already exists
         arcpy.Delete_management(extract_2) # deletes raster if it already exists
@@ -62,12 +75,14 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     # Now that both rasters are cropped to the same extent, start calculation for RMSE
 
     # Difference between two rasters
+    lap("minus")
     difference = "difference" + "_" + str(tag) # name of the difference DEM using the tag 
     if arcpy.Exists(difference) == 1: # checks to see if name already exists
         arcpy.Delete_management(difference) # deletes raster if it already exists
     arcpy.ddd.Minus(extract_1, extract_2, difference) # takes the difference between the two DEMS
 
     # Generate statistics of the difference DEM 
+    lap("zonal_statistics")
     difference_table = "difference_table" + str(tag) # name of the statistics table using the tag 
     if arcpy.Exists(difference_table) == 1: # checks to see if name already exists
         arcpy.Delete_management(difference_table) # deletes raster if it already exists
@@ -78,6 +93,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
                                                                                                                     # "CURRENT_SLICE": Statistics will be calculated from the current slice of the input multidimensional dataset.
 
     # Capture bias (mean difference) of difference DEM
+    lap("bias_cursor")
     get_bias = arcpy.SearchCursor(difference_table) #Create cursor to access zonal statistics table 
     bias_num = [] #Create empty list for values to be added to
     field_name = "MEAN" # define we're looking for MEAN
@@ -87,6 +103,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     print("The bias for " + str(tag) + " is " + str(round(bias_num,3))+ " meters.") # print the mean difference to three decimal places 
 
     # Capture standard deviation (STD) of difference DEM  
+    lap("std_cursor")
     get_std = arcpy.SearchCursor(difference_table) #Create cursor to access zonal statistics table 
     std_num = [] #Create empty list for values to be added to
     field_name = "STD" # define we're looking for STD 
@@ -100,6 +117,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     print("The square root of the square standard deviation plus the square mean for " + str(tag) + " is " + str(round(check,3))+ " meters.") # print the result to three decimal places 
 
     # Square each value of the difference raster  
+    lap("square")
     square_raster = "square_raster" + str(tag) # name of the square DEM using the tag 
     if arcpy.Exists(square_raster) == 1: # checks to see if name already exists
         arcpy.Delete_management(square_raster) # deletes raster if it already exists
@@ -107,6 +125,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     out_raster.save(square_raster) # Saves the square DEM 
 
     # Generate statistics table for the square 
+    lap("square_zonal_statistics")
     square_table = "square_table" + str(tag) # name of the square DEM using the tag
     if arcpy.Exists(square_table) == 1: # checks to see if name already exists
         arcpy.Delete_management(square_table) # deletes raster if it already exists
@@ -117,6 +136,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
                                                                                                                     # "CURRENT_SLICE": Statistics will be calculated from the current slice of the input multidimensional dataset.
 
     # Capture the number of cells in square DEM
+    lap("count_cursor")
     get_count = arcpy.SearchCursor(square_table) # Create cursor to access zonal statistics table 
     count_num = [] #Create empty list for values to be added to
     field_name = "COUNT" # define we're looking for COUNT 
@@ -126,6 +146,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     count_num = np.sum(count_num) #sum all count values 
 
     # Capture sum of square DEM
+    lap("sum_cursor")
     get_sum = arcpy.SearchCursor(square_table) # Create cursor to access zonal statistics table 
     sum_num = [] #Create empty list for values to be added to
     field_name = "SUM" # define we're looking for SUM 
@@ -146,6 +167,7 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
         print("No good! RMSE minus square root of square mean plus square standard deviation is " + str(round(test_2,3)) + " m.") # Tell the user RMSE did not pass the check 
         
     # Take out the trash     
+    lap("trash")
     arcpy.management.Delete(domain_1)
     arcpy.management.Delete(domain_2)
     arcpy.management.Delete(intersect)
@@ -156,4 +178,87 @@ def calculate_RMSE(raster_1, raster_2, AOI, tag): # (raster to compare other ras
     arcpy.management.Delete(square_raster)
     arcpy.management.Delete(square_table)
 
-calculate_RMSE(r"I:\NASA\Florida_SDB\sm_AOI_truth.tif", r"I:\NASA\Florida_SDB\sm_AOI_difference.tif", "AOI_btw_tracklines", "cut_extent") # this line runs the code and is change for new datasets
\ No newline at end of file
+# NumPy version of calculate_RMSE. Instead of writing a difference raster and a squared raster and reading them back with zonal statistics and four cursors, 
+# both grids are read block by block and bias, standard deviation and RMSE are computed in a single pass with running (Welford/Chan) statistics. 
+# No intermediate rasters are written. The common area is found from the grids' georeferencing (they must share cell size and alignment) instead of 
+# RasterDomain/Intersect/ExtractByMask, so neither grid is rewritten to crop it.
+# The AOI polygons are rasterized once onto the common area and every zone (OBJECTID) gets its own statistics in the same pass. The overall figures are pooled from
+# the zones' counts, means and spreads, rather than adding up each zone's MEAN and STD. With AOI=None every common cell is used.
+# With distribution=True the same pass also fills a fixed-bin histogram of the differences (median, NMAD, 68th and 95th percentiles of the absolute error) 
+# and RMSE by truth depth (depth_bins, in meters), without holding the differences in memory. 
+# The full resolution difference raster is not written. To still see where the grids agree and disagree, set error_map_block (e.g. 32 or 256) to write a coarse
+# error map with the count, bias and RMSE of every error_map_block x error_map_block tile, computed in the same pass (see save_error_map for where it goes).
+# With cache (a folder, see artifact_cache.py), the rasterized AOI is kept under a hash of the AOI polygons and the common cells, so comparing other grids over the
+# same area (or rerunning with other depth bins) does not rasterize it again.
+@traced()
+def calculate_RMSE_numpy(raster_1, raster_2, AOI, tag, block_size=1024, distribution=True, depth_bins=(0, 2, 5, 10, math.inf), error_map_block=None, error_map_folder=None, cache=None, 
+                         workspace=None): 
+    # (raster to compare other raster to, raster that other raster will be compared to, feature class of the area of interest (or list of (label, rings) polygons, or None), 
+    # string added to outputs to distinguish, block edge in cells, whether to compute the error distribution, edges of the depth bins, tile edge of the error map in cells (None for no map),
+    # folder for .npy error maps (None to save them in the ArcGIS workspace), artifact cache folder for the AOI zone grid (None to rasterize it every time),
+    # ArcGIS Pro database that geodatabase names are looked up in (None: ArcPy's current workspace; not needed, and ArcPy not imported, for .npy/.tif grids and polygon lists))
+    use_workspace(workspace)
+
+    grid_1 = open_grid(raster_1) # ".npy" grids are memory mapped, everything else is read in windows with ArcPy
+    grid_2 = open_grid(raster_2)
+    grid_1, grid_2 = overlap_grids(grid_1, grid_2) # crop both grids to the cells they have in common (views/windows, nothing is copied)
+
+    # Choose what to accumulate during the single pass over both grids
+    if AOI is None: # no zones, compare every common cell
+        labels = None
+        zonal = None
+        stats = RunningStats()
+        accumulators = [stats]
+    else:
+        polygons = read_polygons(AOI) if isinstance(AOI, str) else AOI # read once: for the cache key and, if needed, to rasterize
+        with stage("aoi_zones", items=len(polygons)):
+            labels = cached_arrays(cache, fingerprint("aoi_zones", polygons, tuple(grid_1.definition)), 
+                                   lambda: {"labels": rasterize(polygons, grid_1.definition, "OBJECTID")})["labels"] # zone grid of the AOI on the common cells, built once
+        zonal = ZonalStats(labels)
+        accumulators = [zonal]
+    if distribution:
+        histogram = ErrorHistogram() # 1 mm bins
+        by_depth = DepthBinnedStats(depth_bins)
+        accumulators += [histogram, by_depth]
+    else:
+        histogram = by_depth = None
+    if error_map_block:
+        error_map = ErrorMap(grid_1.definition, error_map_block)
+        accumulators.append(error_map)
+    else:
+        error_map = None
+
+    with stage("compare_grids", items=grid_1.definition.nrows * grid_1.definition.ncols): # items: cells read from each grid
+        compare_grids(grid_1, grid_2, accumulators, block_size, mask=labels) # one pass over both grids for everything, limited to the AOI if there is one
+
+    if zonal is not None:
+        stats = zonal.pooled() # overall statistics pooled over the zones
+        table = zonal.table()
+        for i in range(table["zone"].size): # report every zone
+            print("Zone " + str(table["zone"][i]) + " of " + str(tag) + ": bias " + str(round(table["bias"][i],3)) + " m, standard deviation " + str(round(table["std"][i],3)) + " m, RMSE " + str(round(table["rmse"][i],3)) + " m (" + str(table["count"][i]) + " cells).")
+
+    print("The bias for " + str(tag) + " is " + str(round(stats.bias,3))+ " meters.") # print the mean difference to three decimal places 
+    print("The standard deviation for " + str(tag) + " is " + str(round(stats.std,3))+ " meters.") # print the standard deviation to three decimal places 
+    print("The RMSE for " + str(tag) + " is " + str(round(stats.rmse,3))+ " meters.") # Print the RMSE for the user to three decimal places
+    print("Cells compared for " + str(tag) + ": " + str(stats.count)) # number of cells with data in both grids
+
+    if distribution:
+        print("The median difference for " + str(tag) + " is " + str(round(histogram.median,3)) + " meters and the NMAD is " + str(round(histogram.nmad,3)) + " meters.")
+        print("68% of absolute differences for " + str(tag) + " are within " + str(round(histogram.percentile(68, absolute=True),3)) + " meters, 95% within " + str(round(histogram.percentile(95, absolute=True),3)) + " meters.")
+        if histogram.clipped:
+            print("Warning: " + str(histogram.clipped) + " differences were beyond +/- " + str(histogram.limit) + " meters, percentiles near the tails are clipped.")
+        table = by_depth.table()
+        for i in range(table["zone"].size): # RMSE for every depth bin with data
+            print("The RMSE for " + str(tag) + " between " + str(table["depth_from"][i]) + " and " + str(table["depth_to"][i]) + " meters depth is " + str(round(table["rmse"][i],3)) + " meters (" + str(table["count"][i]) + " cells).")
+
+    if error_map is not None:
+        lap("save_error_map")
+        save_error_map(error_map, tag, error_map_folder)
+        print("Error map for " + str(tag) + " saved with " + str(error_map.block) + " x " + str(error_map.block) + " cell tiles.")
+
+    return stats, zonal, histogram, by_depth
+
+
+if __name__ == "__main__": # only runs when this file is run as a script, not when it is imported
+    calculate_RMSE(r"I:\NASA\Florida_SDB\sm_AOI_truth.tif", r"I:\NASA\Florida_SDB\sm_AOI_difference.tif", "AOI_btw_tracklines", "cut_extent", 
+                   workspace=r"I:\NASA\Florida_SDB\Florida_SDB.gdb") # this line runs the code and is change for new datasets
\ No newline at end of file
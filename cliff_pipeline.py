@@ -0,0 +1,192 @@
+# Pipeline that prepares the erosion model inputs (CrossSections.py) for many sites at once, instead of running thin_it_out, extend_cross_sections and
+# get_the_good_stuff by hand one site at a time.
+# The sites are listed in a JSON manifest. Every site goes through three stages, each depending on the one before:
+#   "thin"   CrossSections.thin_it_out_fast on the CliffMetrics normals, cliff toe and cliff top points,
+#   "extend" CrossSections.extend_cross_sections_fast on the thinned normals and the coastline,
+#   "sample" CrossSections.get_the_good_stuff_fast on the extended normals and the DEM (profile store, and .csv files if asked for).
+# The stages of all sites form one dependency graph that is run on a pool of worker processes: a stage is started as soon as the stage it depends on has finished,
+# so different sites run side by side. Every site gets its own scratch folder (<scratch>/<tag>) with its own file geodatabase (work.gdb) used as the ArcPy
+# workspace of its stages, so the fixed scratch names of CrossSections.py ("land_buffer", "merged_buffer_erase", ...) of different sites never collide. The stage
+# outputs (normals_thin_<tag>, toe_thin_<tag>, top_thin_<tag>, extended_normals<tag>) are in work.gdb and the profile store in the site's out_folder (default the
+# site's scratch folder).
+# Runs are incremental. Every stage has a key: a fingerprint of its parameters, of the contents of its inputs (file sizes and modification times for files on disk,
+# the features for feature classes, and for rasters in a geodatabase their description, statistics and the file times of the geodatabase, or the cells themselves
+# with "content_hash": true, see artifact_cache.dataset_signature) and of the key of the stage it depends on. The keys of finished stages are kept in
+# <scratch>/<tag>/state.json, and a stage whose key has not changed (and whose outputs still exist) is skipped. When one site's DEM is updated, only that site's
+# "sample" stage runs again. With a "cache" folder, the buffer lines and extended normals are also kept in a shared artifact cache (artifact_cache.py), so a
+# stage that does run again (for example after a parameter change) reuses the intermediates its change does not affect.
+#
+# Manifest example (paths of inputs are relative to the site's workspace unless absolute, "defaults" apply to every site that does not set them):
+# {"scratch": "I:/Thesis/pipeline", "workers": 4, "cache": "I:/Thesis/artifact_cache",
+#  "defaults": {"stride": 15, "spacing": null, "parallel_offsets": false, "station_spacing": 1, "csvs": false, "content_hash": false},
+#  "sites": [{"tag": "Near_Brush_Creek", "workspace": "I:/Thesis/Thesis/Near_Brush_Creek.gdb", "normals": "normals", "toe": "cliff_toe", "top": "cliff_top",
+#             "coast": "coast_Clip", "dem": "Near_Brush_Creek_full_m"},
+#            {"tag": "Ophir_Beach", "workspace": "I:/Thesis/Thesis/Ophir_Beach.gdb", ...}]}
+#
+# Example: python cliff_pipeline.py sites.json --workers 4                (every site, skipping what is up to date)
+#          python cliff_pipeline.py sites.json --sites Ophir_Beach --force  (one site, every stage)
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from artifact_cache import dataset_signature, fingerprint
+
+
+# Stages in order: name -> (stage it depends on, manifest inputs it reads, manifest parameters it uses)
+STAGES = {
+    "thin": (None, ("normals", "toe", "top"), ("stride", "spacing")),
+    "extend": ("thin", ("coast",), ("parallel_offsets",)),
+    "sample": ("extend", ("dem",), ("station_spacing", "csvs")),
+}
+
+DEFAULTS = {"stride": 15, "spacing": None, "parallel_offsets": False, "station_spacing": 1, "csvs": False, "content_hash": False}
+
+
+# Manifest (path of a JSON file or a dict) as a list of sites, each a dict with every parameter filled in plus "scratch" (its own folder), "work" (its work.gdb)
+# and "out_folder"
+def read_manifest(manifest):
+    if not isinstance(manifest, dict):
+        with open(manifest) as manifest_file:
+            manifest = json.load(manifest_file)
+    scratch = manifest.get("scratch", "pipeline_scratch")
+    sites = []
+    for entry in manifest["sites"]:
+        site = dict(DEFAULTS, **manifest.get("defaults", {}))
+        site.update(entry)
+        site["scratch"] = os.path.join(scratch, site["tag"])
+        site["work"] = os.path.join(site["scratch"], "work.gdb")
+        site.setdefault("out_folder", site["scratch"])
+        site["cache"] = manifest.get("cache") # artifact cache shared by every site (see artifact_cache.py), or None
+        sites.append(site)
+    tags = [site["tag"] for site in sites]
+    if len(set(tags)) != len(tags):
+        raise ValueError("Site tags must be unique: " + ", ".join(tags))
+    return sites, manifest.get("workers")
+
+
+# Full path of an input of a site (names are in the site's workspace)
+def input_path(site, name):
+    name = site[name]
+    return name if os.path.isabs(name) else os.path.join(site["workspace"], name)
+
+
+# Key of every stage of a site (parameters, input contents and the key of the stage before), as stage -> key
+def stage_keys(site):
+    keys = {}
+    for stage, (before, inputs, parameters) in STAGES.items():
+        keys[stage] = fingerprint(stage, {name: site[name] for name in parameters}, [dataset_signature(input_path(site, name), site["content_hash"]) for name in inputs],
+                                  keys.get(before))
+    return keys
+
+
+# True if the outputs of a stage of a site exist
+def outputs_exist(site, stage):
+    tag = str(site["tag"])
+    if stage == "sample":
+        return os.path.exists(os.path.join(site["out_folder"], tag + "_profiles", "meta.json"))
+    import arcpy
+    names = ["normals_thin_" + tag, "toe_thin_" + tag, "top_thin_" + tag] if stage == "thin" else ["extended_normals" + tag]
+    return all(arcpy.Exists(os.path.join(site["work"], name)) for name in names)
+
+
+def load_state(site): # stage -> key of the last successful run
+    try:
+        with open(os.path.join(site["scratch"], "state.json")) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(site, state):
+    path = os.path.join(site["scratch"], "state.json")
+    with open(path + ".tmp", "w") as state_file:
+        json.dump(state, state_file)
+    os.replace(path + ".tmp", path)
+
+
+# Run one stage of one site (in a worker process): the site's work.gdb is the ArcPy workspace, so all scratch layers and outputs go there
+def run_stage(site, stage):
+    import CrossSections
+    tag, work = site["tag"], site["work"]
+    if stage == "thin":
+        CrossSections.thin_it_out_fast(input_path(site, "normals"), input_path(site, "toe"), input_path(site, "top"), tag, site["stride"], site["spacing"], workspace=work)
+    elif stage == "extend":
+        CrossSections.extend_cross_sections_fast("normals_thin_" + str(tag), input_path(site, "coast"), tag, site["parallel_offsets"], cache=site["cache"], workspace=work)
+    elif stage == "sample":
+        os.makedirs(site["out_folder"], exist_ok=True)
+        CrossSections.get_the_good_stuff_fast("extended_normals" + str(tag), input_path(site, "dem"), tag, site["out_folder"], site["station_spacing"], site["csvs"], 
+                                              workspace=work)
+    return site["tag"], stage
+
+
+# Run the pipeline for the sites of a manifest (only the sites whose tags are in only, if given) with a pool of worker processes. force runs every stage again.
+# Returns (tag, stage) -> "up to date", "done", "failed: <error>" or "not run" (the stage it depends on failed).
+def run_pipeline(manifest, only=None, workers=None, force=False):
+    sites, manifest_workers = read_manifest(manifest)
+    sites = {site["tag"]: site for site in sites if only is None or site["tag"] in only}
+    workers = workers or manifest_workers or os.cpu_count() or 1
+
+    # Stages to run: key changed, outputs missing or a stage they depend on runs
+    status, keys, states, todo = {}, {}, {}, {}
+    for tag, site in sites.items():
+        keys[tag], states[tag] = stage_keys(site), load_state(site)
+        for stage, (before, inputs, parameters) in STAGES.items():
+            if force or (before is not None and (tag, before) in todo) or states[tag].get(stage) != keys[tag][stage] or not outputs_exist(site, stage):
+                todo[(tag, stage)] = before
+            else:
+                status[(tag, stage)] = "up to date"
+    for tag in {tag for tag, stage in todo}:
+        site = sites[tag]
+        os.makedirs(site["scratch"], exist_ok=True)
+        if not os.path.exists(site["work"]):
+            import arcpy
+            arcpy.management.CreateFileGDB(site["scratch"], "work.gdb")
+
+    # Run the graph: a stage is submitted once the stage it depends on is done
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while todo or running:
+            for node in [node for node, before in todo.items() if before is None or (node[0], before) not in todo and status.get((node[0], before)) in ("done", "up to date")]:
+                tag, stage = node
+                del todo[node]
+                states[tag].pop(stage, None) # a stage that fails half way is not up to date
+                save_state(sites[tag], states[tag])
+                running[pool.submit(run_stage, sites[tag], stage)] = node
+            for node in [node for node, before in todo.items() if status.get((node[0], before), "").startswith(("failed", "not run"))]:
+                del todo[node]
+                status[node] = "not run"
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                tag, stage = running.pop(future)
+                try:
+                    future.result()
+                except Exception as error:
+                    status[(tag, stage)] = "failed: " + repr(error)
+                else:
+                    status[(tag, stage)] = "done"
+                    states[tag][stage] = keys[tag][stage]
+                    save_state(sites[tag], states[tag])
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare cross sections and profiles (CrossSections.py) for the sites of a manifest.")
+    parser.add_argument("manifest", help="JSON manifest of the sites")
+    parser.add_argument("--sites", nargs="+", help="only run these sites (tags)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: manifest, then number of cores)")
+    parser.add_argument("--force", action="store_true", help="run every stage again, even if it is up to date")
+    args = parser.parse_args(argv)
+
+    status = run_pipeline(args.manifest, args.sites, args.workers, args.force)
+    for (tag, stage), result in sorted(status.items(), key=lambda item: (item[0][0], list(STAGES).index(item[0][1]))):
+        print(str(tag).ljust(30) + stage.ljust(8) + result)
+    if any(result.startswith(("failed", "not run")) for result in status.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# Vectorized extension of cross sections (CliffMetrics normals) to the offset lines around the coast, for CrossSections.extend_cross_sections_fast.
+# extend_cross_sections extends one normal at a time (MakeFeatureLayer, Merge, ExtendLine, a delete cursor and Append for every cross section). Here all normals
+# and all offset line segments (450 m landward and 20 m seaward of the coast) are held in arrays and every normal is extended at once:
+#   (1) each normal gives two rays, one from each end, pointing away from the line along its end segment (the direction ExtendLine extends in),
+#   (2) the offset line segments are put in a uniform grid (spatial index): every segment is registered in the cells its bounding box (plus a margin) covers,
+#   (3) rays are marched through the grid in rings of growing distance (expanding search). Points sampled along each ray give the cells it crosses, the segments
+#       registered there are the candidates, and all (ray, candidate) pairs are intersected at once. A ray stops at the first ring where it hits something, so
+#       most rays only ever look at the cells within a few hundred meters of their end,
+#   (4) each end of a normal is moved to the nearest hit of its ray (within max_distance, 10000 m like ExtendLine), or left where it is if there is none.
+# offset_polyline builds parallel offset lines of the coast with NumPy when the ArcPy buffers are not wanted.
+
+import math
+
+import numpy as np
+
+
+# Segments (x0, y0, x1, y1 arrays) of all the lines of a FeatureTable (feature_store.py) of polylines, part by part for multipart lines
+def polyline_segments(table):
+    bounds = table.part_offsets()
+    last = np.zeros(table.x.size, dtype=bool)
+    last[bounds[1:][np.diff(bounds) > 0] - 1] = True # last vertex of every part: no segment starts there
+    start = np.flatnonzero(~last)
+    return table.x[start], table.y[start], table.x[start + 1], table.y[start + 1]
+
+
+# Uniform grid over line segments: segments registered in every cell their bounding box, grown by margin, touches (cell -> segments as CSR arrays)
+class SegmentGrid:
+
+    def __init__(self, x0, y0, x1, y1, cell_size=None, max_cells=4000000): # (segment ends, cell edge (default: twice the median segment length), largest number of cells)
+        self.segments = tuple(np.asarray(a, dtype=np.float64) for a in (x0, y0, x1, y1))
+        lengths = np.hypot(self.segments[2] - x0, self.segments[3] - y0)
+        x_min, x_max = min(np.min(x0), np.min(x1)), max(np.max(x0), np.max(x1))
+        y_min, y_max = min(np.min(y0), np.min(y1)), max(np.max(y0), np.max(y1))
+        if cell_size is None:
+            cell_size = 2.0 * float(np.median(lengths)) if lengths.size else 1.0
+        cell_size = max(cell_size, math.sqrt((x_max - x_min + 1e-9) * (y_max - y_min + 1e-9) / max_cells), 1e-9)
+        self.cell_size = cell_size
+        self.margin = cell_size / 2.0 # rays are sampled every margin, so a hit is always within margin of a sample point
+        self.x_min, self.y_min = x_min - self.margin, y_min - self.margin
+        self.ncols = int(math.ceil((x_max - self.x_min + self.margin) / cell_size)) + 1
+        self.nrows = int(math.ceil((y_max - self.y_min + self.margin) / cell_size)) + 1
+
+        # Cells of every segment's grown bounding box
+        col0 = np.floor((np.minimum(x0, x1) - self.margin - self.x_min) / cell_size).astype(np.int64)
+        col1 = np.floor((np.maximum(x0, x1) + self.margin - self.x_min) / cell_size).astype(np.int64)
+        row0 = np.floor((np.minimum(y0, y1) - self.margin - self.y_min) / cell_size).astype(np.int64)
+        row1 = np.floor((np.maximum(y0, y1) + self.margin - self.y_min) / cell_size).astype(np.int64)
+        width, height = col1 - col0 + 1, row1 - row0 + 1
+        count = width * height
+        segment = np.repeat(np.arange(count.size), count)
+        k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) # position inside the segment's box
+        cell = (row0[segment] + k // width[segment]) * self.ncols + col0[segment] + k % width[segment]
+        order = np.argsort(cell, kind="stable")
+        self.cell_segments = segment[order]
+        self.cell_starts = np.searchsorted(cell[order], np.arange(self.nrows * self.ncols + 1)) # segments of cell c: cell_segments[cell_starts[c]:cell_starts[c + 1]]
+
+    def cells(self, x, y): # cell of every point, -1 outside the grid
+        col = np.floor((x - self.x_min) / self.cell_size).astype(np.int64)
+        row = np.floor((y - self.y_min) / self.cell_size).astype(np.int64)
+        inside = (col >= 0) & (col < self.ncols) & (row >= 0) & (row < self.nrows)
+        return np.where(inside, row * self.ncols + col, -1)
+
+    def candidates(self, cells, owners): # (owner, segment) pairs for every segment registered in the cells (owners: ray of every cell)
+        keep = cells >= 0
+        cells, owners = cells[keep], owners[keep]
+        start, stop = self.cell_starts[cells], self.cell_starts[cells + 1]
+        count = stop - start
+        owner = np.repeat(owners, count)
+        segment = self.cell_segments[np.repeat(start, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)]
+        return owner, segment
+
+
+# Nearest hit of every ray (origins ox, oy and unit directions dx, dy) on the segments of a SegmentGrid within max_distance. Rays are searched in rings of growing
+# length (first_ring, then doubling), sampled every grid.margin, max_samples points at a time. Returns the distance to the hit (inf where there is none).
+def cast_rays(grid, ox, oy, dx, dy, max_distance=10000.0, first_ring=None, max_samples=4000000):
+    distance = np.full(ox.size, np.inf)
+    active = np.arange(ox.size)
+    x0, y0, x1, y1 = grid.segments
+    step = grid.margin
+    near, far = 0.0, first_ring if first_ring is not None else 64 * step
+    while active.size and near < max_distance:
+        far = min(far, max_distance)
+        t = np.arange(near + step / 2, far + step, step) # samples covering [near, far] to within step / 2
+        chunk = max(1, max_samples // t.size) # rays per batch, so the sample arrays stay bounded
+        for start in range(0, active.size, chunk):
+            rays = active[start:start + chunk]
+            sample_x = ox[rays, None] + dx[rays, None] * t[None, :]
+            sample_y = oy[rays, None] + dy[rays, None] * t[None, :]
+            cells = grid.cells(sample_x.ravel(), sample_y.ravel())
+            key = np.unique(np.repeat(rays, t.size) * (grid.nrows * grid.ncols + 1) + (cells + 1)) # each cell once per ray
+            owner, segment = grid.candidates(key % (grid.nrows * grid.ncols + 1) - 1, key // (grid.nrows * grid.ncols + 1))
+            if not owner.size:
+                continue
+            pair = np.unique(owner * x0.size + segment) # each segment once per ray
+            ray, segment = pair // x0.size, pair % x0.size
+            ex, ey = x1[segment] - x0[segment], y1[segment] - y0[segment]
+            wx, wy = x0[segment] - ox[ray], y0[segment] - oy[ray]
+            denominator = dx[ray] * ey - dy[ray] * ex # zero for parallel segments
+            with np.errstate(divide="ignore", invalid="ignore"):
+                hit = (wx * ey - wy * ex) / denominator # distance along the ray
+                along = (wx * dy[ray] - wy * dx[ray]) / denominator # position along the segment (0 to 1)
+            found = (denominator != 0) & (along >= 0) & (along <= 1) & (hit > 1e-9) & (hit <= far)
+            np.minimum.at(distance, ray[found], hit[found])
+        active = active[~np.isfinite(distance[active])] # rays with a hit in this ring are done
+        near, far = far, 2 * far
+    distance[distance > max_distance] = np.inf
+    return distance
+
+
+# Extend every normal (FeatureTable of polylines) at both ends, along its end segments, to the nearest offset line segment within max_distance
+# (segments as (x0, y0, x1, y1) arrays, e.g. from polyline_segments). Ends with nothing to hit are left as they are.
+# Returns (new FeatureTable with the same fields, start extended, end extended) with a boolean per normal for each end.
+def extend_lines(normals, segments, max_distance=10000.0, grid=None):
+    from feature_store import FeatureTable
+    grid = grid if grid is not None else SegmentGrid(*segments)
+    first, last = normals.offsets[:-1], normals.offsets[1:] - 1
+    counts = np.diff(normals.offsets)
+    second, before_last = np.where(counts >= 2, first + 1, first), np.where(counts >= 2, last - 1, last) # a line of one point is its own neighbour
+    # Rays from the start (pointing back along the first segment) and from the end (along the last segment)
+    ox = np.concatenate([normals.x[first], normals.x[last]])
+    oy = np.concatenate([normals.y[first], normals.y[last]])
+    dx = np.concatenate([normals.x[first] - normals.x[second], normals.x[last] - normals.x[before_last]])
+    dy = np.concatenate([normals.y[first] - normals.y[second], normals.y[last] - normals.y[before_last]])
+    length = np.hypot(dx, dy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dx, dy = dx / length, dy / length
+    usable = (length > 0) & np.tile(counts >= 2, 2) # lines of one point (or with a zero length end segment) are not extended
+    distance = np.full(ox.size, np.inf)
+    distance[usable] = cast_rays(grid, ox[usable], oy[usable], dx[usable], dy[usable], max_distance)
+
+    # New lines: the ends moved to the hits
+    n = len(normals)
+    x, y = normals.x.copy(), normals.y.copy()
+    hit = np.isfinite(distance)
+    ends = np.concatenate([first, last])
+    x[ends[hit]] = ox[hit] + dx[hit] * distance[hit]
+    y[ends[hit]] = oy[hit] + dy[hit] * distance[hit]
+    return FeatureTable(normals.geometry_type, x, y, normals.fields, normals.offsets, normals.spatial_reference, normals.parts), hit[:n], hit[n:]
+
+
+# Parallel offset of a polyline by distance (positive: to the right of the line's direction, like Buffer "RIGHT"). Every vertex moves along the bisector of the
+# segments meeting there (mitred corners, limited to miter_limit times the distance). Returns (x, y) of the offset line.
+def offset_polyline(x, y, distance, miter_limit=4.0):
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    ex, ey = np.diff(x), np.diff(y)
+    length = np.hypot(ex, ey)
+    keep = length > 0 # drop repeated vertices
+    ex, ey, length = ex[keep], ey[keep], length[keep]
+    nx, ny = ey / length, -ex / length # right hand normal of every segment
+    # Every vertex moves along the bisector of the normals of the segments before and after it (the first and last vertex only have one)
+    before_x, before_y = np.concatenate([nx[:1], nx]), np.concatenate([ny[:1], ny])
+    after_x, after_y = np.concatenate([nx, nx[-1:]]), np.concatenate([ny, ny[-1:]])
+    vx, vy = before_x + after_x, before_y + after_y
+    norm = np.hypot(vx, vy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vx, vy = np.where(norm > 0, vx / norm, before_x), np.where(norm > 0, vy / norm, before_y) # a line doubling back on itself keeps the normal before
+    half_cosine = np.sqrt(np.maximum((1.0 + before_x * after_x + before_y * after_y) / 2.0, 1e-12)) # cosine of half the turning angle
+    scale = np.minimum(1.0 / half_cosine, miter_limit) # a mitred corner stays distance away from both segments
+    px, py = np.concatenate([x[:-1][keep], x[-1:]]), np.concatenate([y[:-1][keep], y[-1:]])
+    return px + vx * scale * distance, py + vy * scale * distance
+
+
+# Segments of the offset lines of every coast line (FeatureTable of polylines) at each of the distances (e.g. (450, -20) for 450 m right and 20 m left); every
+# part of a multipart line is offset on its own
+def offset_segments(coast, distances):
+    from feature_store import FeatureTable
+    xs, ys, offsets = [], [], [0]
+    bounds = coast.part_offsets()
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        x, y = coast.x[start:stop], coast.y[start:stop]
+        if x.size < 2:
+            continue
+        for distance in distances:
+            ox, oy = offset_polyline(x, y, distance)
+            xs.append(ox)
+            ys.append(oy)
+            offsets.append(offsets[-1] + ox.size)
+    lines = FeatureTable("POLYLINE", np.concatenate(xs), np.concatenate(ys), offsets=offsets)
+    return polyline_segments(lines)
@@ -0,0 +1,200 @@
+# Vertical datum offsets at survey points, sampled from the MSS and TSS grids made by MSS_TSS_final.py.
+# Instead of separate ArcGIS steps after MSS_generation/TSS_generation, the grids are sampled straight from Python (or from the command line) for whole arrays of
+# longitudes and latitudes at a time. Each point gets the bilinear interpolation of the four grid cells around it. Points are grouped by the tile they fall in, so
+# every tile is fetched once per batch and all its points are interpolated with a handful of array operations.
+# Grids are read lazily, one tile at a time, through a bounded least recently used cache of decoded tiles (tiled GeoTIFFs from tiled_tiff.py are read tile by
+# tile from their tile index, .npy grids are memory mapped), so a batch of points along one coast only ever touches the few tiles it needs.
+# Cells that are masked (land, outside the coverage) or NoData are NaN in the grids. By default a point next to such a cell gets NaN; with partial=True it gets the
+# interpolation of the valid cells around it instead (weights renormalized), so points close to the coastline still get an offset.
+#
+# Example: python datum_points.py soundings.csv --grid MSS=raster_MSS_xGeoid20.tif --grid TSS=raster_TSS_xGeoid20.tif --out soundings_offsets.csv
+# Points can also be a .npy array of (longitude, latitude) rows; the output is then a .npy array with a column per grid.
+
+import argparse
+import csv
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+from grid_io import open_grid
+
+
+# Least recently used cache of the decoded tiles of a grid. Tiles are tile_size x tile_size cells (the grid's own tiles for tiled GeoTIFFs), padded with NaN past
+# the edge of the grid. At most max_tiles tiles are kept in memory.
+class TileCache:
+
+    def __init__(self, grid, tile_size=256, max_tiles=256): # (grid from grid_io.open_grid or a path, tile edge in cells, largest number of tiles kept)
+        self.grid = open_grid(grid) if isinstance(grid, str) else grid
+        self.definition = self.grid.definition
+        self.native = hasattr(self.grid, "read_tile") # tiled GeoTIFF: use its own tiles
+        self.tile_size = self.grid.tile_size if self.native else (tile_size, tile_size)
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self.hits = self.misses = 0
+
+    def tile(self, tile_row, tile_col): # decoded tile as floats with NaN for NoData
+        key = (tile_row, tile_col)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return self.tiles[key]
+        self.misses += 1
+        rows, cols = self.tile_size
+        if self.native:
+            tile = self.grid.read_tile(tile_row, tile_col)
+        else:
+            row0, col0 = tile_row * rows, tile_col * cols
+            nrows, ncols = min(rows, self.definition.nrows - row0), min(cols, self.definition.ncols - col0)
+            tile = np.full((rows, cols), np.nan, dtype=np.float64)
+            tile[:nrows, :ncols] = self.grid.read(row0, col0, nrows, ncols)
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False) # least recently used
+        return tile
+
+    def block(self, tile_row, tile_col, wrap=False): # tile plus the first row and column of the next tiles (rows + 1 x columns + 1), for bilinear interpolation
+        rows, cols = self.tile_size
+        tiles_down, tiles_across = -(-self.definition.nrows // rows), -(-self.definition.ncols // cols)
+        block = np.full((rows + 1, cols + 1), np.nan)
+        block[:rows, :cols] = self.tile(tile_row, tile_col)
+        next_col = tile_col + 1
+        last_col = self.definition.ncols - tile_col * cols # columns of this tile inside the grid
+        if next_col < tiles_across:
+            block[:rows, cols] = self.tile(tile_row, next_col)[:, 0]
+        elif wrap: # the column after the last one is the first one
+            block[:rows, last_col] = self.tile(tile_row, 0)[:, 0]
+        if tile_row + 1 < tiles_down:
+            below = self.tile(tile_row + 1, tile_col)
+            block[rows, :cols] = below[0]
+            if next_col < tiles_across:
+                block[rows, cols] = self.tile(tile_row + 1, next_col)[0, 0]
+            elif wrap:
+                block[rows, last_col] = self.tile(tile_row + 1, 0)[0, 0]
+        return block
+
+
+# Bilinear interpolation of a grid at points (arrays of longitudes/x and latitudes/y in the grid's coordinates). Returns an array of values, NaN for points outside
+# the grid or next to NoData cells (with partial=True, points next to NoData cells get the interpolation of the valid cells around them).
+# grid is a TileCache, a grid or a path. Longitudes are wrapped around the world for global geographic grids.
+def sample_bilinear(grid, x, y, partial=False):
+    cache = grid if isinstance(grid, TileCache) else TileCache(grid)
+    d = cache.definition
+    x, y = np.asarray(x, dtype=np.float64).ravel(), np.asarray(y, dtype=np.float64).ravel()
+    wrap = abs(d.ncols * d.cell_width - 360.0) < d.cell_width / 2
+    if wrap:
+        x = d.x_min + np.mod(x - d.x_min, 360.0)
+    col = (x - d.x_min) / d.cell_width - 0.5 # position between cell centres
+    row = (d.y_max - y) / d.cell_height - 0.5
+    col0, row0 = np.floor(col), np.floor(row)
+    wx, wy = col - col0, row - row0
+    col0 = np.where(wrap & (col0 < 0), d.ncols - 1, col0) # west of the first cell centre: between the last and the first column
+    inside = (row >= -0.5) & (row <= d.nrows - 0.5) & (col >= -0.5) & (col <= d.ncols - 0.5) # inside the grid (edges get the edge cells)
+    inside &= np.isfinite(col) & np.isfinite(row)
+    row0 = np.clip(np.where(inside, row0, 0), -1, d.nrows - 1).astype(np.int64)
+    col0 = np.clip(np.where(inside, col0, 0), -1, d.ncols - 1).astype(np.int64)
+    row0, wy = np.where(row0 < 0, 0, row0), np.where(row0 < 0, 0.0, wy) # half a cell inside the edge: use the edge cell
+    if not wrap:
+        col0, wx = np.where(col0 < 0, 0, col0), np.where(col0 < 0, 0.0, wx)
+    wy = np.where(row0 == d.nrows - 1, 0.0, wy)
+    if not wrap:
+        wx = np.where(col0 == d.ncols - 1, 0.0, wx)
+
+    values = np.full(x.shape, np.nan)
+    rows, cols = cache.tile_size
+    tile_row, tile_col = row0 // rows, col0 // cols
+    key = tile_row * (-(-d.ncols // cols)) + tile_col
+    order = np.argsort(np.where(inside, key, -1), kind="stable") # points grouped by tile
+    sorted_key = np.where(inside, key, -1)[order]
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+    for start, stop in zip(starts, np.r_[starts[1:], sorted_key.size]):
+        if sorted_key[start] < 0: # outside the grid
+            continue
+        points = order[start:stop]
+        block = cache.block(int(tile_row[points[0]]), int(tile_col[points[0]]), wrap)
+        r, c = row0[points] - tile_row[points] * rows, col0[points] - tile_col[points] * cols
+        corners = np.stack([block[r, c], block[r, c + 1], block[r + 1, c], block[r + 1, c + 1]])
+        fx, fy = wx[points], wy[points]
+        weights = np.stack([(1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy])
+        used = weights > 0 # cells with no weight (e.g. past the edge) do not count, even if NoData
+        valid = ~np.isnan(corners) | ~used
+        corners = np.where(np.isnan(corners), 0.0, corners)
+        if partial:
+            total = np.where(valid & used, weights, 0.0).sum(axis=0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values[points] = np.where(total > 0, (corners * weights).sum(axis=0) / total, np.nan)
+        else:
+            values[points] = np.where(valid.all(axis=0), (corners * weights).sum(axis=0), np.nan)
+    return values
+
+
+# Offsets from every grid (name -> TileCache, grid or path) at the points. Returns name -> array of values.
+def transform_points(x, y, grids, partial=False):
+    return {name: sample_bilinear(grid, x, y, partial) for name, grid in grids.items()}
+
+
+# Points of a .csv (with a header) in chunks of up to chunk_size rows: yields (longitudes, latitudes, rows as lists of strings)
+def read_csv_points(path, x_field="lon", y_field="lat", chunk_size=1000000):
+    with open(path, newline="") as table:
+        reader = csv.reader(table)
+        header = next(reader)
+        x_index, y_index = header.index(x_field), header.index(y_field)
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if not rows:
+                break
+            x = np.array([row[x_index] for row in rows], dtype=np.float64)
+            y = np.array([row[y_index] for row in rows], dtype=np.float64)
+            yield header, x, y, rows
+
+
+# Add a column per grid to a .csv of points, chunk by chunk. Cells without a value are left empty.
+def transform_csv(points, out_table, grids, x_field="lon", y_field="lat", partial=False, chunk_size=1000000):
+    caches = {name: TileCache(grid) for name, grid in grids.items()} # shared by all chunks
+    count = 0
+    with open(out_table, "w", newline="") as table:
+        writer = csv.writer(table)
+        for number, (header, x, y, rows) in enumerate(read_csv_points(points, x_field, y_field, chunk_size)):
+            if number == 0:
+                writer.writerow(header + list(caches))
+            offsets = transform_points(x, y, caches, partial)
+            columns = [np.where(np.isnan(values), "", np.char.mod("%.4f", values)) for values in offsets.values()]
+            writer.writerows(row + list(extra) for row, extra in zip(rows, zip(*columns)))
+            count += len(rows)
+    return count
+
+
+# Offsets at the points of a .npy array of (longitude, latitude) rows, saved as a .npy array with a column per grid. Returns the number of points.
+def transform_npy(points, out_array, grids, partial=False, chunk_size=10000000):
+    xy = np.load(points, mmap_mode="r")
+    caches = {name: TileCache(grid) for name, grid in grids.items()}
+    out = np.lib.format.open_memmap(out_array, mode="w+", dtype=np.float64, shape=(xy.shape[0], len(caches)))
+    for start in range(0, xy.shape[0], chunk_size):
+        chunk = np.asarray(xy[start:start + chunk_size])
+        for column, values in enumerate(transform_points(chunk[:, 0], chunk[:, 1], caches, partial).values()):
+            out[start:start + chunk.shape[0], column] = values
+    out.flush()
+    return xy.shape[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sample MSS/TSS grids (bilinear) at survey points.", fromfile_prefix_chars="@")
+    parser.add_argument("points", help="points: .csv with a header, or .npy array of (longitude, latitude) rows")
+    parser.add_argument("--grid", action="append", required=True, metavar="NAME=PATH", help="grid to sample, e.g. MSS=raster_MSS.tif (repeat for several grids)")
+    parser.add_argument("--out", required=True, help="output .csv (the input columns plus one per grid) or .npy (one column per grid)")
+    parser.add_argument("--lon-field", default="lon", help="longitude column of a .csv")
+    parser.add_argument("--lat-field", default="lat", help="latitude column of a .csv")
+    parser.add_argument("--partial", action="store_true", help="interpolate from the valid cells next to NoData cells instead of giving no value")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="points processed at a time")
+    args = parser.parse_args(argv)
+
+    grids = dict(grid.split("=", 1) for grid in args.grid)
+    if str(args.points).lower().endswith(".npy"):
+        count = transform_npy(args.points, args.out, grids, args.partial, args.chunk_size)
+    else:
+        count = transform_csv(args.points, args.out, grids, args.lon_field, args.lat_field, args.partial, args.chunk_size)
+    print(str(count) + " points written to " + str(args.out))
+
+
+if __name__ == "__main__":
+    main()
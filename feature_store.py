@@ -0,0 +1,191 @@
+# Compact columnar store for CliffMetrics features (normals, cliff toe and cliff top points) and the vectorized thinning used by CrossSections.thin_it_out_fast.
+# A feature class is read once into NumPy arrays: the coordinates (one x/y per point, or every vertex of every line with an offsets array marking where each line
+# starts) and one array per attribute field. Selecting features is then array indexing instead of deleting rows one at a time with an UpdateCursor, and the result
+# is written to a new feature class in one go: its OBJECTIDs are numbered 1, 2, 3, ... and only the fields that are kept are written, so the CopyFeatures and
+# DeleteField passes are not needed either.
+# Thinning selects profiles (by CliffMetrics profile number: "Normal" on the normals, "nProf" on the toe and top points), so the normals, toe points and top
+# points that are kept always belong to the same cross sections. Profiles are kept either every Nth one (stride) or at least a given distance apart along the
+# coast (spacing). Stores can also be saved to and loaded from .npz files, so later steps can reuse them without ArcPy.
+
+import os
+
+import numpy as np
+
+
+# Features as columns: geometry_type "POINT" (x, y per feature) or "POLYLINE" (x, y per vertex, offsets of length features + 1 so feature i has the vertices
+# offsets[i]:offsets[i + 1]), fields as name -> array with a value per feature, and the spatial reference as a string (ArcPy exportToString) or None.
+# Multipart lines have their vertices one part after the other and parts gives the vertex offsets of every part (parts + 1 values, every feature offset is one
+# of them); parts is None when every line has a single part.
+class FeatureTable:
+
+    def __init__(self, geometry_type, x, y, fields=None, offsets=None, spatial_reference=None, parts=None):
+        self.geometry_type = geometry_type.upper()
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64) if offsets is not None else None
+        self.parts = np.asarray(parts, dtype=np.int64) if parts is not None else None
+        self.fields = dict(fields or {})
+        self.spatial_reference = spatial_reference
+        if self.geometry_type == "POLYLINE" and self.offsets is None:
+            raise ValueError("Polylines need vertex offsets")
+
+    def __len__(self):
+        return self.offsets.size - 1 if self.offsets is not None else self.x.size
+
+    def vertices(self, i): # (x, y) arrays of the vertices of feature i
+        if self.offsets is None:
+            return self.x[i:i + 1], self.y[i:i + 1]
+        return self.x[self.offsets[i]:self.offsets[i + 1]], self.y[self.offsets[i]:self.offsets[i + 1]]
+
+    def part_offsets(self): # vertex offsets of every part of every line (the feature offsets when all lines are single part)
+        return self.parts if self.parts is not None else self.offsets
+
+    def part_vertices(self, i): # list of (x, y) arrays of the parts of feature i
+        bounds = self.part_offsets()
+        first, last = np.searchsorted(bounds, [self.offsets[i], self.offsets[i + 1]])
+        return [(self.x[start:stop], self.y[start:stop]) for start, stop in zip(bounds[first:last], bounds[first + 1:last + 1])]
+
+    def first_points(self): # (x, y) of the first vertex of every feature (the point itself for points)
+        if self.offsets is None:
+            return self.x, self.y
+        return self.x[self.offsets[:-1]], self.y[self.offsets[:-1]]
+
+    def take(self, index): # new table with the features at index (integer array or boolean mask), in that order
+        index = np.flatnonzero(index) if np.asarray(index).dtype == bool else np.asarray(index, dtype=np.int64)
+        fields = {name: values[index] for name, values in self.fields.items()}
+        if self.offsets is None:
+            return FeatureTable(self.geometry_type, self.x[index], self.y[index], fields, None, self.spatial_reference)
+        counts = np.diff(self.offsets)[index]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        vertex = np.repeat(self.offsets[index] - offsets[:-1], counts) + np.arange(offsets[-1]) # source vertex of every new vertex
+        parts = None
+        if self.parts is not None: # whole features are copied, so a new vertex starts a part where its source vertex does
+            part_start = np.zeros(self.x.size + 1, dtype=bool)
+            part_start[self.parts] = True
+            parts = np.append(np.flatnonzero(part_start[vertex]), offsets[-1])
+        return FeatureTable(self.geometry_type, self.x[vertex], self.y[vertex], fields, offsets, self.spatial_reference, parts)
+
+    def select_fields(self, keep=None, drop=()): # new table with only the fields in keep (all if None) minus the fields in drop (shares the arrays)
+        names = [name for name in (keep if keep is not None else self.fields) if name not in set(drop)]
+        return FeatureTable(self.geometry_type, self.x, self.y, {name: self.fields[name] for name in names}, self.offsets, self.spatial_reference,
+                            self.parts)
+
+    def fingerprint(self): # content hash of the geometry, fields and spatial reference (artifact_cache.fingerprint), to key what is computed from the features
+        from artifact_cache import fingerprint
+        return fingerprint(self.geometry_type, self.x, self.y, self.offsets, self.fields, self.spatial_reference, self.parts)
+
+    def save(self, path): # .npz file with every column
+        arrays = {"x": self.x, "y": self.y, "geometry_type": np.array(self.geometry_type), "spatial_reference": np.array(self.spatial_reference or "")}
+        if self.offsets is not None:
+            arrays["offsets"] = self.offsets
+        if self.parts is not None:
+            arrays["parts"] = self.parts
+        arrays.update({"field_" + name: values for name, values in self.fields.items()})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            fields = {name[len("field_"):]: arrays[name] for name in arrays.files if name.startswith("field_")}
+            offsets = arrays["offsets"] if "offsets" in arrays.files else None
+            parts = arrays["parts"] if "parts" in arrays.files else None
+            return cls(str(arrays["geometry_type"]), arrays["x"], arrays["y"], fields, offsets, str(arrays["spatial_reference"]) or None, parts)
+
+
+# Read a point or polyline feature class into a FeatureTable with a single ArcPy call per feature class. fields: attribute fields to read (None for all of them
+# except OBJECTID and the geometry). The vertices come from one exploded read; the parts of multipart lines are then counted with a cursor over the shapes, which
+# only looks at the vertices of lines with more than one part, so that no segment is made across the gap between two parts.
+def read_features(feature_class, fields=None):
+    import arcpy
+    description = arcpy.Describe(feature_class)
+    geometry_type = description.shapeType.upper()
+    if fields is None:
+        fields = [field.name for field in arcpy.ListFields(feature_class) if field.type not in ("OID", "Geometry") and field.name.upper() not in ("SHAPE_LENGTH", "SHAPE_AREA")]
+    spatial_reference = description.spatialReference.exportToString()
+    if geometry_type == "POINT":
+        table = arcpy.da.FeatureClassToNumPyArray(feature_class, ["SHAPE@X", "SHAPE@Y"] + list(fields))
+        return FeatureTable("POINT", table["SHAPE@X"], table["SHAPE@Y"], {name: table[name] for name in fields}, None, spatial_reference)
+    if geometry_type != "POLYLINE":
+        raise ValueError("Only point and polyline feature classes are supported, " + str(feature_class) + " is " + geometry_type)
+    vertices = arcpy.da.FeatureClassToNumPyArray(feature_class, ["OID@", "SHAPE@X", "SHAPE@Y"], explode_to_points=True) # every vertex, in order, with its feature's OID
+    table = arcpy.da.FeatureClassToNumPyArray(feature_class, ["OID@"] + list(fields))
+    starts = np.searchsorted(vertices["OID@"], table["OID@"]) # vertices of a feature are contiguous and features come in OID order
+    offsets = np.append(starts, vertices.size)
+    part_starts = [] # vertex offsets of the second, third, ... part of multipart lines
+    with arcpy.da.SearchCursor(feature_class, ["OID@", "SHAPE@"]) as cursor:
+        for oid, shape in cursor:
+            if shape is not None and shape.partCount > 1:
+                sizes = [part.count for part in shape]
+                start = offsets[np.searchsorted(table["OID@"], oid)]
+                part_starts.extend(start + np.cumsum(sizes[:-1]))
+    parts = np.union1d(offsets, part_starts) if part_starts else None
+    return FeatureTable("POLYLINE", vertices["SHAPE@X"], vertices["SHAPE@Y"], {name: table[name] for name in fields}, offsets, spatial_reference, parts)
+
+
+# ArcGIS field type for a NumPy array
+def field_type(values):
+    kind = values.dtype.kind
+    if kind in "iub":
+        return "LONG" if values.dtype.itemsize <= 4 else "DOUBLE"
+    if kind == "f":
+        return "DOUBLE"
+    return "TEXT"
+
+
+# Write a FeatureTable to a new feature class (replaced if it exists) in one pass: OBJECTIDs are numbered from 1 and only the table's fields are created.
+def write_features(table, out_fc, workspace=None):
+    import arcpy
+    workspace = workspace if workspace is not None else arcpy.env.workspace
+    if arcpy.Exists(os.path.join(workspace, out_fc)) == 1: # checks to see if name already exists
+        arcpy.Delete_management(os.path.join(workspace, out_fc))
+    spatial_reference = None
+    if table.spatial_reference:
+        spatial_reference = arcpy.SpatialReference()
+        spatial_reference.loadFromString(table.spatial_reference)
+    arcpy.management.CreateFeatureclass(workspace, out_fc, table.geometry_type, spatial_reference=spatial_reference)
+    out_path = os.path.join(workspace, out_fc)
+    names = list(table.fields)
+    for name in names:
+        values = table.fields[name]
+        length = max(1, values.dtype.itemsize // 4 if values.dtype.kind == "U" else values.dtype.itemsize) if field_type(values) == "TEXT" else None # characters
+        arcpy.management.AddField(out_path, name, field_type(values), field_length=length)
+    columns = [table.fields[name].tolist() for name in names] # plain Python values for the cursor
+    with arcpy.da.InsertCursor(out_path, ["SHAPE@"] + names) as cursor:
+        for i in range(len(table)):
+            x, y = table.vertices(i)
+            if table.offsets is None:
+                shape = arcpy.PointGeometry(arcpy.Point(float(x[0]), float(y[0])), spatial_reference)
+            else:
+                shape = arcpy.Polyline(arcpy.Array([arcpy.Array([arcpy.Point(float(a), float(b)) for a, b in zip(px, py)]) for px, py in table.part_vertices(i)]),
+                                       spatial_reference)
+            cursor.insertRow([shape] + [column[i] for column in columns])
+    return out_path
+
+
+# Profiles kept by keeping every stride-th profile (in profile number order), like keeping OBJECTIDs 15, 30, 45, ... of the CliffMetrics outputs
+def stride_profiles(profiles, stride=15):
+    unique = np.unique(profiles)
+    return unique[stride - 1::stride]
+
+
+# Profiles kept so that they are about spacing apart along the coast: the distance along the coast is the running sum of the distances between the anchor points
+# (x, y) of consecutive profiles, and the first profile of every spacing long stretch is kept.
+def spacing_profiles(profiles, x, y, spacing):
+    order = np.argsort(profiles, kind="stable")
+    along = np.concatenate([[0.0], np.cumsum(np.hypot(np.diff(x[order]), np.diff(y[order])))])
+    first = np.unique(np.floor(along / spacing), return_index=True)[1]
+    return np.asarray(profiles)[order][first]
+
+
+# Thin normals and the matching toe/top points to the same profiles. normals is a FeatureTable of the normals, points a list of FeatureTables (toe points, top
+# points); profiles are chosen on the normals (stride, or spacing along the coast when spacing is given) and kept in every table.
+# Returns (thinned normals, [thinned points tables]).
+def thin_profiles(normals, points, stride=15, spacing=None, normal_field="Normal", point_field="nProf"):
+    profiles = normals.fields[normal_field]
+    if spacing is None:
+        kept = stride_profiles(profiles, stride)
+    else:
+        x, y = normals.first_points() # where each normal starts, on the coast
+        kept = spacing_profiles(profiles, x, y, spacing)
+    thinned = normals.take(np.isin(profiles, kept))
+    return thinned, [table.take(np.isin(table.fields[point_field], kept)) for table in points]
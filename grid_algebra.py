@@ -0,0 +1,164 @@
+# Fused, tiled raster algebra for the MSS and TSS grids (see MSS_TSS_final.py).
+# RasterCalculator needs every input cropped to the final mask first, which writes a masked copy of every input grid before the equation is even evaluated.
+# Here the equation ("a+b+c", "a-b-c-d", ...) is compiled once and evaluated tile by tile: each tile of every input is read once, the equation is evaluated straight
+# into the matching tile of a preallocated output grid and the mask is applied to that tile. No masked copies of the inputs are ever written.
+# Tiles that are completely masked (e.g. all land) are filled with NoData without reading the inputs at all.
+# Several products (e.g. MSS and TSS) can be evaluated in the same pass: every input tile is then read once and shared by all the products that use it.
+
+import ast
+
+import numpy as np
+
+from grid_io import iter_blocks
+
+
+# Operators allowed in an expression and the NumPy functions that evaluate them in place
+BINARY_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+UNARY_OPERATORS = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+
+# Raster calculator expression (+, -, *, /, parentheses, numbers and input names) compiled for repeated evaluation on tiles.
+# Intermediate results go into scratch buffers that are allocated once per tile shape and reused for every tile, the final result goes straight into the output tile.
+class Expression:
+
+    def __init__(self, text, names): # (expression such as "a+b+c", names of the inputs it may use)
+        self.text = text
+        self.names = list(names)
+        self.tree = ast.parse(text, mode="eval").body
+        self.used = set() # names the expression actually uses, filled in by check
+        self.check(self.tree)
+        self.scratch = {} # (depth, shape) -> buffer
+
+    def check(self, node): # only plain arithmetic on the named inputs is allowed
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            self.check(node.left)
+            self.check(node.right)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            self.check(node.operand)
+        elif isinstance(node, ast.Name):
+            if node.id not in self.names:
+                raise ValueError("Unknown input '" + node.id + "' in expression " + self.text)
+            self.used.add(node.id)
+        elif not (isinstance(node, ast.Constant) and isinstance(node.value, (int, float))):
+            raise ValueError("Unsupported expression " + self.text)
+
+    def evaluate(self, values, out): # evaluate with values (name -> block) into out (a block of the same shape)
+        result = self.evaluate_node(self.tree, values, out, 0)
+        if result is not out: # a lone input or number
+            out[...] = result
+        return out
+
+    def evaluate_node(self, node, values, out, depth): # returns the result, which is either out, an input block or a number
+        if isinstance(node, ast.Name):
+            return values[node.id]
+        if isinstance(node, ast.Constant):
+            return float(node.value)
+        if isinstance(node, ast.UnaryOp):
+            operand = self.evaluate_node(node.operand, values, out, depth)
+            return UNARY_OPERATORS[type(node.op)](operand, out=out)
+        left = self.evaluate_node(node.left, values, out, depth) # the left side can reuse the output tile
+        right = self.evaluate_node(node.right, values, self.buffer(depth, out), depth + 1) # the right side needs its own buffer if it is not a plain input
+        return BINARY_OPERATORS[type(node.op)](left, right, out=out)
+
+    def buffer(self, depth, out): # scratch buffer for intermediate results at this depth of the expression
+        key = (depth, out.shape, out.dtype)
+        if key not in self.scratch:
+            self.scratch[key] = np.empty(out.shape, dtype=out.dtype)
+        return self.scratch[key]
+
+
+# One output of a tiled evaluation: an expression, the array it is written into and an optional mask (boolean array or object with read(), in the output's cells).
+# window = (row0, col0, rows, columns) places the output inside the tiled area when it only covers part of it (e.g. TSS inside the global MSS grid).
+class Product:
+
+    def __init__(self, expression, out, mask=None, window=None, names=None): # (expression text or Expression, output array, cells to keep, place in the tiled area, input names)
+        self.expression = expression if isinstance(expression, Expression) else Expression(expression, names)
+        self.out = out
+        self.mask = mask
+        self.window = window if window is not None else (0, 0) + tuple(out.shape)
+
+
+# Input grid placed inside the tiled area: its first cell is at (row0, col0) of the tiled area. Used for inputs that only cover part of it.
+class Placed:
+
+    def __init__(self, grid, row0, col0):
+        self.grid = grid
+        self.offset = (row0, col0)
+
+    def read(self, row0, col0, nrows, ncols):
+        return self.grid.read(row0 - self.offset[0], col0 - self.offset[1], nrows, ncols)
+
+
+# Evaluate an expression over aligned grids tile by tile into a preallocated output array (e.g. OutputGrid.array or a memory mapped .npy).
+# inputs maps the expression's names to grids (see grid_io.py) covering the same cells as out. mask (optional) is a boolean array over the same cells (or any
+# object with a read(row0, col0, rows, columns) method); cells where it is False get NoData (NaN) and fully masked tiles are skipped without reading the inputs.
+def evaluate_tiled(expression, inputs, out, mask=None, tile_size=1024): # (expression text or Expression, name -> grid, output array, cells to keep, tile edge in cells)
+    for name, grid in inputs.items(): # inputs must line up with the output
+        if grid.definition.shape != out.shape:
+            raise ValueError("Input " + name + " of shape " + str(grid.definition.shape) + " does not match output of shape " + str(out.shape))
+    evaluate_tiled_many([Product(expression, out, mask, names=inputs.keys())], inputs, out.shape, tile_size)
+    return out
+
+
+# Evaluate several products in one pass over an area of the given shape (rows, columns). inputs maps names to grids in the area's cells (wrap inputs that only cover
+# part of it in Placed). In every tile, each input is read once, over the cells the products that use it need, and shared by all of them.
+# area = (row0, col0, rows, columns) limits the evaluation to part of the tiled area (e.g. one latitude band, see band_scheduler.py).
+def evaluate_tiled_many(products, inputs, shape, tile_size=1024, area=None):
+    area = area if area is not None else (0, 0) + tuple(shape)
+    for block in iter_blocks(area[2], area[3], tile_size):
+        tile = (area[0] + block[0], area[1] + block[1], block[2], block[3])
+        jobs = [] # (product, cells of the tile it covers, output block, mask block)
+        for product in products:
+            cells = intersect_windows(tile, product.window)
+            if cells is None: # product does not reach this tile
+                continue
+            local = (cells[0] - product.window[0], cells[1] - product.window[1], cells[2], cells[3]) # same cells in the product's own rows and columns
+            out_block = product.out[local[0]:local[0] + local[2], local[1]:local[1] + local[3]] # view into the output, written in place
+            keep = read_mask(product.mask, *local)
+            if keep is not None and not keep.any(): # nothing to compute for this product here
+                out_block[...] = np.nan
+                continue
+            jobs.append((product, cells, out_block, keep))
+
+        regions = {} # cells to read for every input: the union of what the products using it need
+        for product, cells, out_block, keep in jobs:
+            for name in product.expression.used:
+                regions[name] = union_windows(regions.get(name), cells)
+        blocks = {name: (region, inputs[name].read(*region)) for name, region in regions.items()} # every input tile is read once
+
+        for product, cells, out_block, keep in jobs:
+            values = {}
+            for name in product.expression.used:
+                region, block = blocks[name]
+                row, col = cells[0] - region[0], cells[1] - region[1]
+                values[name] = block[row:row + cells[2], col:col + cells[3]]
+            product.expression.evaluate(values, out_block)
+            if keep is not None:
+                out_block[~keep] = np.nan
+
+
+# Cells two (row0, col0, rows, columns) windows have in common, or None
+def intersect_windows(a, b):
+    row0, col0 = max(a[0], b[0]), max(a[1], b[1])
+    row1, col1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if row1 <= row0 or col1 <= col0:
+        return None
+    return (row0, col0, row1 - row0, col1 - col0)
+
+
+# Smallest window covering both windows (a may be None)
+def union_windows(a, b):
+    if a is None:
+        return b
+    row0, col0 = min(a[0], b[0]), min(a[1], b[1])
+    row1, col1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return (row0, col0, row1 - row0, col1 - col0)
+
+
+# Tile of a mask given as an array or as a grid-like object with read(), as booleans (None if there is no mask)
+def read_mask(mask, row0, col0, nrows, ncols):
+    if mask is None:
+        return None
+    if hasattr(mask, "read"):
+        return mask.read(row0, col0, nrows, ncols) > 0
+    return np.asarray(mask[row0:row0 + nrows, col0:col0 + ncols], dtype=bool)
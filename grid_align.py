@@ -0,0 +1,138 @@
+# Put grids that do not line up cell for cell onto one target grid, on the fly, for the MSS and TSS equations (see MSS_TSS_final.py).
+# CNES' MSS (1 minute), xGeoid20 and the MATLAB conversion grids come with their own extents and cell sizes. Instead of resampling them by hand in ArcGIS Pro before
+# every run, the common coverage of all the inputs is found from their georeferencing, a target grid is laid over it (on the cells of a reference input, CNES' MSS
+# by default) and every other input is resampled onto it block by block as it is read (nearest neighbour or bilinear).
+# For north-up grids, the source rows and columns (and bilinear weights) of a target cell only depend on the target row and the target column respectively, so a
+# resampling plan is just two short index/weight arrays per grid pair. Plans are computed once per (source grid, target grid, method) and kept in a GridCache,
+# so later runs with the same grids reuse them. Inputs that already line up with the target are only cropped (no resampling).
+
+import math
+
+import numpy as np
+
+from grid_cache import as_cache, fingerprint
+from grid_io import common_windows
+
+
+# Extent (x_min, y_min, x_max, y_max) covered by every grid
+def common_coverage(definitions):
+    x_min = max(d.x_min for d in definitions)
+    y_min = max(d.y_min for d in definitions)
+    x_max = min(d.x_max for d in definitions)
+    y_max = min(d.y_max for d in definitions)
+    if x_max <= x_min or y_max <= y_min:
+        raise ValueError("Grids do not overlap")
+    return x_min, y_min, x_max, y_max
+
+
+# Target grid: the cells of the reference grid that lie completely inside the common coverage of all the grids
+def target_grid(definitions, reference=0, tolerance=1e-6):
+    ref = definitions[reference]
+    x_min, y_min, x_max, y_max = common_coverage(definitions)
+    col0 = int(math.ceil((x_min - ref.x_min) / ref.cell_width - tolerance))
+    col1 = int(math.floor((x_max - ref.x_min) / ref.cell_width + tolerance))
+    row0 = int(math.ceil((ref.y_max - y_max) / ref.cell_height - tolerance))
+    row1 = int(math.floor((ref.y_max - y_min) / ref.cell_height + tolerance))
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError("Common coverage is smaller than one cell of the reference grid")
+    return ref.window(row0, col0, row1 - row0, col1 - col0)
+
+
+# Source cells and weights along one axis. centres: target cell centres in source cell units (0.5 = centre of the first source cell).
+# Returns (first index, second index, weight of the second, valid) arrays. Out of range targets are marked invalid; wrap joins the last cell to the first (global longitudes).
+def axis_plan(centres, size, method, wrap=False):
+    if method == "nearest":
+        first = np.floor(centres).astype(np.int64)
+        second = first.copy()
+        weight = np.zeros(centres.size)
+    elif method == "bilinear":
+        position = centres - 0.5 # position between source cell centres
+        nearest = np.round(position)
+        position = np.where(np.abs(position - nearest) < 1e-9, nearest, position) # rounding errors on target cells that sit on a source cell centre
+        first = np.floor(position).astype(np.int64)
+        second = first + 1
+        weight = position - first
+    else:
+        raise ValueError("Unknown resampling method " + str(method))
+    second = np.where(weight == 0, first, second) # cell centre hit exactly: the second cell is not needed
+    if wrap:
+        first, second = first % size, second % size
+        valid = np.ones(centres.size, dtype=bool)
+    else:
+        valid = (first >= 0) & (second < size)
+        first, second = np.clip(first, 0, size - 1), np.clip(second, 0, size - 1)
+    return first, second, weight, valid
+
+
+# Resampling plan from a source grid to a target grid: per-row and per-column source indices and weights
+def resample_plan(source, target, method="bilinear"):
+    wrap = abs(source.ncols * source.cell_width - 360.0) < source.cell_width / 2 # global in longitude
+    col_centres = (target.x_min + (np.arange(target.ncols) + 0.5) * target.cell_width - source.x_min) / source.cell_width
+    row_centres = (source.y_max - (target.y_max - (np.arange(target.nrows) + 0.5) * target.cell_height)) / source.cell_height
+    plan = {}
+    for axis, centres, size, axis_wrap in (("row", row_centres, source.nrows, False), ("col", col_centres, source.ncols, wrap)):
+        first, second, weight, valid = axis_plan(centres, size, method, axis_wrap)
+        plan[axis + "_first"], plan[axis + "_second"], plan[axis + "_weight"], plan[axis + "_valid"] = first, second, weight, valid
+    return plan
+
+
+# Resampling plan, taken from the cache when the same (source, target, method) has been planned before
+def cached_resample_plan(source, target, method="bilinear", cache=None):
+    cache = as_cache(cache)
+    key = fingerprint("resample_plan", tuple(source), tuple(target), method)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0]
+    plan = resample_plan(source, target, method)
+    if cache is not None:
+        cache.put(key, plan, {"method": method, "source": source.to_dict(), "target": target.to_dict()})
+    return plan
+
+
+# A source grid seen through a resampling plan: reads return blocks of the target grid, computed from the source cells they need
+class ResampledGrid:
+
+    def __init__(self, source, definition, plan): # (source grid, target GridDefinition, plan from resample_plan)
+        self.source = source
+        self.definition = definition
+        self.plan = plan
+        self.nodata = None
+
+    def read(self, row0, col0, nrows, ncols):
+        p = self.plan
+        rows = slice(row0, row0 + nrows)
+        cols = slice(col0, col0 + ncols)
+        row_first, row_second, row_weight = p["row_first"][rows], p["row_second"][rows], p["row_weight"][rows][:, None]
+        col_first, col_second, col_weight = p["col_first"][cols], p["col_second"][cols], p["col_weight"][cols][None, :]
+
+        # Read the source window covering every source cell this block needs (all columns if the block wraps around the grid edge)
+        source_rows = (int(min(row_first.min(), row_second.min())), int(max(row_first.max(), row_second.max())) + 1)
+        source_cols = (int(min(col_first.min(), col_second.min())), int(max(col_first.max(), col_second.max())) + 1)
+        block = self.source.read(source_rows[0], source_cols[0], source_rows[1] - source_rows[0], source_cols[1] - source_cols[0])
+        r1, r2 = row_first - source_rows[0], row_second - source_rows[0]
+        c1, c2 = col_first - source_cols[0], col_second - source_cols[0]
+
+        top = block[np.ix_(r1, c1)] * (1.0 - col_weight) + block[np.ix_(r1, c2)] * col_weight
+        bottom = block[np.ix_(r2, c1)] * (1.0 - col_weight) + block[np.ix_(r2, c2)] * col_weight
+        values = top * (1.0 - row_weight) + bottom * row_weight # NoData (NaN) in any cell used gives NoData
+        valid = p["row_valid"][rows][:, None] & p["col_valid"][cols][None, :]
+        values[~valid] = np.nan # outside the source grid
+        return values
+
+
+# Put a grid on the target grid: a crop (window) if its cells already line up with the target, otherwise resampled with a (cached) plan
+def aligned_grid(grid, target, method="bilinear", cache=None):
+    try:
+        window = common_windows([target, grid.definition])[1]
+        if (window[2], window[3]) == target.shape: # lines up and covers the whole target
+            return grid.window(*window)
+    except ValueError: # different cell size or not aligned
+        pass
+    return ResampledGrid(grid, target, cached_resample_plan(grid.definition, target, method, cache))
+
+
+# Put any number of grids onto one target grid: the reference grid's cells inside the common coverage of all of them
+def align_grids(grids, method="bilinear", cache=None, reference=0):
+    target = target_grid([grid.definition for grid in grids], reference)
+    return [aligned_grid(grid, target, method, cache) for grid in grids]
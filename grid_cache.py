@@ -0,0 +1,43 @@
+# On-disk cache of computed grids (for example the offshore masks of MSS_TSS_final.py), so they are built once and reused by every later run.
+# Each entry is a folder named after a content hash of everything the grid was computed from (see fingerprint). It holds the arrays as .npy files, which are
+# memory mapped when the entry is loaded, plus a meta.json file. Entries are written to a temporary folder first and then renamed into place, so a run that is
+# interrupted (or two runs writing the same entry) never leave a half written entry behind.
+# The cache is bounded in size: when it grows past max_bytes, the least recently used entries are deleted (and, with max_age, entries that have not been used for
+# that long). GridCache is an artifact_cache.ArtifactCache, so the same folder can also hold the other intermediates of the three scripts.
+
+import os
+
+import numpy as np
+
+from artifact_cache import ArtifactCache, fingerprint, update_fingerprint # fingerprint is imported from here by the grid modules
+
+
+class GridCache(ArtifactCache):
+
+    def get(self, key): # (arrays as name -> memory mapped array, meta) of an entry, or None if it is not cached
+        found = self.lookup(key)
+        if found is None:
+            return None
+        entry, meta = found
+        try:
+            arrays = {name: np.load(os.path.join(entry, name + ".npy"), mmap_mode="r") for name in meta["arrays"]}
+        except (OSError, ValueError, KeyError): # evicted in the meantime or damaged
+            return None
+        return arrays, meta
+
+    def put(self, key, arrays, meta=None): # store arrays (name -> array) and optional meta (dict) under key, then evict old entries if the cache is too big
+        def write(folder):
+            for name, array in arrays.items():
+                np.save(os.path.join(folder, name + ".npy"), array)
+        meta = dict(meta or {})
+        meta["arrays"] = list(arrays)
+        self.store(key, write, meta)
+
+
+# A GridCache from a folder name, or the cache itself (None stays None: no caching)
+def as_cache(cache):
+    if cache is None or isinstance(cache, GridCache):
+        return cache
+    if isinstance(cache, ArtifactCache): # same folder and limits
+        return GridCache(cache.directory, cache.max_bytes, cache.max_age)
+    return GridCache(cache)
@@ -0,0 +1,241 @@
+# Grid input/output helpers shared by the scripts in this repository.
+# A "grid" here is a 2-D array of cell values plus the information needed to place it on the earth: the coordinates of the upper left corner, the cell size and the value
+# used for NoData. Grids can come from two places:
+#   (1) NumPy .npy files with a small .json sidecar holding the georeferencing. These are memory mapped, so only the blocks that are actually touched are read from disk.
+#   (2) Any raster ArcGIS Pro can open (.tif, geodatabase rasters, ...). These are read one window at a time with arcpy.RasterToNumPyArray.
+# Either way, the code that uses these grids only ever asks for one block at a time, so a continental-scale grid never has to fit in memory and no intermediate raster is written.
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+
+# Georeferencing of a north-up grid: upper left corner, cell size (both positive) and the number of rows and columns
+class GridDefinition(namedtuple("GridDefinition", ["x_min", "y_max", "cell_width", "cell_height", "nrows", "ncols"])):
+    __slots__ = ()
+
+    @property
+    def x_max(self): # right edge of the grid
+        return self.x_min + self.ncols * self.cell_width
+
+    @property
+    def y_min(self): # bottom edge of the grid
+        return self.y_max - self.nrows * self.cell_height
+
+    @property
+    def shape(self): # (rows, columns), same order as the arrays
+        return (self.nrows, self.ncols)
+
+    def window(self, row0, col0, nrows, ncols): # georeferencing of a window of this grid
+        return GridDefinition(self.x_min + col0 * self.cell_width, self.y_max - row0 * self.cell_height, self.cell_width, self.cell_height, nrows, ncols)
+
+    def to_dict(self): # used for the .json sidecar of .npy grids
+        return dict(self._asdict())
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(float(values["x_min"]), float(values["y_max"]), float(values["cell_width"]), float(values["cell_height"]), int(values["nrows"]), int(values["ncols"]))
+
+
+# Grid backed by a NumPy array (in memory or memory mapped from a .npy file)
+class ArrayGrid:
+
+    def __init__(self, array, definition, nodata=None): # (2-D array, GridDefinition, value used for NoData or None if the array only uses NaN)
+        if array.ndim != 2 or array.shape != definition.shape: # the georeferencing has to describe the array it is attached to
+            raise ValueError("Array of shape " + str(array.shape) + " does not match grid of shape " + str(definition.shape))
+        self.array = array
+        self.definition = definition
+        self.nodata = nodata
+
+    def read(self, row0, col0, nrows, ncols): # read a window as floats with NaN in NoData cells
+        block = self.array[row0:row0 + nrows, col0:col0 + ncols] # slicing a (memory mapped) array is a view, nothing is copied yet
+        return as_float(block, self.nodata)
+
+    def window(self, row0, col0, nrows, ncols): # zero-copy sub-grid (a view of the same array)
+        return ArrayGrid(self.array[row0:row0 + nrows, col0:col0 + ncols], self.definition.window(row0, col0, nrows, ncols), self.nodata)
+
+
+# Grid backed by a raster that ArcGIS Pro can read. ArcPy is only imported once a window is actually requested.
+class ArcpyGrid:
+
+    def __init__(self, path): # (path or geodatabase name of the raster)
+        import arcpy
+        raster = arcpy.Raster(path)
+        self.path = path
+        self.definition = GridDefinition(raster.extent.XMin, raster.extent.YMax, raster.meanCellWidth, raster.meanCellHeight, raster.height, raster.width)
+        self.nodata = raster.noDataValue
+
+    def read(self, row0, col0, nrows, ncols): # read a window as floats with NaN in NoData cells
+        import arcpy
+        d = self.definition
+        lower_left = arcpy.Point(d.x_min + (col0 + 0.5) * d.cell_width, d.y_max - (row0 + nrows - 0.5) * d.cell_height) # centre of the lower left cell of the window so the point cannot snap to a neighbouring cell
+        block = arcpy.RasterToNumPyArray(self.path, lower_left, ncols, nrows)
+        return as_float(block, self.nodata)
+
+    def window(self, row0, col0, nrows, ncols): # sub-grid that only reads the requested window of the raster
+        return GridWindow(self, row0, col0, nrows, ncols)
+
+
+# Window of another grid. Reads are shifted into the parent grid, so only cells inside the window are ever read.
+class GridWindow:
+
+    def __init__(self, parent, row0, col0, nrows, ncols): # (grid the window belongs to, first row, first column, rows, columns)
+        self.parent = parent
+        self.offset = (row0, col0)
+        self.definition = parent.definition.window(row0, col0, nrows, ncols)
+        self.nodata = parent.nodata
+
+    def read(self, row0, col0, nrows, ncols):
+        return self.parent.read(self.offset[0] + row0, self.offset[1] + col0, nrows, ncols)
+
+    def window(self, row0, col0, nrows, ncols):
+        return GridWindow(self.parent, self.offset[0] + row0, self.offset[1] + col0, nrows, ncols)
+
+
+# Find the cells two grids have in common straight from their georeferencing (no domain polygons, intersect or ExtractByMask needed).
+# The grids must be aligned: same cell size and corners that differ by a whole number of cells (within tolerance, as a fraction of a cell).
+# Returns ((row0, col0, rows, columns) in grid 1, (row0, col0, rows, columns) in grid 2), both windows covering the same cells.
+def overlap_windows(definition_1, definition_2, tolerance=1e-3):
+    return tuple(common_windows([definition_1, definition_2], tolerance))
+
+
+# Same as overlap_windows for any number of aligned grids: returns one (row0, col0, rows, columns) window per grid, all covering the cells every grid has in common
+def common_windows(definitions, tolerance=1e-3):
+    d1 = definitions[0] # every other grid is placed relative to the first one
+    shifts = []
+    for d2 in definitions:
+        if abs(d1.cell_width - d2.cell_width) > tolerance * d1.cell_width or abs(d1.cell_height - d2.cell_height) > tolerance * d1.cell_height: # cell sizes have to match
+            raise ValueError("Grids have different cell sizes: " + str((d1.cell_width, d1.cell_height)) + " vs " + str((d2.cell_width, d2.cell_height)))
+        col_shift = (d2.x_min - d1.x_min) / d1.cell_width # position of this grid's first column in grid 1, in cells
+        row_shift = (d1.y_max - d2.y_max) / d1.cell_height # position of this grid's first row in grid 1, in cells
+        if abs(col_shift - round(col_shift)) > tolerance or abs(row_shift - round(row_shift)) > tolerance: # cells have to line up
+            raise ValueError("Grids are not aligned: grid 2 is shifted by " + str((row_shift, col_shift)) + " cells")
+        shifts.append((int(round(row_shift)), int(round(col_shift))))
+    row_start = max(row_shift for row_shift, col_shift in shifts) # common rows and columns in grid 1
+    row_stop = min(row_shift + d.nrows for (row_shift, col_shift), d in zip(shifts, definitions))
+    col_start = max(col_shift for row_shift, col_shift in shifts)
+    col_stop = min(col_shift + d.ncols for (row_shift, col_shift), d in zip(shifts, definitions))
+    if row_stop <= row_start or col_stop <= col_start:
+        raise ValueError("Grids do not overlap")
+    nrows, ncols = row_stop - row_start, col_stop - col_start
+    return [(row_start - row_shift, col_start - col_shift, nrows, ncols) for row_shift, col_shift in shifts]
+
+
+# Crop any number of aligned grids to the cells they all have in common (views for array grids, lazily read windows for ArcPy grids)
+def common_grids(grids, tolerance=1e-3):
+    windows = common_windows([grid.definition for grid in grids], tolerance)
+    return [grid.window(*window) for grid, window in zip(grids, windows)]
+
+
+# Crop two aligned grids to the cells they have in common. Array grids are cropped to views, ArcPy grids to windows that are read lazily.
+def overlap_grids(grid_1, grid_2, tolerance=1e-3):
+    window_1, window_2 = overlap_windows(grid_1.definition, grid_2.definition, tolerance)
+    return grid_1.window(*window_1), grid_2.window(*window_2)
+
+
+# Convert a block to floats and replace the NoData value with NaN. Float blocks that already use NaN are passed through untouched (no copy).
+def as_float(block, nodata):
+    if block.dtype.kind == "f" and (nodata is None or np.isnan(nodata)):
+        return block
+    block = block.astype(np.float64)
+    if nodata is not None:
+        block[block == nodata] = np.nan
+    return block
+
+
+# Open any supported grid. ".npy" files are memory mapped (with their .json sidecar), tiled float32 GeoTIFFs laid out like the ones tiled_tiff.py writes are
+# read tile by tile, everything else (other compressions or cell types, rotated grids, geodatabase rasters) goes through ArcPy.
+def open_grid(path):
+    if str(path).lower().endswith(".npy"):
+        with open(sidecar_path(path)) as sidecar: # georeferencing written by save_grid
+            meta = json.load(sidecar)
+        return ArrayGrid(np.load(path, mmap_mode="r"), GridDefinition.from_dict(meta), meta.get("nodata"))
+    if is_tiff(path):
+        from tiled_tiff import TiledTiff, is_tiled_tiff
+        if is_tiled_tiff(path):
+            return TiledTiff(path)
+    return ArcpyGrid(path)
+
+
+# Save an array as a grid. ".npy" paths get a .json sidecar, ".tif" paths become tiled, compressed GeoTIFFs with overviews (tiled_tiff.py), everything else is
+# written with ArcPy (e.g. a geodatabase raster).
+def save_grid(array, definition, path, nodata=None):
+    if str(path).lower().endswith(".npy"):
+        np.save(path, array)
+        save_sidecar(definition, path, nodata)
+    elif is_tiff(path): # tiled, compressed GeoTIFF with overviews, NaN as NoData
+        from tiled_tiff import write_tiled_tiff
+        array = np.asarray(array, dtype=np.float32)
+        write_tiled_tiff(array if nodata is None else np.where(array == nodata, np.nan, array), definition, path)
+    else:
+        import arcpy
+        if arcpy.Exists(path) == 1: # checks to see if name already exists
+            arcpy.Delete_management(path) # deletes raster if it already exists
+        lower_left = arcpy.Point(definition.x_min, definition.y_min)
+        out_raster = arcpy.NumPyArrayToRaster(array, lower_left, definition.cell_width, definition.cell_height, nodata)
+        out_raster.save(path)
+
+
+# Output grid that is filled block by block. ".npy" outputs are memory mapped files written in place, so they never have to fit in memory;
+# anything else is filled in memory and written with save_grid (a tiled GeoTIFF for ".tif", ArcPy with NaN cells as NoData otherwise) when close() is called. With a
+# scratch folder, other outputs are filled in a memory mapped .npy file in that folder instead (so several processes can write into it, see band_scheduler.py).
+# mode "r+" reopens an existing .npy output (e.g. to resume an interrupted run) instead of creating it; it is still created if it is missing or of another shape.
+class OutputGrid:
+
+    def __init__(self, path, definition, dtype=np.float32, nodata=-9999.0, mode="w+", scratch=None): 
+        # (output path or geodatabase name, GridDefinition, cell type, NoData value used for ArcPy rasters, "w+" to create or "r+" to reopen, folder for the .npy file of other outputs)
+        self.path = path
+        self.definition = definition
+        self.nodata = nodata
+        self.file = path if str(path).lower().endswith(".npy") else None # memory mapped file holding the cells
+        if self.file is None and scratch is not None:
+            self.file = os.path.join(scratch, os.path.basename(str(path)) + ".npy")
+        if self.file is not None and mode == "r+":
+            try:
+                self.array = np.lib.format.open_memmap(self.file, mode="r+")
+                if self.array.shape != definition.shape or self.array.dtype != np.dtype(dtype):
+                    raise ValueError("Existing output does not match")
+            except (OSError, ValueError):
+                mode = "w+"
+        if self.file is not None and mode == "w+":
+            self.array = np.lib.format.open_memmap(self.file, mode=mode, dtype=dtype, shape=definition.shape)
+        elif self.file is None:
+            self.array = np.empty(definition.shape, dtype=dtype)
+
+    def close(self):
+        if self.file == self.path:
+            self.array.flush()
+            save_sidecar(self.definition, self.path, None) # NaN marks NoData in .npy grids
+        elif is_tiff(self.path):
+            save_grid(self.array, self.definition, self.path) # NaN stays NaN (NoData) in GeoTIFFs
+        else:
+            save_grid(np.nan_to_num(self.array, nan=self.nodata), self.definition, self.path, self.nodata)
+
+
+# True for GeoTIFF file names (written with tiled_tiff.py)
+def is_tiff(path):
+    return str(path).lower().endswith((".tif", ".tiff"))
+
+
+# Write the .json sidecar holding the georeferencing of a .npy grid
+def save_sidecar(definition, path, nodata=None):
+    meta = definition.to_dict()
+    meta["nodata"] = nodata
+    with open(sidecar_path(path), "w") as sidecar:
+        json.dump(meta, sidecar)
+
+
+# Name of the .json file holding the georeferencing of a .npy grid
+def sidecar_path(path):
+    return os.path.splitext(str(path))[0] + ".json"
+
+
+# Split a (nrows x ncols) grid into blocks of at most block_rows x block_cols cells, row by row. Yields (row0, col0, rows, columns) for every block.
+def iter_blocks(nrows, ncols, block_rows, block_cols=None):
+    if block_cols is None: # square blocks unless told otherwise
+        block_cols = block_rows
+    for row0 in range(0, nrows, block_rows):
+        for col0 in range(0, ncols, block_cols):
+            yield row0, col0, min(block_rows, nrows - row0), min(block_cols, ncols - col0)
@@ -0,0 +1,294 @@
+# Streaming statistics for comparing two grids (for example a satellite derived bathymetric grid against a LiDAR one, see calculate_RMSE.py).
+# The grids are read block by block (see grid_io.py) and every block is handed to one or more "accumulators" that keep running totals. Nothing is written to disk
+# and every cell is read exactly once, no matter how many statistics are requested.
+# The running mean and spread are kept with Welford's method: each block's count, mean and sum of squared deviations (M2) are computed with NumPy and merged
+# into the running totals with Chan et al.'s parallel formula. Unlike summing values and squared values, this does not lose precision when millions of cells with
+# a large common offset are added up.
+
+import math
+import os
+
+import numpy as np
+
+from grid_io import GridDefinition, iter_blocks, save_grid
+
+
+# Running count, mean and sum of squared deviations (M2) of the cell differences.
+# Bias is the mean difference, standard deviation is the population standard deviation (the same one ZonalStatisticsAsTable reports) and
+# RMSE is the square root of the mean square difference, which equals sqrt(bias^2 + STD^2) exactly.
+class RunningStats:
+
+    def __init__(self):
+        self.count = 0 # number of cells with data in both grids
+        self.mean = 0.0 # running mean difference
+        self.m2 = 0.0 # running sum of squared deviations from the mean
+
+    def add(self, values): # add a 1-D array of finite values
+        n = values.size
+        if n == 0: # nothing to add (e.g. a block of NoData)
+            return
+        block_mean = float(values.mean())
+        block_m2 = float(np.square(values - block_mean).sum())
+        self.merge_moments(n, block_mean, block_m2)
+
+    def merge_moments(self, n, mean, m2): # Chan et al. merge of another (count, mean, M2) into the running totals
+        if n == 0:
+            return
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    def merge(self, other): # merge another RunningStats (e.g. from another process)
+        self.merge_moments(other.count, other.mean, other.m2)
+
+    def add_block(self, diff, truth, window): # accumulator interface used by compare_grids, NaN marks cells without data
+        self.add(diff[~np.isnan(diff)])
+
+    @property
+    def bias(self): # mean difference
+        return self.mean if self.count else math.nan
+
+    @property
+    def std(self): # population standard deviation of the difference
+        return math.sqrt(self.m2 / self.count) if self.count else math.nan
+
+    @property
+    def rmse(self): # root mean square difference
+        return math.sqrt(self.mean * self.mean + self.m2 / self.count) if self.count else math.nan
+
+
+# Per-zone running count, mean and M2 of the cell differences, for every zone of a label grid (e.g. the AOI polygons rasterized with rasterize.py).
+# Every block is split by zone with np.bincount, so all zones are updated in one vectorized step no matter how many there are. Each zone's block moments are
+# merged with the same Chan et al. formula as RunningStats, applied to whole arrays of zones at once. Cells labelled 0 (or less) are outside every zone.
+class ZonalStats:
+
+    def __init__(self, labels, nzones=None): # (2-D integer array of zone labels covering the same cells as the compared grids, number of labels if known)
+        self.labels = labels
+        if nzones is None:
+            nzones = int(labels.max()) + 1 if labels.size else 1
+        self.count = np.zeros(nzones, dtype=np.int64) # index = zone label
+        self.mean = np.zeros(nzones)
+        self.m2 = np.zeros(nzones)
+
+    def add_block(self, diff, truth, window): # accumulator interface used by compare_grids
+        row0, col0, nrows, ncols = window
+        labels = self.labels[row0:row0 + nrows, col0:col0 + ncols]
+        valid = (labels > 0) & ~np.isnan(diff) # cells inside a zone with data in both grids
+        self.add(labels[valid], diff[valid])
+
+    def add(self, zones, values): # add 1-D arrays of zone labels and matching values
+        nzones = self.count.size
+        n = np.bincount(zones, minlength=nzones)
+        if not n.any():
+            return
+        with np.errstate(invalid="ignore", divide="ignore"): # zones without cells in this block give 0/0
+            block_mean = np.where(n > 0, np.bincount(zones, values, nzones) / n, 0.0)
+        block_m2 = np.bincount(zones, np.square(values - block_mean[zones]), nzones)
+        self.merge_moments(n, block_mean, block_m2)
+
+    def merge_moments(self, n, mean, m2): # Chan et al. merge for every zone at once
+        total = self.count + n
+        safe_total = np.maximum(total, 1) # zones still without cells keep zeros
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / safe_total
+        self.m2 = self.m2 + m2 + delta * delta * self.count * n / safe_total
+        self.count = total
+
+    def merge(self, other): # merge another ZonalStats over the same zones (e.g. from another process)
+        self.merge_moments(other.count, other.mean, other.m2)
+
+    def zones(self): # labels of the zones that have at least one cell
+        return np.nonzero(self.count)[0]
+
+    def table(self): # per-zone results as columns (only zones with cells)
+        zones = self.zones()
+        count = self.count[zones]
+        mean = self.mean[zones]
+        m2 = self.m2[zones]
+        return {
+            "zone": zones,
+            "count": count,
+            "sum": mean * count, # sum of differences
+            "sum_squares": m2 + count * mean * mean, # sum of squared differences
+            "bias": mean,
+            "std": np.sqrt(m2 / count),
+            "rmse": np.sqrt(mean * mean + m2 / count),
+        }
+
+    def pooled(self): # statistics over all zones together, pooled properly instead of adding up the zones' means and standard deviations
+        stats = RunningStats()
+        total = int(self.count.sum())
+        if total:
+            mean = float((self.count * self.mean).sum() / total) # count-weighted mean of the zone means
+            m2 = float(self.m2.sum() + (self.count * np.square(self.mean - mean)).sum()) # spread within zones plus spread between zones
+            stats.merge_moments(total, mean, m2)
+        return stats
+
+
+# Per-depth-bin statistics: the cells are grouped by the depth of the truth grid (0-2 m, 2-5 m, 5-10 m and beyond 10 m by default) instead of by AOI zone.
+# Depth is taken as the absolute value of the truth, so it works for grids stored as positive depths or as negative elevations. Bin i (counting from 1)
+# holds depths from edges[i-1] up to (not including) edges[i]; cells outside the edges are left out.
+class DepthBinnedStats(ZonalStats):
+
+    def __init__(self, edges=(0.0, 2.0, 5.0, 10.0, math.inf)): # (bin edges in meters, increasing)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        ZonalStats.__init__(self, None, self.edges.size) # label 0 is unused, labels 1..n-1 are the bins
+
+    def add_block(self, diff, truth, window): # accumulator interface used by compare_grids
+        bins = np.searchsorted(self.edges, np.abs(truth), side="right") # 1 for the first bin, edges.size for depths past the last edge
+        valid = (bins > 0) & (bins < self.edges.size) & ~np.isnan(diff)
+        self.add(bins[valid], diff[valid])
+
+    def table(self): # per-bin results as columns, with the depth range of each bin
+        table = ZonalStats.table(self)
+        table["depth_from"] = self.edges[table["zone"] - 1]
+        table["depth_to"] = self.edges[table["zone"]]
+        return table
+
+
+# Coarse error map: count, bias and RMSE of the differences for every tile of block x block cells (e.g. 32 x 32 or 256 x 256), in place of a full resolution
+# difference raster. Each tile is treated as a zone, so the tiles of a block are all updated at once with the same vectorized moments as ZonalStats.
+# Blocks read by compare_grids do not have to line up with the tiles.
+class ErrorMap(ZonalStats):
+
+    def __init__(self, definition, block=256): # (GridDefinition of the compared cells, tile edge in cells)
+        self.block = block
+        self.tile_rows = -(-definition.nrows // block) # tiles down, rounding up so the edge tiles are kept
+        self.tile_cols = -(-definition.ncols // block) # tiles across
+        self.definition = GridDefinition(definition.x_min, definition.y_max, definition.cell_width * block, definition.cell_height * block, self.tile_rows, self.tile_cols) # georeferencing of the map
+        ZonalStats.__init__(self, None, self.tile_rows * self.tile_cols)
+
+    def add_block(self, diff, truth, window): # accumulator interface used by compare_grids
+        row0, col0, nrows, ncols = window
+        tile_row = (row0 + np.arange(nrows)) // self.block # tile of every row and column of the block
+        tile_col = (col0 + np.arange(ncols)) // self.block
+        tiles = tile_row[:, None] * self.tile_cols + tile_col[None, :]
+        valid = ~np.isnan(diff)
+        self.add(tiles[valid], diff[valid])
+
+    def maps(self): # (count, bias, RMSE) as 2-D arrays on the map's grid, NaN where a tile has no data
+        shape = (self.tile_rows, self.tile_cols)
+        has_data = self.count > 0
+        bias = np.where(has_data, self.mean, np.nan)
+        rmse = np.where(has_data, np.sqrt(self.mean * self.mean + self.m2 / np.maximum(self.count, 1)), np.nan)
+        return self.count.reshape(shape), bias.reshape(shape), rmse.reshape(shape)
+
+
+# Distribution of the cell differences in a fixed-bin histogram, so medians and percentiles can be found without keeping the differences in memory.
+# Bins are bin_width wide (1 mm by default) between -limit and +limit; differences beyond the limit are counted in the outermost bins (and in "clipped"),
+# so memory stays fixed no matter how many cells are compared. Percentiles are exact to within one bin. Histograms from different processes can be merged.
+class ErrorHistogram:
+
+    def __init__(self, bin_width=0.001, limit=50.0): # (bin width and largest difference resolved, both in meters)
+        self.bin_width = bin_width
+        self.limit = limit
+        nbins = 2 * int(math.ceil(limit / bin_width)) # even number of bins, so 0 is a bin edge and the histogram folds neatly into absolute errors
+        self.counts = np.zeros(nbins, dtype=np.int64)
+        self.clipped = 0 # differences beyond +/- limit
+
+    def add_block(self, diff, truth, window): # accumulator interface used by compare_grids
+        self.add(diff[~np.isnan(diff)])
+
+    def add(self, values): # add a 1-D array of finite values
+        nbins = self.counts.size
+        index = np.floor(values / self.bin_width).astype(np.int64) + nbins // 2
+        outside = (index < 0) | (index >= nbins)
+        if outside.any():
+            self.clipped += int(outside.sum())
+            index = np.clip(index, 0, nbins - 1)
+        self.counts += np.bincount(index, minlength=nbins)
+
+    def merge(self, other): # merge another histogram with the same bins
+        self.counts += other.counts
+        self.clipped += other.clipped
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def centres(self): # value at the centre of every bin
+        nbins = self.counts.size
+        return (np.arange(nbins) - nbins // 2 + 0.5) * self.bin_width
+
+    def absolute_counts(self): # histogram of the absolute differences (same bin width, starting at 0)
+        half = self.counts.size // 2
+        return self.counts[half:] + self.counts[:half][::-1]
+
+    def percentile(self, q, absolute=False): # q-th percentile (0-100) of the differences, or of the absolute differences
+        if absolute:
+            return histogram_quantile(self.absolute_counts(), 0.0, self.bin_width, q / 100.0)
+        return histogram_quantile(self.counts, -self.bin_width * (self.counts.size // 2), self.bin_width, q / 100.0)
+
+    @property
+    def median(self): # median difference
+        return self.percentile(50)
+
+    @property
+    def nmad(self): # normalized median absolute deviation, 1.4826 * median(|difference - median|), a robust standard deviation
+        if not self.count:
+            return math.nan
+        deviation = np.abs(self.centres() - self.median) # distance of every bin from the median
+        order = np.argsort(deviation, kind="stable")
+        cumulative = np.cumsum(self.counts[order])
+        middle = np.searchsorted(cumulative, 0.5 * cumulative[-1]) # bin holding the median deviation
+        return 1.4826 * float(deviation[order][middle])
+
+
+# Quantile (0-1) of a histogram with equal bins starting at "start", interpolated linearly inside the bin where it falls
+def histogram_quantile(counts, start, bin_width, q):
+    cumulative = np.cumsum(counts)
+    if cumulative.size == 0 or cumulative[-1] == 0:
+        return math.nan
+    target = q * cumulative[-1]
+    index = int(np.searchsorted(cumulative, target)) # first bin where the cumulative count reaches the target
+    index = min(index, counts.size - 1)
+    below = cumulative[index] - counts[index] # values in earlier bins
+    fraction = (target - below) / counts[index] if counts[index] else 0.0
+    return float(start + (index + fraction) * bin_width)
+
+
+# Read two grids block by block and hand the difference (grid_1 - grid_2) of every block to the accumulators.
+# Each accumulator needs an add_block(diff, truth, window) method: diff is the difference block with NaN where either grid has NoData,
+# truth is the matching block of grid_1 and window is (row0, col0, rows, columns) of the block.
+# mask (optional) is an array over the same cells; cells where it is 0/False are treated as NoData, e.g. to keep every statistic inside the AOI.
+def compare_grids(grid_1, grid_2, accumulators, block_size=1024, mask=None): # (truth grid, grid compared to the truth, list of accumulators, block edge in cells, cells to use)
+    if grid_1.definition.shape != grid_2.definition.shape: # both grids must cover the same cells
+        raise ValueError("Grids are not co-registered: " + str(grid_1.definition.shape) + " vs " + str(grid_2.definition.shape))
+    nrows, ncols = grid_1.definition.shape
+    for window in iter_blocks(nrows, ncols, block_size):
+        truth = grid_1.read(*window)
+        diff = truth - grid_2.read(*window) # NaN in either grid gives NaN in the difference
+        if mask is not None:
+            row0, col0, block_rows, block_cols = window
+            diff[mask[row0:row0 + block_rows, col0:col0 + block_cols] <= 0] = np.nan
+        for accumulator in accumulators:
+            accumulator.add_block(diff, truth, window)
+    return accumulators
+
+
+# Bias, standard deviation and RMSE of grid_1 - grid_2 in a single pass
+def difference_statistics(grid_1, grid_2, block_size=1024):
+    stats = RunningStats()
+    compare_grids(grid_1, grid_2, [stats], block_size)
+    return stats
+
+
+# Per-zone bias, standard deviation and RMSE of grid_1 - grid_2 in a single pass (labels: zone grid covering the same cells, 0 outside every zone)
+def zonal_difference_statistics(grid_1, grid_2, labels, block_size=1024):
+    zonal = ZonalStats(labels)
+    compare_grids(grid_1, grid_2, [zonal], block_size)
+    return zonal
+
+
+# Save the count, bias and RMSE maps of an ErrorMap as error_count_<tag>, error_bias_<tag> and error_RMSE_<tag>: geodatabase rasters in the ArcGIS workspace, 
+# or .npy grids (with .json sidecars) in folder if one is given
+def save_error_map(error_map, tag, folder=None):
+    count, bias, rmse = error_map.maps()
+    for name, values in (("error_count", count.astype(np.float32)), ("error_bias", bias.astype(np.float32)), ("error_RMSE", rmse.astype(np.float32))):
+        out = name + "_" + str(tag) # name of the map using the tag
+        if folder is not None: # .npy grid, NaN marks tiles without data
+            save_grid(values, error_map.definition, os.path.join(folder, out + ".npy"))
+        else: # geodatabase raster, -9999 marks tiles without data
+            save_grid(np.nan_to_num(values, nan=-9999.0), error_map.definition, out, -9999.0)
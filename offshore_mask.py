@@ -0,0 +1,163 @@
+# Offshore mask for the MSS and TSS grids (see MSS_TSS_final.py) built on the grid itself instead of with a vector Buffer and Erase.
+# The land polygon is rasterized once onto the target grid (rasterize.py). Then, for every water cell, the distance to the nearest land cell is found with a
+# separable Euclidean distance transform, done in bands of rows so only a band (plus a few halo rows) is in memory at a time:
+#   (1) along each row, the distance in cells to the nearest land cell on the left and on the right comes from running maximum/minimum of land cell indices.
+#       This is converted to meters with the east-west cell size of that row, which shrinks with latitude (cos(latitude)) on a geographic grid.
+#   (2) down each column, the squared distance is the smallest (north-south offset)^2 + (row distance from step 1)^2 over the rows within the buffer distance.
+#       Only rows closer than the buffer distance can matter, so this is a handful of shifted minimums (5 rows each way for 9 km at 1/60 degree).
+# Cell sizes in meters come from the WGS 84 ellipsoid (radii of curvature at the latitude of each row). On a global grid, distances wrap around the 180th meridian.
+# Distances are measured between cell centres, so the mask edge is exact to within a cell. Cells further than the buffer distance from land (9 km by default, the
+# same distance as the 9000 Meters Buffer) and inside the coverage are offshore. The mask can be bit-packed (8 cells per byte) to keep a global grid small: each
+# band is packed as soon as it is done, and with land and coverage given as PolygonRows (rasterized a band at a time, as cached_offshore_mask does), only a band
+# plus its halo rows is ever held at full size.
+
+import math
+
+import numpy as np
+
+from grid_cache import as_cache, fingerprint
+from rasterize import polygon_mask, read_polygons
+
+
+WGS84_A = 6378137.0 # semi-major axis of the WGS 84 ellipsoid (m)
+WGS84_E2 = 0.00669437999014 # first eccentricity squared of the WGS 84 ellipsoid
+
+
+# East-west and north-south size of the cells of every row in meters. For geographic grids (cell sizes in degrees) the sizes come from the WGS 84 radii of curvature
+# at the latitude of each row; for projected grids (cell sizes already in meters) they are constant.
+def cell_sizes(definition, geographic=True):
+    if not geographic:
+        return np.full(definition.nrows, float(definition.cell_width)), np.full(definition.nrows, float(definition.cell_height))
+    latitude = np.radians(definition.y_max - (np.arange(definition.nrows) + 0.5) * definition.cell_height) # latitude of every row centre
+    w = 1.0 - WGS84_E2 * np.sin(latitude) ** 2
+    prime_vertical = WGS84_A / np.sqrt(w) # radius of curvature east-west
+    meridional = WGS84_A * (1.0 - WGS84_E2) / w ** 1.5 # radius of curvature north-south
+    dx = prime_vertical * np.cos(latitude) * math.radians(definition.cell_width)
+    dy = meridional * math.radians(definition.cell_height)
+    return np.maximum(dx, 0.0), dy
+
+
+# Squared east-west distance (m^2) from every cell to the nearest land cell in the same row (inf for rows without land). wrap: the row continues across the grid edge.
+def row_distance_squared(land, dx, wrap=False):
+    nrows, ncols = land.shape
+    columns = np.arange(ncols)
+    far = 3 * ncols # stands for "no land on this side", further than any real distance
+    left = np.maximum.accumulate(np.where(land, columns, -far), axis=1) # nearest land column at or left of every cell
+    right = np.minimum.accumulate(np.where(land, columns, far)[:, ::-1], axis=1)[:, ::-1] # nearest land column at or right of every cell
+    if wrap: # no land on one side: use the last (first) land cell of the row, one grid width away on the other side of the grid edge
+        has_land = land.any(axis=1)[:, None]
+        left = np.where((left < 0) & has_land, left[:, -1:] - ncols, left)
+        right = np.where((right >= ncols) & has_land, right[:, :1] + ncols, right)
+    cells = np.minimum(columns - left, right - columns).astype(np.float64) # distance in cells
+    cells[cells > ncols] = np.inf # no land in the row
+    return np.square(cells * dx[:, None])
+
+
+# Squared distance (m^2) from every cell of rows [row0, row1) to the nearest land cell, for distances up to max_distance (larger distances are inf).
+def band_distance_squared(land, dx, dy, row0, row1, max_distance, wrap=False):
+    nrows = land.shape[0]
+    reach = int(math.ceil(max_distance / max(float(dy.min()), 1e-9))) # rows that can be closer than max_distance
+    halo0, halo1 = max(0, row0 - reach), min(nrows, row1 + reach)
+    g = row_distance_squared(mask_rows(land, halo0, halo1), dx[halo0:halo1], wrap) # row distances for the band and its halo
+    g[g > max_distance * max_distance] = np.inf # too far to ever count
+    distance = g[row0 - halo0:row1 - halo0].copy() # offset 0: land in the same row
+    band_dy = dy[row0:row1, None]
+    for shift in range(1, reach + 1): # land 'shift' rows above and below
+        north_south = np.square(shift * band_dy)
+        for source0 in (row0 - shift, row0 + shift):
+            first, last = max(source0, halo0), min(source0 + (row1 - row0), halo1) # source rows that exist
+            if last <= first:
+                continue
+            target = slice(first - source0, last - source0)
+            np.minimum(distance[target], g[first - halo0:last - halo0] + north_south[target], out=distance[target])
+    return distance
+
+
+# Rows [row0, row1) of a boolean grid: a 2-D array, or anything with read(row0, col0, nrows, ncols) such as PolygonRows or PackedMask
+def mask_rows(mask, row0, row1):
+    if hasattr(mask, "read"):
+        return np.asarray(mask.read(row0, 0, row1 - row0, mask.shape[1]), dtype=bool)
+    return np.asarray(mask[row0:row1], dtype=bool)
+
+
+# Offshore mask: True for water cells further than "distance" meters from land and inside the coverage (a boolean grid over the same cells, or None for everywhere).
+# land is a boolean grid (True on land), for example from land_mask, or PolygonRows. wrap defaults to True for geographic grids that go all the way around the
+# world. With packed=True every band is packed into the PackedMask as soon as it is done, so the whole mask is never held unpacked.
+def offshore_mask(land, definition, distance=9000.0, geographic=True, coverage=None, wrap=None, band_rows=512, packed=False):
+    if wrap is None:
+        wrap = geographic and abs(definition.ncols * definition.cell_width - 360.0) < definition.cell_width / 2
+    dx, dy = cell_sizes(definition, geographic)
+    nrows = definition.nrows
+    if packed:
+        bits = np.zeros((nrows, -(-definition.ncols // 8)), dtype=np.uint8)
+    else:
+        mask = np.zeros(definition.shape, dtype=bool)
+    for row0 in range(0, nrows, band_rows):
+        row1 = min(nrows, row0 + band_rows)
+        far = band_distance_squared(land, dx, dy, row0, row1, distance, wrap) > distance * distance # also False on land itself (distance 0)
+        if coverage is not None:
+            far &= mask_rows(coverage, row0, row1)
+        if packed:
+            bits[row0:row1] = np.packbits(far, axis=1)
+        else:
+            mask[row0:row1] = far
+    return PackedMask(bits=bits, shape=definition.shape) if packed else mask
+
+
+# Rasterize a land polygon (feature class name or list of (label, rings) polygons) onto the grid: True on land
+def land_mask(land_polygon, definition):
+    return polygon_mask(land_polygon, definition)
+
+
+# Polygons (list of (label, rings)) as a boolean grid that is rasterized when rows of it are read, so offshore_mask never holds the whole grid (True inside)
+class PolygonRows:
+
+    def __init__(self, polygons, definition):
+        self.polygons = polygons
+        self.definition = definition
+        self.shape = definition.shape
+
+    def read(self, row0, col0, nrows, ncols):
+        return polygon_mask(self.polygons, self.definition.window(row0, col0, nrows, ncols))
+
+
+# Offshore mask for a land polygon, reused from the cache when the same mask has been built before. The cache key is a content hash of the land polygon's
+# geometry, the buffer distance, the target grid and the coverage, so a mask is only rebuilt when one of those changes. land_polygon and coverage can be feature
+# class names (read with ArcPy) or lists of (label, rings) polygons. cache is a GridCache or a folder name; None builds the mask without caching.
+# Returns a PackedMask (memory mapped from the cache).
+def cached_offshore_mask(land_polygon, definition, distance=9000.0, coverage=None, cache=None, geographic=True):
+    if isinstance(land_polygon, str): # read each polygon once: for the hash and, if needed, to rasterize it
+        land_polygon = read_polygons(land_polygon)
+    if isinstance(coverage, str):
+        coverage = read_polygons(coverage)
+    cache = as_cache(cache)
+    key = fingerprint("offshore_mask", land_polygon, float(distance), tuple(definition), coverage, geographic)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            arrays, meta = cached
+            return PackedMask(bits=arrays["bits"], shape=meta["shape"])
+    coverage_rows = PolygonRows(coverage, definition) if coverage is not None else None
+    mask = offshore_mask(PolygonRows(land_polygon, definition), definition, distance, geographic, coverage_rows, packed=True) # rasterized band by band
+    if cache is not None:
+        cache.put(key, {"bits": mask.bits}, {"shape": list(mask.shape), "distance": distance, "grid": definition.to_dict()})
+    return mask
+
+
+# Boolean mask stored 8 cells per byte. read() unpacks only the requested window, so it can be handed to grid_algebra.evaluate_tiled like any other mask.
+class PackedMask:
+
+    def __init__(self, mask=None, bits=None, shape=None): # either a boolean array, or already packed bits (rows x ceil(columns / 8) bytes) and the mask shape
+        if mask is not None:
+            bits, shape = np.packbits(mask, axis=1), mask.shape
+        self.bits = bits
+        self.shape = tuple(shape)
+
+    def read(self, row0, col0, nrows, ncols):
+        first_byte, last_byte = col0 // 8, -(-(col0 + ncols) // 8)
+        block = np.unpackbits(self.bits[row0:row0 + nrows, first_byte:last_byte], axis=1)
+        start = col0 - first_byte * 8
+        return block[:, start:start + ncols].astype(bool)
+
+    def unpack(self): # whole mask as a boolean array
+        return self.read(0, 0, self.shape[0], self.shape[1])
@@ -0,0 +1,104 @@
+# Elevation profiles along cross sections, for CrossSections.get_the_good_stuff_fast.
+# get_the_good_stuff runs MakeFeatureLayer, GeneratePointsAlongLines (1 m, with end points), AddXY, AddSurfaceInformation (BILINEAR) and TableToExcel once per cross
+# section, so the DEM is opened and read again for every one of them. Here the stations of all cross sections are generated as one set of coordinate arrays and the
+# DEM is sampled for all of them in a single vectorized pass:
+#   (1) stations every spacing meters from the start of every line, plus its start and end point (like "DISTANCE", "1 Meters", "END_POINTS"),
+#   (2) stations are grouped by the DEM block (block_size x block_size cells) they fall in, and only the blocks with stations are read (one window per block, plus
+#       one row and column past it for the interpolation), through the windowed reads of grid_io.open_grid: memory mapped for .npy DEMs, tile by tile for tiled
+#       GeoTIFFs and RasterToNumPyArray windows for ArcGIS rasters,
+#   (3) Z is the bilinear interpolation of the four cell centres around each station, NaN if one of them is NoData or the station is off the DEM.
+# Stations within half a cell of the edge of the DEM get the edge cells.
+
+import os
+
+import numpy as np
+
+from grid_io import open_grid
+
+
+# Stations along every line of a FeatureTable of polylines (feature_store.py): every spacing (map units) from the start of the line and, with end_points, the start
+# and end points too. Returns (columns, offsets): columns "profile" (index of the line), "distance" (along the line), "x" and "y", one value per station, and
+# offsets so the stations of line i are [offsets[i]:offsets[i + 1]].
+def profile_stations(lines, spacing=1.0, end_points=True):
+    x, y, offsets = lines.x, lines.y, lines.offsets
+    first, last = offsets[:-1], offsets[1:] - 1
+    step = np.hypot(np.diff(x), np.diff(y))
+    step[last[:-1]] = 0.0 # no segment from the end of one line to the start of the next
+    along = np.concatenate([[0.0], np.cumsum(step)]) # running distance over the vertices of all lines
+    length = along[last] - along[first]
+
+    intervals = np.floor(length / spacing + 1e-9).astype(np.int64) # whole spacings that fit on each line
+    if end_points: # 0, spacing, 2 spacing, ... and the end point unless it already is a station
+        count = intervals + 1 + (length - intervals * spacing > 1e-6)
+    else: # spacing, 2 spacing, ...
+        count = intervals
+    station_offsets = np.concatenate([[0], np.cumsum(count)])
+    profile = np.repeat(np.arange(count.size), count)
+    k = np.arange(station_offsets[-1]) - np.repeat(station_offsets[:-1], count) # station number along its line
+    distance = np.minimum((k + (0 if end_points else 1)) * spacing, length[profile]) # the extra end point lands on the end of the line
+
+    # Segment each station falls on, and its position along the segment
+    position = along[first][profile] + distance
+    segment = np.searchsorted(along, position, side="right") - 1
+    segment = np.clip(segment, first[profile], np.maximum(last[profile] - 1, first[profile]))
+    following = np.minimum(segment + 1, x.size - 1)
+    segment_length = np.append(step, 0.0)[segment] # zero for lines of a single vertex
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.clip(np.where(segment_length > 0, (position - along[segment]) / segment_length, 0.0), 0.0, 1.0)
+    columns = {"profile": profile, "distance": distance,
+               "x": x[segment] + t * (x[following] - x[segment]), "y": y[segment] + t * (y[following] - y[segment])}
+    return columns, station_offsets
+
+
+# Bilinear interpolation of a grid at points x, y, reading only the block_size x block_size blocks of cells the points fall in (each once). Returns an array of
+# values, NaN for points off the grid or next to NoData cells. dem is a grid from grid_io.open_grid or a path.
+def sample_grid(dem, x, y, block_size=2048):
+    grid = open_grid(dem) if isinstance(dem, str) else dem
+    d = grid.definition
+    col = (np.asarray(x, dtype=np.float64) - d.x_min) / d.cell_width - 0.5 # position between cell centres
+    row = (d.y_max - np.asarray(y, dtype=np.float64)) / d.cell_height - 0.5
+    inside = (row >= -0.5) & (row <= d.nrows - 0.5) & (col >= -0.5) & (col <= d.ncols - 0.5)
+    row0 = np.clip(np.floor(np.where(inside, row, 0)), 0, max(d.nrows - 2, 0)).astype(np.int64) # upper left of the four cells (edge cells near the edge)
+    col0 = np.clip(np.floor(np.where(inside, col, 0)), 0, max(d.ncols - 2, 0)).astype(np.int64)
+    fy, fx = np.clip(row - row0, 0.0, 1.0), np.clip(col - col0, 0.0, 1.0)
+
+    values = np.full(row.shape, np.nan)
+    blocks_across = -(-d.ncols // block_size)
+    key = np.where(inside, (row0 // block_size) * blocks_across + col0 // block_size, -1)
+    order = np.argsort(key, kind="stable") # points grouped by block
+    sorted_key = key[order]
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]]) if key.size else np.array([], dtype=np.int64)
+    for start, stop in zip(starts, np.r_[starts[1:], sorted_key.size]):
+        if sorted_key[start] < 0: # off the grid
+            continue
+        points = order[start:stop]
+        block_row0, block_col0 = (sorted_key[start] // blocks_across) * block_size, (sorted_key[start] % blocks_across) * block_size
+        nrows, ncols = min(block_size + 1, d.nrows - block_row0), min(block_size + 1, d.ncols - block_col0) # one row and column past the block
+        block = grid.read(block_row0, block_col0, nrows, ncols)
+        r, c = row0[points] - block_row0, col0[points] - block_col0
+        r1, c1 = np.minimum(r + 1, nrows - 1), np.minimum(c + 1, ncols - 1) # grids of a single row or column
+        wx, wy = fx[points], fy[points]
+        values[points] = ((1 - wx) * (1 - wy) * block[r, c] + wx * (1 - wy) * block[r, c1] +
+                          (1 - wx) * wy * block[r1, c] + wx * wy * block[r1, c1])
+    return values
+
+
+# Stations along every line (profile_stations) with Z sampled from the DEM (sample_grid). Returns (columns, offsets) with a "z" column added.
+def sample_profiles(lines, dem, spacing=1.0, end_points=True, block_size=2048):
+    columns, offsets = profile_stations(lines, spacing, end_points)
+    columns["z"] = sample_grid(dem, columns["x"], columns["y"], block_size)
+    return columns, offsets
+
+
+# Write one .csv per profile (<tag>_CSV<n>.csv, n counted from 0 like get_the_good_stuff's tables) with the fields of its TableToExcel output: OBJECTID (of the
+# station), ORIG_FID (OBJECTID of the cross section, profile + 1), POINT_X, POINT_Y and Z (empty where there is no elevation). Returns the number of files.
+def write_profile_csvs(columns, offsets, folder, tag):
+    x = np.char.mod("%.6f", columns["x"])
+    y = np.char.mod("%.6f", columns["y"])
+    z = np.where(np.isnan(columns["z"]), "", np.char.mod("%.6f", columns["z"]))
+    for profile in range(offsets.size - 1):
+        start, stop = offsets[profile], offsets[profile + 1]
+        with open(os.path.join(folder, str(tag) + "_CSV" + str(profile) + ".csv"), "w") as table:
+            table.write("OBJECTID,ORIG_FID,POINT_X,POINT_Y,Z\n")
+            table.writelines(str(i + 1) + "," + str(profile + 1) + "," + x[start + i] + "," + y[start + i] + "," + z[start + i] + "\n" for i in range(stop - start))
+    return offsets.size - 1
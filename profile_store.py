@@ -0,0 +1,105 @@
+# Consolidated store for the cross section profiles of CrossSections.get_the_good_stuff_fast (profile_sampler.py), instead of one table per cross section.
+# A store is a folder holding one flat binary file per column (x, y, z, distance, ... as raw little endian arrays, every point of every profile one after the other),
+# an offsets file (int64, profiles + 1 values: profile i is points offsets[i]:offsets[i + 1]) and meta.json (column types, counts and attributes such as the tag,
+# spacing or spatial reference). Loading memory maps the files, so opening a store reads nothing but meta.json and the offsets, and a profile is a slice (a view) of
+# the mapped columns: no parsing and no copies.
+# Profiles are written in batches (ProfileWriter.write), appended to the column files as they come, so a store can be written while the profiles are produced. The
+# store is built in a "<path>.partial" folder that replaces path when the writer is closed: a store that exists is always complete.
+# export_csvs writes the old one file per profile layout (<tag>_CSV<n>.csv) from a store for tools that still need it.
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+# Writer of a profile store. columns: names of the columns written for every point; dtype: their type (float64 or float32); meta: attributes saved in meta.json.
+class ProfileWriter:
+
+    def __init__(self, path, columns=("x", "y", "z", "distance"), dtype=np.float64, meta=None):
+        self.path = str(path)
+        self.partial = self.path + ".partial"
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.meta = dict(meta or {})
+        if os.path.exists(self.partial):
+            shutil.rmtree(self.partial)
+        os.makedirs(self.partial)
+        self.files = {name: open(os.path.join(self.partial, name + ".bin"), "wb") for name in self.columns}
+        self.offsets = [np.zeros(1, dtype=np.int64)]
+        self.points = 0
+
+    # Append a batch of profiles: columns as name -> array with a value per point (every column of the store), offsets of the profiles within the batch (as
+    # returned by profile_sampler.sample_profiles)
+    def write(self, columns, offsets):
+        offsets = np.asarray(offsets, dtype=np.int64)
+        for name in self.columns:
+            values = np.asarray(columns[name])[offsets[0]:offsets[-1]]
+            self.files[name].write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+        self.offsets.append(offsets[1:] - offsets[0] + self.points)
+        self.points += int(offsets[-1] - offsets[0])
+
+    def close(self): # write the offsets and meta.json, then move the store into place
+        for column_file in self.files.values():
+            column_file.close()
+        offsets = np.concatenate(self.offsets)
+        offsets.astype("<i8").tofile(os.path.join(self.partial, "offsets.bin"))
+        meta = dict(self.meta, columns={name: self.dtype.str for name in self.columns}, profiles=int(offsets.size - 1), points=self.points)
+        with open(os.path.join(self.partial, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.replace(self.partial, self.path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is None:
+            self.close()
+        else: # leave no half written store behind
+            for column_file in self.files.values():
+                column_file.close()
+            shutil.rmtree(self.partial, ignore_errors=True)
+
+
+# Write a whole set of profiles (columns and offsets from profile_sampler.sample_profiles) to a store in one batch. Returns the path of the store.
+def write_profiles(path, columns, offsets, names=("x", "y", "z", "distance"), dtype=np.float64, meta=None):
+    with ProfileWriter(path, names, dtype, meta) as writer:
+        writer.write(columns, offsets)
+    return writer.path
+
+
+# Profile store opened for reading. Columns are memory mapped (read only) and profiles are views of them.
+class ProfileStore:
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(os.path.join(self.path, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        self.offsets = np.fromfile(os.path.join(self.path, "offsets.bin"), dtype="<i8")
+        self.columns = {}
+        for name, dtype in self.meta["columns"].items():
+            if self.meta["points"]:
+                self.columns[name] = np.memmap(os.path.join(self.path, name + ".bin"), dtype=dtype, mode="r", shape=(self.meta["points"],))
+            else: # empty files cannot be mapped
+                self.columns[name] = np.empty(0, dtype=dtype)
+
+    def __len__(self): # number of profiles
+        return self.offsets.size - 1
+
+    def profile(self, i): # name -> values of every column for profile i (views of the mapped files)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return {name: values[start:stop] for name, values in self.columns.items()}
+
+    def profile_numbers(self): # profile of every point (0, 0, ..., 1, 1, ...)
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+
+# Write one .csv per profile of a store (<tag>_CSV<n>.csv, see profile_sampler.write_profile_csvs) to folder. Returns the number of files.
+def export_csvs(store, folder, tag):
+    from profile_sampler import write_profile_csvs
+    store = store if isinstance(store, ProfileStore) else ProfileStore(store)
+    return write_profile_csvs(store.columns, store.offsets, folder, tag)
@@ -0,0 +1,100 @@
+# Burn polygons into a grid of labels, for example the AOI zones used by calculate_RMSE.py or the land polygon used by MSS_TSS_final.py.
+# A cell gets a polygon's label when the centre of the cell falls inside the polygon (the same rule PolygonToRaster uses with "CELL_CENTER"). Holes and multipart
+# polygons are handled with the even-odd rule. Each polygon is filled with a scanline: every edge is crossed with the row centres it spans, the crossings are paired
+# up along each row and the spans between them are switched on with a +1/-1 difference array. Everything is vectorized per polygon, so hundreds of AOI polygons
+# rasterize in one pass over the grid without writing a zone raster to disk.
+
+import numpy as np
+
+
+# Burn a list of (label, rings) polygons into an integer grid. Rings are (N, 2) arrays of x, y vertices; cells outside every polygon get the value "background".
+# Where polygons overlap, the one later in the list wins.
+def rasterize_polygons(polygons, definition, background=0, dtype=np.int32): # (polygons, GridDefinition of the output, value outside the polygons, output type)
+    labels = np.full(definition.shape, background, dtype=dtype)
+    for label, rings in polygons:
+        inside = polygon_cells(rings, definition)
+        if inside is None: # polygon does not touch the grid
+            continue
+        (row0, col0), covered = inside
+        labels[row0:row0 + covered.shape[0], col0:col0 + covered.shape[1]][covered] = label
+    return labels
+
+
+# Cells of the grid whose centre is inside the polygon. Returns ((row0, col0), boolean block) for the polygon's bounding box, or None if it misses the grid.
+def polygon_cells(rings, definition):
+    d = definition
+    x1 = np.concatenate([ring[:, 0] for ring in rings]) # start points of every edge
+    y1 = np.concatenate([ring[:, 1] for ring in rings])
+    x2 = np.concatenate([np.roll(ring[:, 0], -1) for ring in rings]) # end points (rings are closed automatically)
+    y2 = np.concatenate([np.roll(ring[:, 1], -1) for ring in rings])
+
+    # Bounding box of the polygon in rows and columns, clipped to the grid
+    row0 = max(0, int(np.floor((d.y_max - max(y1.max(), y2.max())) / d.cell_height)))
+    row1 = min(d.nrows, int(np.ceil((d.y_max - min(y1.min(), y2.min())) / d.cell_height)))
+    col0 = max(0, int(np.floor((min(x1.min(), x2.min()) - d.x_min) / d.cell_width)))
+    col1 = min(d.ncols, int(np.ceil((max(x1.max(), x2.max()) - d.x_min) / d.cell_width)))
+    if row1 <= row0 or col1 <= col0:
+        return None
+
+    # Row centres each edge spans. The half-open test (low, high] counts a vertex shared by two edges only once.
+    low, high = np.minimum(y1, y2), np.maximum(y1, y2)
+    first = np.ceil((d.y_max - high) / d.cell_height - 0.5).astype(np.int64) # first row whose centre is at or below the top of the edge
+    last = np.ceil((d.y_max - low) / d.cell_height - 0.5).astype(np.int64) # rows whose centre is above the bottom of the edge end before this one
+    first = np.clip(first, row0, row1)
+    last = np.clip(last, row0, row1)
+    spans = np.maximum(last - first, 0)
+    edge = np.repeat(np.arange(spans.size), spans) # one entry per (edge, row) crossing
+    if edge.size == 0:
+        return None
+    row = first[edge] + (np.arange(edge.size) - np.repeat(np.cumsum(spans) - spans, spans)) # row of each crossing
+    y = d.y_max - (row + 0.5) * d.cell_height # row centre
+    t = (y - y1[edge]) / (y2[edge] - y1[edge]) # horizontal edges never get here because they span no rows
+    x = x1[edge] + t * (x2[edge] - x1[edge]) # where the edge crosses the row centre
+
+    # Pair up the crossings along each row (even-odd rule) and switch on the cells whose centres fall between each pair
+    order = np.lexsort((x, row))
+    row, x = row[order], x[order]
+    col = np.ceil((x - d.x_min) / d.cell_width - 0.5).astype(np.int64) # first column whose centre is at or right of the crossing
+    col = np.clip(col, col0, col1) - col0
+    counts = np.zeros((row1 - row0, col1 - col0 + 1), dtype=np.int32)
+    np.add.at(counts, (row[0::2] - row0, col[0::2]), 1) # span starts
+    np.add.at(counts, (row[1::2] - row0, col[1::2]), -1) # span ends
+    covered = np.cumsum(counts, axis=1)[:, :-1] > 0
+    return (row0, col0), covered
+
+
+# Boolean grid that is True inside any of the polygons (e.g. the land polygon), one byte per cell instead of a full label grid
+def polygon_mask(polygons, definition, id_field="OBJECTID"):
+    if isinstance(polygons, str):
+        polygons = read_polygons(polygons, id_field)
+    return rasterize_polygons([(True, rings) for label, rings in polygons], definition, False, bool)
+
+
+# Read the polygons of a feature class as (label, rings) pairs with ArcPy. The label is taken from id_field (OBJECTID by default, like the zones of ZonalStatisticsAsTable).
+def read_polygons(feature_class, id_field="OBJECTID"):
+    import arcpy
+    polygons = []
+    with arcpy.da.SearchCursor(feature_class, [id_field, "SHAPE@"]) as cursor: # one row per polygon
+        for label, shape in cursor:
+            rings = []
+            for part in shape: # multipart polygons have several parts
+                ring = []
+                for point in part: # a None point separates the outer ring from its holes
+                    if point is None:
+                        if ring:
+                            rings.append(np.array(ring, dtype=np.float64))
+                        ring = []
+                    else:
+                        ring.append((point.X, point.Y))
+                if ring:
+                    rings.append(np.array(ring, dtype=np.float64))
+            if rings:
+                polygons.append((label, rings))
+    return polygons
+
+
+# Rasterize polygons given either as a feature class name (read with ArcPy) or as a list of (label, rings) pairs
+def rasterize(polygons, definition, id_field="OBJECTID", background=0, dtype=np.int32):
+    if isinstance(polygons, str):
+        polygons = read_polygons(polygons, id_field)
+    return rasterize_polygons(polygons, definition, background, dtype)
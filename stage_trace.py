@@ -0,0 +1,236 @@
+# Per-stage timing and memory instrumentation for calculate_RMSE.py, MSS_TSS_final.py and CrossSections.py.
+# A run is split into named stages (domain, intersect, buffer, erase, extract, calculate, cursor loops, each cross section, ...). For every stage the tracer
+# records the wall time, the CPU time of the process, the process's peak resident memory (RSS) at the end of the stage and how much the stage raised it, the bytes
+# read and written by the process and a count of items (cells, features, cross sections) when the code gives one. Every stage is written as one JSON line to the
+# trace file as soon as it ends, and a summary table (per stage name: calls, total time, share of the run, throughput, IO and peak memory) is printed at the end.
+# Stages nest: a stage inside another is recorded as "outer/inner".
+# Stages are marked either with a context manager (with stage("rasterize", items=n): ...) or, in the long linear ArcPy functions, with lap("buffer"), which ends
+# the previous lap of the same function and starts the next one, so existing code does not have to be indented. Functions are wrapped in a stage with @traced.
+# Tracing is off unless a tracer is active: with tracing("run.jsonl"): ..., or the STAGE_TRACE environment variable set to a trace file (every traced function
+# called outside an active tracer then opens one for its run). When it is off, stage, lap and @traced do next to nothing. When it is on, each stage costs two reads
+# of the process counters (around a tenth of a millisecond), so it can stay on for production runs.
+# Peak memory and IO come from psutil when it is installed, otherwise from the resource module and /proc/self/io (Linux); counters that are not available are
+# left empty.
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try: # optional, looked up once here instead of on every lap
+    import psutil
+except ImportError:
+    psutil = None
+try: # not on Windows
+    import resource
+except ImportError:
+    resource = None
+
+
+# Process counters: CPU seconds, peak RSS in bytes, bytes read and bytes written (None when not available)
+def process_counters():
+    cpu = time.process_time()
+    peak = read_bytes = write_bytes = None
+    if psutil is not None:
+        try:
+            process = psutil.Process()
+            memory = process.memory_info()
+            peak = getattr(memory, "peak_wset", None) or getattr(memory, "peak_rss", None) # Windows / Linux
+            io = process.io_counters()
+            read_bytes, write_bytes = io.read_bytes, io.write_bytes
+        except (AttributeError, OSError):
+            pass
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024) # bytes on macOS, kilobytes elsewhere
+    if read_bytes is None and os.path.exists("/proc/self/io"):
+        try:
+            with open("/proc/self/io") as io_file:
+                io = dict(line.split(":") for line in io_file if ":" in line)
+            read_bytes, write_bytes = int(io["read_bytes"]), int(io["write_bytes"])
+        except (OSError, KeyError, ValueError):
+            pass
+    return cpu, peak, read_bytes, write_bytes
+
+
+def difference(end, start):
+    return None if end is None or start is None else end - start
+
+
+# One stage being measured. items can be set or added to while the stage runs.
+class Stage:
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        self.counters = process_counters()
+
+    def add(self, items=1):
+        self.items = (self.items or 0) + items
+
+    def finish(self): # the record written to the trace
+        wall = time.perf_counter() - self.clock
+        cpu, peak, read_bytes, write_bytes = process_counters()
+        return {"stage": self.name, "start": self.start, "wall": wall, "cpu": cpu - self.counters[0], "peak_rss": peak, "peak_rss_growth": difference(peak, self.counters[1]),
+                "read_bytes": difference(read_bytes, self.counters[2]), "write_bytes": difference(write_bytes, self.counters[3]), "items": self.items}
+
+
+# Stage that is not measured (tracing off): accepts items like a Stage
+class NoStage:
+
+    items = None
+
+    def add(self, items=1):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+class Tracer:
+
+    def __init__(self, path=None, run=None, summary=True): # (JSON lines trace file, appended to (None: keep the records in memory only), name of the run, print the summary on close)
+        self.path = path
+        self.run = run
+        self.print_summary = summary
+        self.records = []
+        self.open_stages = [] # names of the stages running now, outermost first
+        self.laps = {} # depth -> current lap
+        self.clock = time.perf_counter()
+        self.trace_file = open(path, "a") if path is not None else None
+
+    def full_name(self, name):
+        return "/".join(self.open_stages + [name])
+
+    def record(self, stage):
+        record = dict(stage.finish(), run=self.run, pid=os.getpid())
+        self.records.append(record)
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps(record) + "\n")
+            self.trace_file.flush() # a run that crashes still leaves its trace
+        return record
+
+    @contextmanager
+    def stage(self, name, items=None): # measure the code inside the with block as stage name (a lap running around it goes on)
+        current = Stage(self.full_name(name), items)
+        self.open_stages.append(name)
+        try:
+            yield current
+        finally:
+            self.end_lap()
+            self.open_stages.pop()
+            self.record(current)
+
+    def lap(self, name, items=None): # end the current lap at this nesting level (if any) and start a new one
+        self.end_lap()
+        current = self.laps[len(self.open_stages)] = Stage(self.full_name(name), items)
+        return current
+
+    def end_lap(self):
+        current = self.laps.pop(len(self.open_stages), None)
+        if current is not None:
+            self.record(current)
+
+    def summary(self): # one row per stage name: calls, wall, cpu, items, bytes read and written, largest peak RSS, largest growth of the peak RSS
+        rows = {}
+        for record in self.records:
+            row = rows.setdefault(record["stage"], {"stage": record["stage"], "calls": 0, "wall": 0.0, "cpu": 0.0, "items": None, "read_bytes": None, "write_bytes": None,
+                                                    "peak_rss": None, "peak_rss_growth": None})
+            row["calls"] += 1
+            row["wall"] += record["wall"]
+            row["cpu"] += record["cpu"]
+            for name in ("items", "read_bytes", "write_bytes"):
+                if record[name] is not None:
+                    row[name] = (row[name] or 0) + record[name]
+            for name in ("peak_rss", "peak_rss_growth"):
+                if record[name] is not None:
+                    row[name] = max(row[name] or 0, record[name])
+        return sorted(rows.values(), key=lambda row: -row["wall"])
+
+    def summary_table(self):
+        total = time.perf_counter() - self.clock
+        megabytes = lambda value: "" if value is None else format(value / 1024.0 ** 2, ".1f")
+        lines = ["Stages of " + str(self.run or "run") + " (" + format(total, ".2f") + " s):",
+                 "stage".ljust(44) + "calls".rjust(7) + "wall s".rjust(10) + "%".rjust(6) + "cpu s".rjust(10) + "items".rjust(12) + "items/s".rjust(11) +
+                 "read MB".rjust(10) + "written MB".rjust(11) + "peak MB".rjust(9) + "+peak MB".rjust(9)]
+        for row in self.summary():
+            rate = "" if not row["items"] or row["wall"] <= 0 else format(row["items"] / row["wall"], ".3g")
+            lines.append(row["stage"][-44:].ljust(44) + str(row["calls"]).rjust(7) + format(row["wall"], ".3f").rjust(10) +
+                         format(100.0 * row["wall"] / total if total > 0 else 0.0, ".1f").rjust(6) + format(row["cpu"], ".3f").rjust(10) +
+                         ("" if row["items"] is None else str(row["items"])).rjust(12) + rate.rjust(11) + megabytes(row["read_bytes"]).rjust(10) +
+                         megabytes(row["write_bytes"]).rjust(11) + megabytes(row["peak_rss"]).rjust(9) + megabytes(row["peak_rss_growth"]).rjust(9))
+        return "\n".join(lines)
+
+    def close(self):
+        while self.laps:
+            depth = max(self.laps)
+            self.record(self.laps.pop(depth))
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+        if self.print_summary and self.records:
+            print(self.summary_table())
+
+
+# Tracer of the running code (one per thread), or None when tracing is off
+local = threading.local()
+
+
+def active_tracer():
+    return getattr(local, "tracer", None)
+
+
+# Trace the code inside the with block to path (JSON lines, appended), printing the summary at the end. Inside an already active tracer, the run is traced as a
+# stage of that tracer instead.
+@contextmanager
+def tracing(path=None, run=None, summary=True):
+    if active_tracer() is not None:
+        with active_tracer().stage(run or "run") as current:
+            yield active_tracer()
+        return
+    local.tracer = Tracer(path, run, summary)
+    try:
+        yield local.tracer
+    finally:
+        tracer, local.tracer = local.tracer, None
+        tracer.close()
+
+
+# Measure the code inside the with block as a stage of the active tracer (nothing is measured when tracing is off). Yields the stage, so items can be added.
+@contextmanager
+def stage(name, items=None):
+    tracer = active_tracer()
+    if tracer is None:
+        yield NO_STAGE
+        return
+    with tracer.stage(name, items) as current:
+        yield current
+
+
+# End the current lap and start the next one (see Tracer.lap); nothing happens when tracing is off
+def lap(name, items=None):
+    tracer = active_tracer()
+    return tracer.lap(name, items) if tracer is not None else NO_STAGE
+
+
+# Run a function as a stage named after it (or name). Outside an active tracer, a tracer is opened for the call when the STAGE_TRACE environment variable names a
+# trace file; otherwise the function just runs.
+def traced(name=None):
+    def decorate(function):
+        stage_name = name or function.__name__
+        @functools.wraps(function)
+        def run(*args, **kwargs):
+            if active_tracer() is None:
+                if not os.environ.get("STAGE_TRACE"):
+                    return function(*args, **kwargs)
+                with tracing(os.environ["STAGE_TRACE"], stage_name):
+                    with stage(stage_name):
+                        return function(*args, **kwargs)
+            with stage(stage_name):
+                return function(*args, **kwargs)
+        return run
+    return decorate
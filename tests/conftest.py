@@ -0,0 +1,6 @@
+# The modules are plain scripts at the top of the repository (no package), so the tests import them from there.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+# Ray casting and segment handling (cross_section_geometry.py) on simple shapes with known answers.
+
+import numpy as np
+import pytest
+
+from cross_section_geometry import SegmentGrid, cast_rays, extend_lines, offset_segments, polyline_segments
+from feature_store import FeatureTable
+
+
+def square_segments(half=10.0):
+    corners = np.array([[-half, -half], [half, -half], [half, half], [-half, half], [-half, -half]])
+    return corners[:-1, 0], corners[:-1, 1], corners[1:, 0], corners[1:, 1]
+
+
+def test_rays_from_the_centre_hit_the_square_at_the_right_distance():
+    grid = SegmentGrid(*square_segments(), cell_size=1.0)
+    angle = np.radians(np.arange(0, 360, 7.5))
+    dx, dy = np.cos(angle), np.sin(angle)
+    distance = cast_rays(grid, np.zeros(angle.size), np.zeros(angle.size), dx, dy, max_distance=100.0, first_ring=2.0)
+    expected = 10.0 / np.maximum(np.abs(dx), np.abs(dy)) # distance to the nearest side along the ray
+    np.testing.assert_allclose(distance, expected, rtol=1e-9)
+
+
+def test_rays_that_miss_or_hit_too_far_get_inf():
+    grid = SegmentGrid(*square_segments(), cell_size=1.0)
+    ox, oy = np.array([20.0, 0.0, -30.0]), np.array([0.0, 0.0, 0.0])
+    dx, dy = np.array([1.0, 1.0, 1.0]), np.array([0.0, 0.0, 0.0])
+    distance = cast_rays(grid, ox, oy, dx, dy, max_distance=15.0)
+    assert distance[0] == np.inf # pointing away from the square
+    assert distance[1] == pytest.approx(10.0)
+    assert distance[2] == np.inf # the square is 20 away, beyond max_distance
+
+
+def test_extend_lines_moves_both_ends_to_the_nearest_segment():
+    normals = FeatureTable("POLYLINE", [-1.0, 1.0, 0.0, 0.0], [0.0, 0.0, 5.0, 6.0], {"Normal": np.array([1, 2])}, [0, 2, 4])
+    extended, start, end = extend_lines(normals, square_segments(), max_distance=100.0)
+    np.testing.assert_allclose(extended.vertices(0)[0], [-10.0, 10.0])
+    np.testing.assert_allclose(extended.vertices(1)[1], [-10.0, 10.0])
+    assert start.all() and end.all()
+    np.testing.assert_array_equal(extended.fields["Normal"], [1, 2])
+
+
+def test_no_segment_crosses_the_gap_between_parts():
+    # one line with two parts, (0, 0)-(1, 0) and (5, 0)-(6, 0)-(7, 0), and a single part line
+    lines = FeatureTable("POLYLINE", [0, 1, 5, 6, 7, 0, 0], [0, 0, 0, 0, 0, 1, 2], offsets=[0, 5, 7], parts=[0, 2, 5, 7])
+    segments = np.column_stack(polyline_segments(lines))
+    np.testing.assert_array_equal(segments, [[0, 0, 1, 0], [5, 0, 6, 0], [6, 0, 7, 0], [0, 1, 0, 2]])
+    x0, y0, x1, y1 = offset_segments(lines, (1.0,))
+    assert x0.size == 4
+    assert not np.any((x0 < 2) & (x1 > 4)) # no offset segment bridges the gap either
+    reordered = lines.take([1, 0])
+    np.testing.assert_array_equal(reordered.parts, [0, 2, 4, 7])
+    np.testing.assert_array_equal(np.column_stack(polyline_segments(reordered)), segments[[3, 0, 1, 2]])
+
+
+def test_extend_lines_leaves_lines_of_one_point_alone():
+    # a one point line between two lines and one at the end of the table, which have no end segment to extend along
+    normals = FeatureTable("POLYLINE", [-1.0, 1.0, 3.0, 0.0, 0.0, 2.0], [0.0, 0.0, 3.0, 5.0, 6.0, 2.0], {"Normal": np.array([1, 2, 3, 4])}, [0, 2, 3, 5, 6])
+    extended, start, end = extend_lines(normals, square_segments(), max_distance=100.0)
+    np.testing.assert_array_equal(start, [True, False, True, False])
+    np.testing.assert_array_equal(end, [True, False, True, False])
+    np.testing.assert_allclose(extended.vertices(0)[0], [-10.0, 10.0])
+    np.testing.assert_allclose(extended.vertices(2)[1], [-10.0, 10.0])
+    assert extended.vertices(1)[0][0] == 3.0 and extended.vertices(3)[0][0] == 2.0
@@ -0,0 +1,81 @@
+# Streaming statistics (grid_stats.py) against NumPy computed over all values at once.
+
+import numpy as np
+import pytest
+
+from grid_io import ArrayGrid, GridDefinition
+from grid_stats import ErrorHistogram, RunningStats, ZonalStats, compare_grids
+
+
+def test_running_stats_merged_from_blocks_matches_numpy():
+    rng = np.random.default_rng(0)
+    values = rng.normal(1000.0, 0.25, 100000) # large common offset, where summing squares loses precision
+    stats, other = RunningStats(), RunningStats()
+    for block in np.array_split(values[:60000], 7):
+        stats.add(block)
+    other.add(values[60000:])
+    other.add(np.empty(0))
+    stats.merge(other)
+    assert stats.count == values.size
+    assert stats.bias == pytest.approx(values.mean(), rel=1e-12)
+    assert stats.std == pytest.approx(values.std(), rel=1e-9)
+    assert stats.rmse == pytest.approx(np.sqrt(np.mean(values ** 2)), rel=1e-12)
+
+
+def test_zonal_stats_match_numpy_per_zone_and_pooled():
+    rng = np.random.default_rng(1)
+    labels = rng.integers(0, 4, size=(60, 80)) # 0 is outside every zone
+    diff = rng.normal(0.5, 2.0, size=labels.shape)
+    diff[rng.random(labels.shape) < 0.1] = np.nan
+    halves = ZonalStats(labels), ZonalStats(labels)
+    halves[0].add_block(diff[:25], None, (0, 0, 25, 80))
+    halves[1].add_block(diff[25:], None, (25, 0, 35, 80))
+    halves[0].merge(halves[1])
+    table = halves[0].table()
+    for zone in (1, 2, 3):
+        values = diff[(labels == zone) & ~np.isnan(diff)]
+        row = list(table["zone"]).index(zone)
+        assert table["count"][row] == values.size
+        assert table["bias"][row] == pytest.approx(values.mean())
+        assert table["std"][row] == pytest.approx(values.std())
+        assert table["rmse"][row] == pytest.approx(np.sqrt(np.mean(values ** 2)))
+    inside = diff[(labels > 0) & ~np.isnan(diff)]
+    pooled = halves[0].pooled()
+    assert pooled.count == inside.size
+    assert pooled.std == pytest.approx(inside.std())
+    assert pooled.rmse == pytest.approx(np.sqrt(np.mean(inside ** 2)))
+
+
+def test_compare_grids_matches_numpy_difference():
+    rng = np.random.default_rng(2)
+    definition = GridDefinition(0.0, 10.0, 0.1, 0.1, 100, 130)
+    truth = rng.normal(size=definition.shape)
+    other = truth + rng.normal(0.1, 0.3, size=definition.shape)
+    other[:5] = -9999.0
+    stats = RunningStats()
+    compare_grids(ArrayGrid(truth, definition), ArrayGrid(other, definition, nodata=-9999.0), [stats], block_size=32)
+    diff = (truth - other)[5:]
+    assert stats.count == diff.size
+    assert stats.bias == pytest.approx(diff.mean())
+    assert stats.rmse == pytest.approx(np.sqrt(np.mean(diff ** 2)))
+
+
+def test_histogram_median_and_nmad_within_a_bin():
+    rng = np.random.default_rng(3)
+    values = np.concatenate([rng.normal(0.3, 0.5, 200000), rng.normal(4.0, 0.1, 20000)]) # skewed by a second mode
+    histogram, other = ErrorHistogram(bin_width=0.001, limit=50.0), ErrorHistogram(bin_width=0.001, limit=50.0)
+    histogram.add(values[:100000])
+    other.add(values[100000:])
+    histogram.merge(other)
+    median = np.median(values)
+    assert histogram.count == values.size
+    assert histogram.median == pytest.approx(median, abs=0.001)
+    assert histogram.nmad == pytest.approx(1.4826 * np.median(np.abs(values - median)), abs=2 * 1.4826 * 0.001)
+    assert histogram.percentile(90, absolute=True) == pytest.approx(np.percentile(np.abs(values), 90), abs=0.001)
+
+
+def test_histogram_counts_clipped_values_in_the_outer_bins():
+    histogram = ErrorHistogram(bin_width=0.01, limit=1.0)
+    histogram.add(np.array([-5.0, 0.0, 0.5, 7.0]))
+    assert histogram.clipped == 2
+    assert histogram.count == 4
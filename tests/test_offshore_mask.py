@@ -0,0 +1,89 @@
+# Offshore mask (offshore_mask.py) against brute force great circle distances from every cell to every land cell.
+
+import numpy as np
+
+from grid_io import GridDefinition
+from offshore_mask import PackedMask, PolygonRows, cached_offshore_mask, land_mask, offshore_mask
+from rasterize import polygon_mask
+
+
+EARTH_RADIUS = 6371008.8 # mean radius (m); the mask uses the WGS 84 ellipsoid, so distances close to the buffer distance are not compared
+
+
+def haversine_to_land(land, definition):
+    rows, cols = np.indices(definition.shape)
+    latitude = np.radians(definition.y_max - (rows + 0.5) * definition.cell_height)
+    longitude = np.radians(definition.x_min + (cols + 0.5) * definition.cell_width)
+    distance = np.full(definition.shape, np.inf)
+    for lat, lon in zip(latitude[land], longitude[land]):
+        h = np.sin((latitude - lat) / 2) ** 2 + np.cos(latitude) * np.cos(lat) * np.sin((longitude - lon) / 2) ** 2
+        distance = np.minimum(distance, 2 * EARTH_RADIUS * np.arcsin(np.sqrt(h)))
+    return distance
+
+
+def global_band():
+    definition = GridDefinition(-180.0, 40.0, 0.25, 0.25, 240, 1440) # all the way around the world, 40 N to 20 S
+    land = np.zeros(definition.shape, dtype=bool)
+    land[100:104, 1437:1440] = True # at the 180th meridian, so the mask has to wrap
+    land[30, 700] = True
+    land[200:210, 300] = True
+    return land, definition
+
+
+def assert_matches(mask, land, distance_to_land, distance):
+    clear = np.abs(distance_to_land - distance) > 0.02 * distance # away from the edge of the buffer
+    expected = (distance_to_land > distance) & ~land
+    assert clear.sum() > 0.9 * land.size
+    np.testing.assert_array_equal(mask[clear], expected[clear])
+
+
+def test_mask_matches_great_circle_distances_across_the_180th_meridian():
+    land, definition = global_band()
+    distance = 60000.0
+    mask = offshore_mask(land, definition, distance, band_rows=50)
+    distance_to_land = haversine_to_land(land, definition)
+    assert_matches(mask, land, distance_to_land, distance)
+    assert not mask[100:104, :2].any() # just east of the meridian, next to the land on its west side
+
+
+def test_mask_without_wrap_ignores_land_across_the_grid_edge():
+    land, definition = global_band()
+    mask = offshore_mask(land, definition, 60000.0, wrap=False)
+    assert mask[100:104, :2].all()
+
+
+def test_projected_grid_matches_euclidean_distances():
+    definition = GridDefinition(0.0, 5000.0, 50.0, 50.0, 100, 120)
+    rng = np.random.default_rng(4)
+    land = rng.random(definition.shape) < 0.002
+    mask = offshore_mask(land, definition, 400.0, geographic=False, band_rows=17)
+    rows, cols = np.nonzero(land)
+    r, c = np.indices(definition.shape)
+    distance_to_land = np.min(np.hypot((r[..., None] - rows) * 50.0, (c[..., None] - cols) * 50.0), axis=-1)
+    np.testing.assert_array_equal(mask, distance_to_land > 400.0) # separable transform is exact on a planar grid
+
+
+def test_coverage_packed_and_cached_masks_agree(tmp_path):
+    definition = GridDefinition(-10.0, 10.0, 0.1, 0.1, 200, 200)
+    island = [(1, [np.array([[-2.0, -2.0], [2.0, -2.0], [2.0, 2.0], [-2.0, 2.0], [-2.0, -2.0]])])]
+    coverage = [(1, [np.array([[-10.0, -10.0], [5.0, -10.0], [5.0, 10.0], [-10.0, 10.0], [-10.0, -10.0]])])]
+    built = cached_offshore_mask(island, definition, 50000.0, coverage, cache=str(tmp_path))
+    cached = cached_offshore_mask(island, definition, 50000.0, coverage, cache=str(tmp_path))
+    uncached = cached_offshore_mask(island, definition, 50000.0, coverage)
+    np.testing.assert_array_equal(built.unpack(), cached.unpack())
+    np.testing.assert_array_equal(built.unpack(), uncached.unpack())
+    mask = uncached.unpack()
+    assert not mask[:, 150:].any() # outside the coverage
+    assert not mask[80:120, 80:120].any() # on and next to the island
+    assert mask[:20, :20].all()
+    np.testing.assert_array_equal(PackedMask(mask).read(13, 37, 50, 61), mask[13:63, 37:98])
+
+
+def test_mask_built_band_by_band_from_polygons_matches_the_whole_grid():
+    definition = GridDefinition(-180.0, 60.0, 0.5, 0.5, 240, 720)
+    land = [(1, [np.array([[-30.0, -20.0], [25.0, -35.0], [40.0, 30.0], [-20.0, 45.0]])]), (2, [np.array([[170.0, 0.0], [179.9, 0.0], [179.9, 10.0]])])]
+    coverage = [(1, [np.array([[-180.0, -50.0], [180.0, -50.0], [180.0, 50.0], [-180.0, 50.0]])])]
+    whole = offshore_mask(land_mask(land, definition), definition, 300000.0, coverage=polygon_mask(coverage, definition))
+    banded = offshore_mask(PolygonRows(land, definition), definition, 300000.0, coverage=PolygonRows(coverage, definition), band_rows=23, packed=True)
+    assert isinstance(banded, PackedMask)
+    np.testing.assert_array_equal(banded.unpack(), whole)
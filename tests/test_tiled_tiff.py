@@ -0,0 +1,115 @@
+# Tiled GeoTIFFs (tiled_tiff.py) written and read back.
+
+import struct
+
+import numpy as np
+import pytest
+
+import grid_io
+from grid_io import GridDefinition, open_grid, save_grid
+from tiled_tiff import (ASCII, BITS_PER_SAMPLE, COMPRESSION, DOUBLE, GDAL_NODATA, IMAGE_LENGTH, IMAGE_WIDTH, LONG, MODEL_TRANSFORMATION, SAMPLE_FORMAT,
+                        SAMPLES_PER_PIXEL, SHORT, TILE_BYTE_COUNTS, TILE_LENGTH, TILE_OFFSETS, TILE_WIDTH, TiledTiff, geo_tags, is_tiled_tiff, tile_windows,
+                        write_ifd, write_tiled_tiff)
+
+
+def sample_grid(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    array = rng.normal(size=shape).astype(np.float32)
+    array[rng.random(shape) < 0.05] = np.nan
+    return array
+
+
+def test_round_trip_keeps_cells_nodata_and_georeferencing(tmp_path):
+    array = sample_grid((300, 517)) # not a multiple of the tile size
+    definition = GridDefinition(-180.0, 90.0, 0.25, 0.2, 300, 517)
+    path = str(tmp_path / "grid.tif")
+    write_tiled_tiff(array, definition, path, tile_size=64, workers=2)
+    tiff = TiledTiff(path)
+    assert tiff.definition == definition
+    np.testing.assert_array_equal(tiff.read(0, 0, 300, 517), array) # NaN compares equal
+    np.testing.assert_array_equal(tiff.read(70, 130, 45, 200), array[70:115, 130:330])
+    np.testing.assert_array_equal(tiff.window(100, 200, 10, 10).read(2, 3, 4, 5), array[102:106, 203:208])
+
+
+def test_overview_is_the_mean_of_the_valid_cells(tmp_path):
+    array = sample_grid((128, 192), seed=1)
+    definition = GridDefinition(0.0, 10.0, 0.5, 0.5, 128, 192)
+    path = str(tmp_path / "grid.tif")
+    write_tiled_tiff(array, definition, path, tile_size=32, overviews=2)
+    level = TiledTiff(path).overview(1)
+    assert level.definition.shape == (64, 96)
+    assert level.definition.cell_width == 1.0
+    blocks = array.reshape(64, 2, 96, 2).astype(np.float64)
+    count = (~np.isnan(blocks)).sum(axis=(1, 3))
+    total = np.nansum(blocks, axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = np.where(count > 0, total / count, np.nan)
+    np.testing.assert_allclose(level.read(0, 0, 64, 96), expected, rtol=1e-6)
+
+
+def test_save_grid_and_open_grid_round_trip(tmp_path):
+    array = np.arange(50 * 40, dtype=np.float32).reshape(50, 40)
+    array[0, 0] = -9999.0
+    definition = GridDefinition(500000.0, 4200000.0, 10.0, 10.0, 50, 40)
+    path = str(tmp_path / "grid.tif")
+    save_grid(array, definition, path, nodata=-9999.0)
+    grid = open_grid(path)
+    assert grid.definition == definition
+    block = grid.read(0, 0, 50, 40)
+    assert np.isnan(block[0, 0])
+    np.testing.assert_array_equal(block.ravel()[1:], array.ravel()[1:])
+
+
+# Tiled GeoTIFF as another tool would write it: uncompressed tiles, NoData as a number and a sparse (not stored) tile
+def write_foreign_tiff(path, array, definition, tile_size=16, nodata=b"-9999\x00", compression=1, extra_tags=()):
+    tiles = list(tile_windows(array.shape, tile_size))
+    with open(path, "wb") as tiff:
+        tiff.write(b"II\x2a\x00" + b"\x00" * 4)
+        offsets, counts = [], []
+        for number, (row0, col0, nrows, ncols) in enumerate(tiles):
+            if number == 1: # sparse tile
+                offsets.append(0)
+                counts.append(0)
+                continue
+            block = np.full((tile_size, tile_size), np.nan, dtype="<f4")
+            block[:nrows, :ncols] = array[row0:row0 + nrows, col0:col0 + ncols]
+            offsets.append(tiff.tell())
+            counts.append(block.nbytes)
+            tiff.write(block.tobytes())
+        ifd = tiff.tell()
+        tags = [(IMAGE_WIDTH, LONG, [array.shape[1]]), (IMAGE_LENGTH, LONG, [array.shape[0]]), (BITS_PER_SAMPLE, SHORT, [32]), (COMPRESSION, SHORT, [compression]),
+                (SAMPLES_PER_PIXEL, SHORT, [1]), (TILE_WIDTH, SHORT, [tile_size]), (TILE_LENGTH, SHORT, [tile_size]), (TILE_OFFSETS, LONG, offsets),
+                (TILE_BYTE_COUNTS, LONG, counts), (SAMPLE_FORMAT, SHORT, [3]), (GDAL_NODATA, ASCII, nodata)] + geo_tags(definition) + list(extra_tags)
+        write_ifd(tiff, sorted(tags), False)
+        tiff.seek(4)
+        tiff.write(struct.pack("<I", ifd))
+
+
+def test_foreign_tiff_with_nodata_value_and_sparse_tile(tmp_path):
+    array = np.arange(40 * 50, dtype=np.float32).reshape(40, 50)
+    array[5:9, 30:40] = -9999.0
+    definition = GridDefinition(10.0, 50.0, 0.5, 0.5, 40, 50)
+    path = str(tmp_path / "foreign.tif")
+    write_foreign_tiff(path, array, definition)
+    grid = open_grid(path)
+    assert isinstance(grid, TiledTiff)
+    assert grid.nodata == -9999.0
+    block = grid.read(0, 0, 40, 50)
+    expected = array.copy()
+    expected[array == -9999.0] = np.nan
+    expected[:16, 16:32] = np.nan # the sparse tile
+    np.testing.assert_array_equal(block, expected)
+
+
+def test_tiffs_in_other_layouts_are_left_to_arcpy(tmp_path, monkeypatch):
+    monkeypatch.setattr(grid_io, "ArcpyGrid", lambda path: ("arcpy", path)) # ArcPy itself is not needed to see where the file goes
+    array = np.ones((20, 20), dtype=np.float32)
+    definition = GridDefinition(0.0, 20.0, 1.0, 1.0, 20, 20)
+    lzw, rotated = str(tmp_path / "lzw.tif"), str(tmp_path / "rotated.tif")
+    write_foreign_tiff(lzw, array, definition, compression=5)
+    write_foreign_tiff(rotated, array, definition, extra_tags=[(MODEL_TRANSFORMATION, DOUBLE, [1.0, 0.5, 0, 0, 0.5, -1.0, 0, 20] + [0.0] * 7 + [1.0])])
+    for path in (lzw, rotated):
+        assert not is_tiled_tiff(path)
+        assert open_grid(path) == ("arcpy", path)
+        with pytest.raises(ValueError):
+            TiledTiff(path)
@@ -0,0 +1,286 @@
+# Tiled, compressed GeoTIFF output (and input) for large grids such as the global MSS and TSS grids of MSS_TSS_final.py.
+# A geodatabase raster has to be read whole by tools outside ArcGIS that only need a small region (e.g. VDatum sampling a few points). These files are instead cut
+# into square tiles (256 x 256 cells by default), each compressed on its own with Deflate (zlib) after the floating point predictor (bytes of each row regrouped by
+# significance and differenced, which compresses smooth surfaces much better). The tile offsets and sizes stored in the file are the tile index: a reader seeks to
+# the tiles covering the cells it needs and decompresses only those.
+# Overviews (each half the resolution of the level before, the mean of the valid cells of every 2 x 2 block) are stored after the full resolution grid as reduced
+# resolution images, so a coarse view of the whole world reads a few tiles instead of the full grid.
+# The files are standard GeoTIFFs (float32 cells, NaN as NoData with the GDAL_NODATA tag, WGS 84 geographic by default), so GDAL, QGIS and ArcGIS Pro read them too.
+# Tiles are compressed by a pool of threads (zlib releases the GIL), and files that could go past 4 GB are written as BigTIFF.
+
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from grid_io import GridDefinition, GridWindow
+
+
+# TIFF field types: code -> (struct format, size in bytes)
+FIELD_TYPES = {2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 12: ("d", 8), 16: ("Q", 8)}
+ASCII, SHORT, LONG, DOUBLE, LONG8 = 2, 3, 4, 12, 16
+
+# Tags used here
+NEW_SUBFILE_TYPE, IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION, PHOTOMETRIC = 254, 256, 257, 258, 259, 262
+SAMPLES_PER_PIXEL, PLANAR_CONFIGURATION, PREDICTOR, TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS, SAMPLE_FORMAT = 277, 284, 317, 322, 323, 324, 325, 339
+MODEL_PIXEL_SCALE, MODEL_TIEPOINT, MODEL_TRANSFORMATION, GEO_KEY_DIRECTORY, GDAL_NODATA = 33550, 33922, 34264, 34735, 42113
+
+
+# Write a grid (2-D array, e.g. a memory mapped .npy grid) as a tiled, Deflate compressed GeoTIFF with overviews.
+# NaN cells are NoData. overviews: number of reduced resolution levels (None: halve until the whole grid fits in one tile). epsg: 4326 for latitude/longitude
+# grids, or the EPSG code of a projected coordinate system. compression_level: zlib level (1 fastest to 9 smallest). workers: threads compressing tiles (None: one per core).
+def write_tiled_tiff(array, definition, path, tile_size=256, overviews=None, epsg=4326, compression_level=6, workers=None, bigtiff=None):
+    if tile_size % 16:
+        raise ValueError("Tile size must be a multiple of 16")
+    levels = [array]
+    while (overviews is None and max(levels[-1].shape) > tile_size) or (overviews is not None and len(levels) <= overviews):
+        if min(levels[-1].shape) < 2:
+            break
+        levels.append(overview(levels[-1]))
+    if bigtiff is None: # uncompressed size as an upper bound of the file size
+        bigtiff = sum(level_array.size for level_array in levels) * 4 > 2 ** 32 - 2 ** 28
+    workers = workers or os.cpu_count() or 1
+
+    with open(path, "wb") as tiff, ThreadPoolExecutor(max_workers=workers) as pool:
+        tiff.write(b"II\x2b\x00\x08\x00\x00\x00" + b"\x00" * 8 if bigtiff else b"II\x2a\x00" + b"\x00" * 4) # header, first IFD offset filled in at the end
+        index = [] # (offsets, byte counts) of the tiles of every level
+        for level_array in levels:
+            offsets, counts = [], []
+            tiles = list(tile_windows(level_array.shape, tile_size))
+            for start in range(0, len(tiles), 4 * workers): # a few tiles per thread at a time, written in order
+                batch = tiles[start:start + 4 * workers]
+                for data in pool.map(lambda tile: encode_tile(level_array, tile, tile_size, compression_level), batch):
+                    offsets.append(tiff.tell())
+                    counts.append(len(data))
+                    tiff.write(data)
+            index.append((offsets, counts))
+
+        # Image file directories (one per level), chained after the tile data
+        ifd_offsets, next_fields = [], [] # where every IFD starts and where its next IFD offset is stored
+        for number, (level_array, (offsets, counts)) in enumerate(zip(levels, index)):
+            if tiff.tell() % 2:
+                tiff.write(b"\x00") # IFDs start on a word boundary
+            ifd_offsets.append(tiff.tell())
+            tags = [(NEW_SUBFILE_TYPE, LONG, [1 if number else 0]), (IMAGE_WIDTH, LONG, [level_array.shape[1]]), (IMAGE_LENGTH, LONG, [level_array.shape[0]]),
+                    (BITS_PER_SAMPLE, SHORT, [32]), (COMPRESSION, SHORT, [8]), (PHOTOMETRIC, SHORT, [1]), (SAMPLES_PER_PIXEL, SHORT, [1]),
+                    (PLANAR_CONFIGURATION, SHORT, [1]), (PREDICTOR, SHORT, [3]), (TILE_WIDTH, SHORT, [tile_size]), (TILE_LENGTH, SHORT, [tile_size]),
+                    (TILE_OFFSETS, LONG8 if bigtiff else LONG, offsets), (TILE_BYTE_COUNTS, LONG8 if bigtiff else LONG, counts), (SAMPLE_FORMAT, SHORT, [3])]
+            if number == 0: # georeferencing of the full resolution grid
+                tags += geo_tags(definition, epsg)
+            tags.append((GDAL_NODATA, ASCII, b"nan\x00"))
+            next_fields.append(write_ifd(tiff, sorted(tags), bigtiff))
+        for field, next_offset in zip([4] + next_fields[:-1], ifd_offsets): # link the header to the first IFD and every IFD to the next one
+            tiff.seek(8 if bigtiff and field == 4 else field)
+            tiff.write(struct.pack("<Q" if bigtiff else "<I", next_offset))
+
+
+# Half resolution version of a grid: mean of the valid (not NaN) cells of every 2 x 2 block, NaN where a block has none. Done in strips of rows.
+def overview(array, strip_rows=2048):
+    nrows, ncols = (array.shape[0] + 1) // 2, (array.shape[1] + 1) // 2
+    out = np.empty((nrows, ncols), dtype=np.float32)
+    for row0 in range(0, nrows, strip_rows // 2):
+        rows = min(strip_rows // 2, nrows - row0)
+        block = np.full((2 * rows, 2 * ncols), np.nan, dtype=np.float64)
+        source = np.asarray(array[2 * row0:2 * (row0 + rows)], dtype=np.float64)
+        block[:source.shape[0], :source.shape[1]] = source
+        block = block.reshape(rows, 2, ncols, 2)
+        valid = ~np.isnan(block)
+        count = valid.sum(axis=(1, 3))
+        total = np.where(valid, block, 0.0).sum(axis=(1, 3))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[row0:row0 + rows] = np.where(count > 0, total / count, np.nan)
+    return out
+
+
+# (row0, col0, rows, columns) of the tiles of an image, row by row
+def tile_windows(shape, tile_size):
+    for row0 in range(0, shape[0], tile_size):
+        for col0 in range(0, shape[1], tile_size):
+            yield row0, col0, min(tile_size, shape[0] - row0), min(tile_size, shape[1] - col0)
+
+
+# Compressed bytes of one tile: padded to the full tile size with NaN, floating point predictor, then Deflate
+def encode_tile(array, tile, tile_size, compression_level=6):
+    row0, col0, nrows, ncols = tile
+    block = np.full((tile_size, tile_size), np.nan, dtype="<f4")
+    block[:nrows, :ncols] = array[row0:row0 + nrows, col0:col0 + ncols]
+    return zlib.compress(predict(block).tobytes(), compression_level)
+
+
+# Floating point predictor (TIFF predictor 3): the bytes of each row are regrouped most significant first, then every byte is replaced by its difference with the one before
+def predict(block):
+    rows, cols = block.shape
+    planes = block.astype("<f4").view(np.uint8).reshape(rows, cols, 4)[:, :, ::-1].transpose(0, 2, 1).reshape(rows, 4 * cols)
+    difference = planes.copy()
+    difference[:, 1:] -= planes[:, :-1] # uint8 arithmetic wraps around, as the predictor expects
+    return difference
+
+
+# Inverse of predict: float32 block from the predicted bytes (rows x 4 * columns)
+def unpredict(data, rows, cols):
+    planes = np.cumsum(data.reshape(rows, 4 * cols), axis=1, dtype=np.uint8)
+    return np.ascontiguousarray(planes.reshape(rows, 4, cols).transpose(0, 2, 1)[:, :, ::-1]).view("<f4").reshape(rows, cols)
+
+
+# GeoTIFF tags: cell size, upper left corner tied to the first cell, and the coordinate system (geographic or projected EPSG code), cells are areas
+def geo_tags(definition, epsg=4326):
+    scale = [float(definition.cell_width), float(definition.cell_height), 0.0]
+    tiepoint = [0.0, 0.0, 0.0, float(definition.x_min), float(definition.y_max), 0.0]
+    geographic = epsg == 4326 or 4000 <= epsg < 5000
+    keys = [1, 1, 0, 3, # version 1.1.0, 3 keys
+            1024, 0, 1, 2 if geographic else 1, # GTModelTypeGeoKey: geographic or projected
+            1025, 0, 1, 1, # GTRasterTypeGeoKey: PixelIsArea
+            2048 if geographic else 3072, 0, 1, epsg] # GeographicTypeGeoKey or ProjectedCSTypeGeoKey
+    return [(MODEL_PIXEL_SCALE, DOUBLE, scale), (MODEL_TIEPOINT, DOUBLE, tiepoint), (GEO_KEY_DIRECTORY, SHORT, keys)]
+
+
+# Write an IFD at the current position: entry count, entries (values that do not fit in an entry go right after the IFD) and a 0 next IFD offset.
+# Returns the file position of the next IFD offset.
+def write_ifd(tiff, tags, bigtiff):
+    start = tiff.tell()
+    entry_size, inline = (20, 8) if bigtiff else (12, 4)
+    count_format, next_format, offset_format = ("<Q", "<Q", "<Q") if bigtiff else ("<H", "<I", "<I")
+    ifd_size = struct.calcsize(count_format) + entry_size * len(tags) + struct.calcsize(next_format)
+    entries, extra = [], b""
+    for tag, field_type, values in tags:
+        value_format, value_size = FIELD_TYPES[field_type]
+        data = values if field_type == ASCII else struct.pack("<" + str(len(values)) + value_format, *values)
+        count = len(values)
+        if len(data) <= inline:
+            field = data.ljust(inline, b"\x00")
+        else:
+            field = struct.pack(offset_format, start + ifd_size + len(extra))
+            extra += data + (b"\x00" if len(data) % 2 else b"")
+        entries.append(struct.pack("<HH" + ("Q" if bigtiff else "I"), tag, field_type, count) + field)
+    tiff.write(struct.pack(count_format, len(tags)) + b"".join(entries) + struct.pack(next_format, 0) + extra)
+    return start + ifd_size - struct.calcsize(next_format)
+
+
+# Grid backed by a tiled GeoTIFF written by write_tiled_tiff (float32, Deflate or no compression, floating point or no predictor), or by another tool with the
+# same layout (see unsupported). Only the tiles covering a requested window are read and decompressed, found through the tile index. level selects an overview
+# (0 is full resolution). Cells equal to the GDAL_NODATA value and the cells of sparse tiles (not stored, offset or byte count 0) are NoData (NaN).
+class TiledTiff:
+
+    def __init__(self, path, level=0): # (path of the .tif file, resolution level)
+        self.path = path
+        self.level = level
+        self.order, self.levels = read_ifds(path)
+        self.tags = self.levels[level]
+        reason = unsupported(self.levels[0]) or unsupported(self.tags, georeferenced=False)
+        if reason:
+            raise ValueError(str(path) + " can not be read tile by tile: " + reason)
+        self.nodata = nodata_value(self.tags.get(GDAL_NODATA, self.levels[0].get(GDAL_NODATA))) # NaN cells are NoData too
+        scale, tiepoint = self.levels[0][MODEL_PIXEL_SCALE], self.levels[0][MODEL_TIEPOINT]
+        full_rows, full_cols = self.levels[0][IMAGE_LENGTH][0], self.levels[0][IMAGE_WIDTH][0]
+        nrows, ncols = self.tags[IMAGE_LENGTH][0], self.tags[IMAGE_WIDTH][0]
+        cell_width, cell_height = scale[0] * full_cols / float(ncols), scale[1] * full_rows / float(nrows) # overviews cover the same extent with fewer cells
+        x_min, y_max = tiepoint[3] - tiepoint[0] * scale[0], tiepoint[4] + tiepoint[1] * scale[1]
+        self.definition = GridDefinition(x_min, y_max, cell_width, cell_height, nrows, ncols)
+        self.tile_size = (self.tags[TILE_LENGTH][0], self.tags[TILE_WIDTH][0])
+        self.tiles_across = -(-ncols // self.tile_size[1])
+
+    def overview(self, level): # the same file at another resolution level
+        return TiledTiff(self.path, level)
+
+    def read_tile(self, tile_row, tile_col): # one decompressed tile (full tile size) as float32
+        number = tile_row * self.tiles_across + tile_col
+        rows, cols = self.tile_size
+        if not self.tags[TILE_OFFSETS][number] or not self.tags[TILE_BYTE_COUNTS][number]: # sparse tile, not stored
+            return np.full((rows, cols), np.nan, dtype=np.float32)
+        with open(self.path, "rb") as tiff:
+            tiff.seek(self.tags[TILE_OFFSETS][number])
+            data = tiff.read(self.tags[TILE_BYTE_COUNTS][number])
+        if self.tags.get(COMPRESSION, [1])[0] == 8:
+            data = zlib.decompress(data)
+        if self.tags.get(PREDICTOR, [1])[0] == 3:
+            return unpredict(np.frombuffer(data, dtype=np.uint8), rows, cols)
+        return np.frombuffer(data, dtype=self.order + "f4").reshape(rows, cols)
+
+    def read(self, row0, col0, nrows, ncols): # read a window as floats with NaN in NoData cells
+        block = np.empty((nrows, ncols), dtype=np.float32)
+        tile_rows, tile_cols = self.tile_size
+        for tile_row in range(row0 // tile_rows, (row0 + nrows - 1) // tile_rows + 1):
+            for tile_col in range(col0 // tile_cols, (col0 + ncols - 1) // tile_cols + 1):
+                tile = self.read_tile(tile_row, tile_col)
+                top, left = tile_row * tile_rows, tile_col * tile_cols # first cell of the tile
+                r0, r1 = max(row0, top), min(row0 + nrows, top + tile_rows)
+                c0, c1 = max(col0, left), min(col0 + ncols, left + tile_cols)
+                block[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = tile[r0 - top:r1 - top, c0 - left:c1 - left]
+        if self.nodata is not None:
+            block[block == np.float32(self.nodata)] = np.nan
+        return block
+
+    def window(self, row0, col0, nrows, ncols):
+        return GridWindow(self, row0, col0, nrows, ncols)
+
+
+# Byte order ("<" or ">") and the tags of every IFD of a TIFF (classic or BigTIFF) as a list of {tag: list of values (bytes for ASCII)}
+def read_ifds(path):
+    with open(path, "rb") as tiff:
+        header = tiff.read(16)
+        order = "<" if header[:2] == b"II" else ">"
+        version = struct.unpack(order + "H", header[2:4])[0]
+        bigtiff = version == 43
+        if header[:2] not in (b"II", b"MM") or version not in (42, 43):
+            raise ValueError(str(path) + " is not a TIFF file")
+        offset = struct.unpack(order + "Q", header[8:16])[0] if bigtiff else struct.unpack(order + "I", header[4:8])[0]
+        entry_format = order + ("HHQ" if bigtiff else "HHI")
+        entry_size, inline = (20, 8) if bigtiff else (12, 4)
+        ifds = []
+        while offset:
+            tiff.seek(offset)
+            count = struct.unpack(order + ("Q" if bigtiff else "H"), tiff.read(8 if bigtiff else 2))[0]
+            raw = tiff.read(entry_size * count + (8 if bigtiff else 4))
+            tags = {}
+            for i in range(count):
+                entry = raw[i * entry_size:(i + 1) * entry_size]
+                tag, field_type, n = struct.unpack(entry_format, entry[:struct.calcsize(entry_format)])
+                if field_type not in FIELD_TYPES:
+                    continue
+                value_format, value_size = FIELD_TYPES[field_type]
+                field = entry[struct.calcsize(entry_format):]
+                if n * value_size <= inline:
+                    data = field[:n * value_size]
+                else:
+                    position = tiff.tell()
+                    tiff.seek(struct.unpack(order + ("Q" if bigtiff else "I"), field)[0])
+                    data = tiff.read(n * value_size)
+                    tiff.seek(position)
+                tags[tag] = data if field_type == ASCII else list(struct.unpack(order + str(n) + value_format, data))
+            ifds.append(tags)
+            offset = struct.unpack(order + ("Q" if bigtiff else "I"), raw[-(8 if bigtiff else 4):])[0]
+    return order, ifds
+
+
+# Why TiledTiff can not read an image with these tags, or None if it can: it has to be laid out like the files write_tiled_tiff writes (tiled, one float32
+# sample per cell, no or Deflate compression, no or floating point predictor) and, for the full resolution image, georeferenced by a cell size and a tiepoint
+# (not a ModelTransformation matrix, which can rotate the grid)
+def unsupported(tags, georeferenced=True):
+    checks = [(all(tag in tags for tag in (TILE_OFFSETS, TILE_BYTE_COUNTS, TILE_WIDTH, TILE_LENGTH)), "not tiled"),
+              (tags.get(SAMPLE_FORMAT, [1])[0] == 3 and tags.get(BITS_PER_SAMPLE, [0])[0] == 32, "cells are not float32"),
+              (tags.get(SAMPLES_PER_PIXEL, [1])[0] == 1, "more than one band"),
+              (tags.get(COMPRESSION, [1])[0] in (1, 8), "compression " + str(tags.get(COMPRESSION, [1])[0]) + " (only none and Deflate are read)"),
+              (tags.get(PREDICTOR, [1])[0] in (1, 3), "predictor " + str(tags.get(PREDICTOR, [1])[0]))]
+    if georeferenced:
+        checks += [(MODEL_PIXEL_SCALE in tags and MODEL_TIEPOINT in tags, "no cell size and tiepoint"), (MODEL_TRANSFORMATION not in tags, "ModelTransformation")]
+    return next((reason for ok, reason in checks if not ok), None)
+
+
+# GDAL_NODATA tag (ASCII number) as a float, None when there is no tag or it is NaN (NaN cells are NoData anyway)
+def nodata_value(tag):
+    if tag is None:
+        return None
+    value = float(tag.rstrip(b"\x00").strip().decode("ascii"))
+    return None if np.isnan(value) else value
+
+
+# True if a file is a tiled TIFF that TiledTiff can read; other TIFFs (other compressions, band counts or cell types) are left to ArcPy
+def is_tiled_tiff(path):
+    try:
+        tags = read_ifds(path)[1][0]
+        nodata_value(tags.get(GDAL_NODATA))
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        return False
+    return unsupported(tags) is None